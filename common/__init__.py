@@ -0,0 +1,19 @@
+# Copyright 2018. Amazon Web Services, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Modules shared by the turbine and weather station programs (and myip_oled.py).
+# Both entry points put the repo root on sys.path and import them as common.<module>.
+# weather.py and myip_oled.py still run under Python 2, so everything in this
+# package has to stay Python 2 compatible: no f-strings, type hints, time.monotonic
+# or other Python 3 only APIs, and nothing from the turbine directory.
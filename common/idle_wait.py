@@ -0,0 +1,71 @@
+# Copyright 2018. Amazon Web Services, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+import time
+
+# Interrupt-driven wake from idle.
+# While the rotor is stopped the main loop waits here instead of sleeping in fixed
+# 5 second steps. The rotation sensor callback calls notify() on every pulse and
+# the wait returns as soon as wakePulses pulses have arrived, or with False after
+# heartbeatSec so a low-rate heartbeat frame still goes out while idle. Waking on
+# the second pulse means a full period has been seen and the first frame after
+# wake carries a valid speed.
+
+
+class IdleWaiter(object):
+    def __init__(self, wakePulses=2, clock=time.time):
+        self.wakePulses = wakePulses
+        self.clock = clock
+        self.condition = threading.Condition()
+        self.pulseCnt = 0
+        self.wakeCnt = 0
+        self.heartbeatCnt = 0
+        self.cancelled = False
+
+    def notify(self):
+        # called from the sensor interrupt callback on every pulse
+        with self.condition:
+            self.pulseCnt += 1
+            self.condition.notify_all()
+
+    def cancel(self):
+        # releases any waiter at shutdown
+        with self.condition:
+            self.cancelled = True
+            self.condition.notify_all()
+
+    def waitForMotion(self, heartbeatSec, pollFunc=None, pollSec=0.1):
+        # returns True once the rotor moves, False when the heartbeat interval ran out;
+        # pollFunc (button checks) is called every pollSec while waiting
+        deadline = self.clock() + heartbeatSec
+        with self.condition:
+            startCnt = self.pulseCnt
+            while self.pulseCnt - startCnt < self.wakePulses:
+                remaining = deadline - self.clock()
+                if remaining <= 0 or self.cancelled:
+                    self.heartbeatCnt += 1
+                    return False
+                if pollFunc is not None:
+                    remaining = min(remaining, pollSec)
+                self.condition.wait(remaining)
+                if pollFunc is not None and self.pulseCnt - startCnt < self.wakePulses:
+                    # the callback may block (brake moves), don't hold the lock for it
+                    self.condition.release()
+                    try:
+                        pollFunc()
+                    finally:
+                        self.condition.acquire()
+            self.wakeCnt += 1
+            return True
@@ -0,0 +1,254 @@
+# Copyright 2018. Amazon Web Services, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import struct
+from array import array
+from datetime import datetime
+
+# Payload encodings for the turbine and weather station messages.
+# The payload builders keep producing dicts; this module turns them into the bytes
+# that go on the wire using the encoding chosen per payload kind in the shadow
+# ('payload_encoding').
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None
+
+# Fixed-layout 'struct' encoding. Every message starts with the schema id and the
+# schema version, followed by the thing name, a bitmask of the fixed fields present
+# (version 2, report-by-exception frames leave fields out), the fixed fields of that
+# schema, the optional sample arrays and a length-prefixed JSON tail holding any
+# other fields. Bump the version whenever a layout changes so consumers can tell
+# them apart.
+structVersion = 2
+structHeader = '<BBB'
+structSchemas = {
+    'telemetry': {
+        'id': 1,
+        'version': structVersion,
+        'fields': [
+            ('deviceID', 'Q'),
+            ('timestamp', 'd'),
+            ('loop_cnt', 'I'),
+            ('turbine_speed', 'f'),
+            ('turbine_rev_cnt', 'I'),
+            ('turbine_voltage', 'f'),
+            ('turbine_vibe_x', 'f'),
+            ('turbine_vibe_y', 'f'),
+            ('turbine_vibe_z', 'f'),
+            ('turbine_vibe_peak', 'f'),
+            ('turbine_vibe_avg', 'f'),
+            ('turbine_vibe_rms', 'f'),
+            ('turbine_vibe_crest', 'f'),
+            ('turbine_vibe_kurtosis', 'f'),
+            ('turbine_sample_cnt', 'I'),
+            ('turbine_sample_rate', 'f'),
+            ('turbine_sample_jitter_ms', 'f'),
+            ('brake_pct', 'f')
+        ],
+        'arrays': []
+    },
+    'hires': {
+        'id': 2,
+        'version': structVersion,
+        'fields': [
+            ('deviceID', 'Q'),
+            ('timestamp', 'd'),
+            ('loop_cnt', 'I'),
+            ('sample_period_ms', 'f'),
+            ('sample_cnt', 'I')
+        ],
+        'arrays': ['turbine_vibe_x', 'turbine_vibe_y', 'turbine_vibe_z', 'turbine_vibe']
+    },
+    'hires_sample': {
+        'id': 3,
+        'version': structVersion,
+        'fields': [
+            ('deviceID', 'Q'),
+            ('timestamp', 'd'),
+            ('loop_cnt', 'I'),
+            ('turbine_vibe_x', 'f'),
+            ('turbine_vibe_y', 'f'),
+            ('turbine_vibe_z', 'f'),
+            ('turbine_vibe', 'f')
+        ],
+        'arrays': []
+    },
+    'weather': {
+        'id': 4,
+        'version': structVersion,
+        'fields': [
+            ('deviceID', 'Q'),
+            ('timestamp', 'd'),
+            ('loop_cnt', 'I'),
+            ('wind_speed', 'f')
+        ],
+        'arrays': []
+    }
+}
+structSchemaById = dict((schema['id'], kind) for kind, schema in structSchemas.items())
+structFieldPackers = dict((kind, struct.Struct('<' + ''.join(code for field, code in schema['fields'])))
+                          for kind, schema in structSchemas.items())
+
+epoch = datetime(1970, 1, 1)
+payloadEncodings = ['json', 'msgpack', 'cbor', 'struct']
+
+# encodings that were requested but are not installed are only reported once
+missingEncodingsReported = set()
+
+
+def availableEncodings():
+    encodings = ['json', 'struct']
+    if msgpack is not None:
+        encodings.append('msgpack')
+    if cbor2 is not None:
+        encodings.append('cbor')
+    return encodings
+
+
+def selectEncoding(setting, kind):
+    # the shadow setting is either one encoding for every topic or a dict by payload kind
+    if isinstance(setting, dict):
+        encoding = setting.get(kind, setting.get('default', 'json'))
+    else:
+        encoding = setting or 'json'
+    if encoding not in availableEncodings():
+        if encoding not in missingEncodingsReported:
+            missingEncodingsReported.add(encoding)
+            print("Payload encoding '" + str(encoding) + "' is not available, using json")
+        encoding = 'json'
+    return encoding
+
+
+def isoToEpoch(timestamp):
+    fmt = '%Y-%m-%dT%H:%M:%S.%f' if '.' in timestamp else '%Y-%m-%dT%H:%M:%S'
+    return (datetime.strptime(timestamp, fmt) - epoch).total_seconds()
+
+
+def epochToIso(seconds):
+    return str(datetime.utcfromtimestamp(seconds).isoformat())
+
+
+def packFloats(values):
+    packed = array('f', values)
+    if hasattr(packed, 'tobytes'):
+        return packed.tobytes()
+    return packed.tostring()
+
+
+def unpackFloats(data):
+    values = array('f')
+    if hasattr(values, 'frombytes'):
+        values.frombytes(data)
+    else:
+        values.fromstring(data)
+    return values.tolist()
+
+
+def encodeStruct(payload, kind):
+    schema = structSchemas[kind]
+    extra = dict(payload)
+    thingName = extra.pop('thing_name', '').encode('utf-8')
+
+    values = []
+    presentMask = 0
+    for bit, (field, code) in enumerate(schema['fields']):
+        if field in extra:
+            presentMask |= 1 << bit
+        value = extra.pop(field, 0)
+        if field == 'timestamp':
+            value = isoToEpoch(value) if value else 0
+        elif code in 'QI':
+            value = int(value)
+        else:
+            value = float(value)
+        values.append(value)
+
+    arrays = [extra.pop(name, []) for name in schema['arrays']]
+    tail = json.dumps(extra, separators=(',', ':')).encode('utf-8') if extra else b''
+
+    parts = [struct.pack(structHeader, schema['id'], schema['version'], len(thingName)), thingName,
+             struct.pack('<I', presentMask), structFieldPackers[kind].pack(*values)]
+    for samples in arrays:
+        parts.append(packFloats(samples))
+    parts.append(struct.pack('<H', len(tail)))
+    parts.append(tail)
+    return b''.join(parts)
+
+
+def decodeStruct(data):
+    schemaId, version, nameLen = struct.unpack_from(structHeader, data, 0)
+    kind = structSchemaById[schemaId]
+    schema = structSchemas[kind]
+    offset = struct.calcsize(structHeader)
+    payload = {'thing_name': data[offset:offset + nameLen].decode('utf-8')}
+    offset += nameLen
+
+    # version 1 frames had no presence mask and always carried every field
+    presentMask = 0xFFFFFFFF
+    if version >= 2:
+        presentMask = struct.unpack_from('<I', data, offset)[0]
+        offset += 4
+
+    fieldPacker = structFieldPackers[kind]
+    values = fieldPacker.unpack_from(data, offset)
+    offset += fieldPacker.size
+    for bit, ((field, code), value) in enumerate(zip(schema['fields'], values)):
+        if not presentMask & (1 << bit):
+            continue
+        if field == 'timestamp':
+            value = epochToIso(value)
+        elif field == 'deviceID':
+            value = str(value)
+        payload[field] = value
+
+    if schema['arrays']:
+        arrayLen = payload['sample_cnt'] * 4
+        for name in schema['arrays']:
+            payload[name] = unpackFloats(data[offset:offset + arrayLen])
+            offset += arrayLen
+
+    tailLen = struct.unpack_from('<H', data, offset)[0]
+    offset += 2
+    if tailLen:
+        payload.update(json.loads(data[offset:offset + tailLen].decode('utf-8')))
+    return payload
+
+
+def encodePayload(payload, kind, encoding='json'):
+    # kind is one of the structSchemas keys and selects the fixed layout for 'struct'
+    if encoding == 'msgpack':
+        return msgpack.packb(payload, use_bin_type=True, use_single_float=True)
+    if encoding == 'cbor':
+        return cbor2.dumps(payload)
+    if encoding == 'struct':
+        return encodeStruct(payload, kind)
+    return json.dumps(payload)
+
+
+def decodePayload(data, encoding='json'):
+    if encoding == 'msgpack':
+        return msgpack.unpackb(data, raw=False)
+    if encoding == 'cbor':
+        return cbor2.loads(data)
+    if encoding == 'struct':
+        return decodeStruct(data)
+    return json.loads(data)
@@ -0,0 +1,227 @@
+# Copyright 2018. Amazon Web Services, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import sqlite3
+import threading
+import time
+
+# Disk-backed store-and-forward for MQTT publishes.
+# Messages that cannot be sent while the connection is down go into a SQLite
+# database in WAL mode instead of the SDK's in-memory offline queue, so memory use
+# stays flat however long an outage lasts. Disk use is capped; once the cap is hit
+# the lowest priority, oldest messages are evicted first. Inserts are grouped into
+# one transaction (one fsync) per batch, committed once syncBatch messages or
+# syncIntervalSec have built up; the drainer's waits call commitIfDue() so the last
+# writes before the telemetry stops are not left uncommitted. A drainer thread
+# replays the backlog at a fixed rate once the connection comes back and deletes
+# each replayed batch in one transaction. close() stops and joins the queue's drainer
+# before closing the database, so a replay in progress never hits a closed
+# connection.
+
+
+class StoreForwardQueue(object):
+    def __init__(self, dbPath, maxBytes=50 * 1024 * 1024, syncBatch=50, syncIntervalSec=2.0):
+        self.dbPath = dbPath
+        self.maxBytes = maxBytes
+        self.syncBatch = syncBatch
+        self.syncIntervalSec = syncIntervalSec
+        self.lock = threading.Lock()
+        self.wakeEvent = threading.Event()
+        # set by the StoreForwardDrainer built on this queue
+        self.drainer = None
+        self.closed = False
+
+        # autocommit mode, transactions are opened and committed explicitly below
+        self.db = sqlite3.connect(dbPath, check_same_thread=False, isolation_level=None)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=FULL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS messages ('
+                        'id INTEGER PRIMARY KEY AUTOINCREMENT, '
+                        'priority INTEGER NOT NULL, '
+                        'topic TEXT NOT NULL, '
+                        'payload BLOB NOT NULL, '
+                        'qos INTEGER NOT NULL, '
+                        'size INTEGER NOT NULL, '
+                        'created REAL NOT NULL)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS messages_priority ON messages (priority, id)')
+
+        self.inTransaction = False
+        self.pendingWrites = 0
+        self.lastCommit = time.time()
+        self.totalBytes = self.db.execute('SELECT COALESCE(SUM(size), 0) FROM messages').fetchone()[0]
+        self.storedCnt = 0
+        self.evictedCnt = 0
+        self.commitCnt = 0
+
+    def put(self, topic, payload, qos=0, priority=0):
+        if not isinstance(payload, bytes):
+            payload = payload.encode('utf-8')
+        size = len(payload) + len(topic)
+        with self.lock:
+            if not self.inTransaction:
+                self.db.execute('BEGIN')
+                self.inTransaction = True
+            self.db.execute('INSERT INTO messages (priority, topic, payload, qos, size, created) VALUES (?, ?, ?, ?, ?, ?)',
+                            (priority, topic, sqlite3.Binary(payload), qos, size, time.time()))
+            self.totalBytes += size
+            self.pendingWrites += 1
+            self.storedCnt += 1
+            if self.totalBytes > self.maxBytes:
+                self.evict()
+            if self.pendingWrites >= self.syncBatch or time.time() - self.lastCommit >= self.syncIntervalSec:
+                self.commit()
+        self.wakeEvent.set()
+
+    def evict(self):
+        # drop the lowest priority, oldest messages until back under the cap
+        rows = self.db.execute('SELECT id, size FROM messages ORDER BY priority ASC, id ASC LIMIT 500').fetchall()
+        evictIds = []
+        for rowId, size in rows:
+            if self.totalBytes <= self.maxBytes:
+                break
+            evictIds.append((rowId,))
+            self.totalBytes -= size
+        self.db.executemany('DELETE FROM messages WHERE id = ?', evictIds)
+        self.evictedCnt += len(evictIds)
+
+    def commit(self):
+        if self.inTransaction:
+            self.db.execute('COMMIT')
+            self.inTransaction = False
+            self.commitCnt += 1
+        self.pendingWrites = 0
+        self.lastCommit = time.time()
+
+    def flush(self):
+        with self.lock:
+            self.commit()
+
+    def commitIfDue(self):
+        # called periodically so a write batch never waits on the next put
+        with self.lock:
+            if self.closed:
+                return
+            if self.inTransaction and time.time() - self.lastCommit >= self.syncIntervalSec:
+                self.commit()
+
+    def peek(self, limit):
+        # highest priority first, oldest first within a priority
+        with self.lock:
+            if self.closed:
+                return []
+            self.commit()
+            return self.db.execute('SELECT id, topic, payload, qos FROM messages ORDER BY priority DESC, id ASC LIMIT ?',
+                                   (limit,)).fetchall()
+
+    def remove(self, rowId):
+        self.removeMany([rowId])
+
+    def removeMany(self, rowIds):
+        # one transaction (one fsync) for a whole replayed batch
+        if not rowIds:
+            return
+        with self.lock:
+            if self.closed:
+                # replayed again after a restart, which the QoS already allows for
+                return
+            if not self.inTransaction:
+                self.db.execute('BEGIN')
+                self.inTransaction = True
+            for start in range(0, len(rowIds), 500):
+                chunk = list(rowIds[start:start + 500])
+                marks = ','.join('?' * len(chunk))
+                removed = self.db.execute('SELECT COALESCE(SUM(size), 0) FROM messages WHERE id IN (' + marks + ')',
+                                          chunk).fetchone()[0]
+                self.db.execute('DELETE FROM messages WHERE id IN (' + marks + ')', chunk)
+                self.totalBytes -= removed
+            self.commit()
+
+    def count(self):
+        with self.lock:
+            return self.db.execute('SELECT COUNT(*) FROM messages').fetchone()[0]
+
+    def close(self, timeoutSec=2.0):
+        if self.drainer is not None:
+            self.drainer.stop(timeoutSec)
+            if self.drainer.is_alive():
+                print("Store-and-forward drainer did not stop, closing the queue anyway")
+        with self.lock:
+            if self.closed:
+                return
+            self.commit()
+            self.db.close()
+            self.closed = True
+
+
+class StoreForwardDrainer(threading.Thread):
+    def __init__(self, queue, publishFunc, connectedEvent, drainRate=20, batchSize=50):
+        # publishFunc(topic, payload, qos) raises or returns False when the publish failed
+        threading.Thread.__init__(self, name="StoreForwardDrainer")
+        self.daemon = True
+        self.queue = queue
+        self.publishFunc = publishFunc
+        self.connectedEvent = connectedEvent
+        self.drainInterval = 1.0 / drainRate
+        self.batchSize = batchSize
+        # wake often enough to commit the queue's pending writes on time
+        self.idleWaitSec = min(5, queue.syncIntervalSec)
+        # the offline wait can't be woken by stop(), so it is kept short
+        self.offlineWaitSec = min(0.5, self.idleWaitSec)
+        self.running = False
+        self.replayedCnt = 0
+        queue.drainer = self
+
+    def run(self):
+        self.running = True
+        while self.running:
+            # nothing can be sent until the client is online again
+            self.connectedEvent.wait(self.offlineWaitSec)
+            if not self.connectedEvent.is_set():
+                self.queue.commitIfDue()
+                continue
+
+            rows = self.queue.peek(self.batchSize)
+            if not rows:
+                self.queue.wakeEvent.clear()
+                if self.running:
+                    self.queue.wakeEvent.wait(self.idleWaitSec)
+                self.queue.commitIfDue()
+                continue
+
+            sentIds = []
+            failed = False
+            for rowId, topic, payload, qos in rows:
+                if not self.connectedEvent.is_set() or not self.running:
+                    break
+                try:
+                    sent = self.publishFunc(topic, bytes(payload), qos)
+                except Exception:
+                    sent = False
+                if sent is False:
+                    # leave it queued and back off before the next attempt
+                    failed = True
+                    break
+                sentIds.append(rowId)
+                self.replayedCnt += 1
+                time.sleep(self.drainInterval)
+            # a crash before this replays the batch again, which the QoS already allows for
+            self.queue.removeMany(sentIds)
+            if failed:
+                time.sleep(1)
+
+    def stop(self, timeoutSec=2.0):
+        self.running = False
+        self.queue.wakeEvent.set()
+        if self.is_alive():
+            self.join(timeoutSec)
@@ -0,0 +1,122 @@
+# Copyright 2018. Amazon Web Services, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import fcntl
+import math
+import os
+import socket
+import struct
+import time
+
+# In-process system stats for the status display.
+# Reads /proc/loadavg, /proc/meminfo, statvfs and the interface addresses directly
+# instead of running hostname/top/free/df pipelines, and produces the same display
+# lines they did. The load and memory reads are a single small file each and are done
+# on every call; the interface address and disk usage change slowly and are cached
+# for their TTL.
+
+siocgifaddr = 0x8915
+
+
+class SysStats(object):
+    def __init__(self, diskPath='/', ipTtlSec=60, diskTtlSec=60, procRoot='/proc', clock=time.time):
+        self.diskPath = diskPath
+        self.ipTtlSec = ipTtlSec
+        self.diskTtlSec = diskTtlSec
+        self.procRoot = procRoot
+        self.clock = clock
+        # key -> (expiry, value)
+        self.cache = {}
+
+    def cached(self, key, ttlSec, func):
+        now = self.clock()
+        entry = self.cache.get(key)
+        if entry is None or now >= entry[0]:
+            entry = (now + ttlSec, func())
+            self.cache[key] = entry
+        return entry[1]
+
+    def readProc(self, name):
+        with open(os.path.join(self.procRoot, name)) as infile:
+            return infile.read()
+
+    def interfaceAddress(self, name):
+        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            request = struct.pack('256s', name[:15].encode('ascii'))
+            return socket.inet_ntoa(fcntl.ioctl(s.fileno(), siocgifaddr, request)[20:24])
+        except (IOError, OSError):
+            return None
+        finally:
+            s.close()
+
+    def readIpAddress(self):
+        # first IPv4 address of a non-loopback interface, like 'hostname -I | cut -f1'
+        try:
+            names = sorted(os.listdir('/sys/class/net'))
+        except OSError:
+            names = []
+        for name in names:
+            if name == 'lo':
+                continue
+            address = self.interfaceAddress(name)
+            if address is not None and not address.startswith('127.'):
+                return address
+        return ''
+
+    def ipAddress(self):
+        return self.cached('ip', self.ipTtlSec, self.readIpAddress)
+
+    def loadAverage(self):
+        return float(self.readProc('loadavg').split()[0])
+
+    def memory(self):
+        # (usedMB, totalMB) the way free computes used: total - available, or
+        # total - free - buffers - cache on kernels without MemAvailable
+        info = {}
+        for line in self.readProc('meminfo').splitlines():
+            parts = line.split()
+            if len(parts) >= 2:
+                info[parts[0].rstrip(':')] = int(parts[1])
+        totalKb = info.get('MemTotal', 0)
+        if 'MemAvailable' in info:
+            usedKb = totalKb - info['MemAvailable']
+        else:
+            cacheKb = info.get('Buffers', 0) + info.get('Cached', 0) + info.get('SReclaimable', 0)
+            usedKb = totalKb - info.get('MemFree', 0) - cacheKb
+        return usedKb // 1024, totalKb // 1024
+
+    def readDisk(self):
+        # (usedGB, totalGB, percent) the way df -h reports them, sizes rounded up
+        st = os.statvfs(self.diskPath)
+        used = (st.f_blocks - st.f_bfree) * st.f_frsize
+        total = st.f_blocks * st.f_frsize
+        available = st.f_bavail * st.f_frsize
+        percent = -(-100 * used // (used + available)) if used + available > 0 else 0
+        gb = float(1024 ** 3)
+        return int(math.ceil(used / gb)), int(math.ceil(total / gb)), percent
+
+    def disk(self):
+        return self.cached('disk', self.diskTtlSec, self.readDisk)
+
+    def lines(self):
+        # the four status lines myip_oled.py shows
+        usedMb, totalMb = self.memory()
+        usedGb, totalGb, diskPct = self.disk()
+        return [
+            "IP: " + self.ipAddress(),
+            "CPU Load: {0:.2f}".format(self.loadAverage()),
+            "Mem: {0}/{1}MB {2:.2f}%".format(usedMb, totalMb, usedMb * 100.0 / totalMb if totalMb else 0),
+            "Disk: {0}/{1}GB {2}%".format(usedGb, totalGb, diskPct)
+        ]
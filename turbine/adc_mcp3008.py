@@ -0,0 +1,166 @@
+# Copyright 2018. Amazon Web Services, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import random
+import threading
+import time
+
+# MCP3008 ADC access.
+# SpiMcp3008 uses the kernel spidev driver (hardware SPI) instead of bit-banging
+# GPIO pins, which makes a conversion take tens of microseconds instead of
+# milliseconds. The MCP3008 only starts a conversion on the falling edge of chip
+# select and one xfer2 holds chip select low for the whole transfer, so conversions
+# can't be batched into one xfer2; a scan is a tight sequence of 3 byte transfers
+# with the command bytes built once. Every device has readRaw(channel) returning
+# the 10 bit count; FakeMcp3008 stands in for the chip when testing without hardware.
+#
+# AdcScanner reads a set of channels with N-times oversampling and keeps the
+# min/max/mean voltage of every channel for the current publish interval. A channel
+# behind a voltage divider has a scale factor; countsToVolts() applies it, so every
+# reading of that channel (scans and single conversions alike) is in the same units.
+# The device lock is held for one conversion at a time rather than a whole scan, so
+# the voltage capture thread gets the bus between the scan's transfers instead of
+# stalling for a full oversampled pass. Decimation needs a power of 4 reads; any
+# other oversample is rounded down to one with a warning.
+
+try:
+    import spidev
+except ImportError:
+    spidev = None
+
+adcMaxCount = 1023
+
+
+class SpiMcp3008(object):
+    def __init__(self, bus=0, device=0, maxSpeedHz=1350000):
+        self.spi = spidev.SpiDev()
+        self.spi.open(bus, device)
+        self.spi.max_speed_hz = maxSpeedHz
+        self.spi.mode = 0
+        # single-ended conversion command for each channel
+        self.commands = [[0x01, (0x08 | channel) << 4, 0x00] for channel in range(8)]
+
+    def readRaw(self, channel):
+        reply = self.spi.xfer2(list(self.commands[channel]))
+        return ((reply[1] & 0x03) << 8) | reply[2]
+
+    def close(self):
+        self.spi.close()
+
+
+class LegacyMcp3008(object):
+    # software SPI through Adafruit_MCP3008, used when spidev is not available
+    def __init__(self, mcp):
+        self.mcp = mcp
+
+    def readRaw(self, channel):
+        return self.mcp.read_adc(channel)
+
+
+class FakeMcp3008(object):
+    def __init__(self, signalFunc=None, vref=3.3, noiseCounts=0.5, clock=time.monotonic, conversionSec=0):
+        # signalFunc(channel, t) returns the voltage on a channel at time t
+        self.signalFunc = signalFunc or (lambda channel, t: 0.0)
+        self.vref = vref
+        self.noiseCounts = noiseCounts
+        self.clock = clock
+        self.conversionSec = conversionSec
+        self.readCnt = 0
+
+    def readRaw(self, channel):
+        self.readCnt += 1
+        if self.conversionSec > 0:
+            time.sleep(self.conversionSec)
+        counts = self.signalFunc(channel, self.clock()) / self.vref * adcMaxCount
+        counts += random.gauss(0, self.noiseCounts)
+        return int(min(max(round(counts), 0), adcMaxCount))
+
+
+class AdcScanner(object):
+    def __init__(self, device, channels=(0,), oversample=4, vref=3.3, mode='average', scales=None):
+        # mode 'average' returns the float mean of the oversampled reads, 'decimate'
+        # sums 4^n reads and shifts by n for n extra bits of resolution.
+        # scales maps a channel to the factor from the ADC input to the measured voltage
+        self.device = device
+        self.channels = list(channels)
+        self.oversample = max(int(oversample), 1)
+        self.vref = vref
+        self.scales = dict(scales or {})
+        self.mode = mode
+        self.extraBits = 0
+        if mode == 'decimate':
+            while 4 ** (self.extraBits + 1) <= self.oversample:
+                self.extraBits += 1
+            if 4 ** self.extraBits != self.oversample:
+                print("ADC oversample {0} is not a power of 4, decimating {1} reads".format(
+                    self.oversample, 4 ** self.extraBits))
+                self.oversample = 4 ** self.extraBits
+        # one conversion at a time on the device, shared with the voltage capture
+        self.lock = threading.Lock()
+        self.lastVolts = dict((channel, 0.0) for channel in self.channels)
+        self.resetInterval()
+
+    def resetInterval(self):
+        self.intervalMin = dict((channel, None) for channel in self.channels)
+        self.intervalMax = dict((channel, None) for channel in self.channels)
+        self.intervalSum = dict((channel, 0.0) for channel in self.channels)
+        self.intervalCnt = 0
+
+    def countsToVolts(self, counts, extraBits=0, channel=None):
+        return self.vref * counts / (adcMaxCount << extraBits) * self.scales.get(channel, 1.0)
+
+    def readRaw(self, channel):
+        # a single conversion, holding the device for just that transfer
+        with self.lock:
+            return self.device.readRaw(channel)
+
+    def readChannel(self, channel):
+        readRaw = self.readRaw
+        total = 0
+        for i in range(self.oversample):
+            total += readRaw(channel)
+        if self.mode == 'decimate':
+            return self.countsToVolts(total >> self.extraBits, self.extraBits, channel)
+        return self.countsToVolts(float(total) / self.oversample, channel=channel)
+
+    def scan(self):
+        # one oversampled reading of every channel, folded into the interval stats
+        volts = dict((channel, self.readChannel(channel)) for channel in self.channels)
+        for channel, value in volts.items():
+            if self.intervalMin[channel] is None or value < self.intervalMin[channel]:
+                self.intervalMin[channel] = value
+            if self.intervalMax[channel] is None or value > self.intervalMax[channel]:
+                self.intervalMax[channel] = value
+            self.intervalSum[channel] += value
+        self.intervalCnt += 1
+        self.lastVolts = volts
+        return volts
+
+    def intervalStats(self):
+        # {channel: {'min', 'max', 'mean'}} since the previous call; scans once if none happened
+        if self.intervalCnt == 0:
+            self.scan()
+        stats = {}
+        for channel in self.channels:
+            stats[channel] = {
+                'min': self.intervalMin[channel],
+                'max': self.intervalMax[channel],
+                'mean': self.intervalSum[channel] / self.intervalCnt
+            }
+        self.resetInterval()
+        return stats
+
+
+def spiAvailable():
+    return spidev is not None
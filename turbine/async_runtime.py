@@ -0,0 +1,118 @@
+# Copyright 2018. Amazon Web Services, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+# asyncio runtime for the turbine (--runtime asyncio).
+# Sampling, publishing, the LED, the buttons and shadow/command handling
+# run as independent tasks that talk over queues and events instead of taking
+# turns in one loop. Blocking hardware and network calls run in executors, one
+# single-worker executor per resource so calls to the same bus stay in order,
+# and a slow brake action no longer holds up the others. The OLED has its own
+# render thread (oled_renderer.OledRenderWorker) under both runtimes.
+
+
+class AsyncRuntime(object):
+    def __init__(self, publishQueueSize=100, ledFlashSec=0.08):
+        self.publishQueueSize = publishQueueSize
+        self.ledFlashSec = ledFlashSec
+        self.loop = None
+        self.executors = {}
+        self.publishQueue = None
+        self.commandQueue = None
+        self.ledEvent = None
+        self.droppedPublishCnt = 0
+
+    def getExecutor(self, resource):
+        if resource not in self.executors:
+            self.executors[resource] = ThreadPoolExecutor(max_workers=1, thread_name_prefix="async-" + resource)
+        return self.executors[resource]
+
+    async def runBlocking(self, resource, func, *args):
+        return await self.loop.run_in_executor(self.getExecutor(resource), func, *args)
+
+    # the request* and submit* calls are safe from any thread (SDK callbacks, executors)
+
+    def submitCommand(self, func, *args):
+        if self.loop is None:
+            func(*args)
+            return
+        self.loop.call_soon_threadsafe(self.commandQueue.put_nowait, (func, args))
+
+    def requestFlash(self):
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.ledEvent.set)
+
+    def publish(self, publishFunc, *args):
+        # called on the loop; when the publisher falls behind the oldest item is dropped
+        if self.publishQueue.full():
+            self.publishQueue.get_nowait()
+            self.droppedPublishCnt += 1
+        self.publishQueue.put_nowait((publishFunc, args))
+
+    async def publishTask(self):
+        # every network send goes through here, in the order it was queued
+        while True:
+            publishFunc, args = await self.publishQueue.get()
+            try:
+                await self.runBlocking('publish', publishFunc, *args)
+            except Exception as e:
+                print("async publish failed: " + str(e))
+
+    async def commandTask(self):
+        # commands (brake moves, shadow deltas) can take seconds, so they get their own worker
+        while True:
+            func, args = await self.commandQueue.get()
+            try:
+                await self.runBlocking('command', func, *args)
+            except Exception as e:
+                print("async command failed: " + str(e))
+
+    async def ledTask(self, onFunc, offFunc):
+        while True:
+            await self.ledEvent.wait()
+            self.ledEvent.clear()
+            offFunc()
+            await asyncio.sleep(self.ledFlashSec)
+            onFunc()
+
+    async def buttonTask(self, readFunc, pressFunc, pollSec=0.1):
+        # readFunc() returns the buttons held down; pressFunc(button) runs as a command on each press
+        lastPressed = set()
+        while True:
+            pressed = set(readFunc())
+            for button in sorted(pressed - lastPressed):
+                self.submitCommand(pressFunc, button)
+            lastPressed = pressed
+            await asyncio.sleep(pollSec)
+
+    async def main(self, tasks):
+        self.loop = asyncio.get_running_loop()
+        self.publishQueue = asyncio.Queue(self.publishQueueSize)
+        self.commandQueue = asyncio.Queue()
+        self.ledEvent = asyncio.Event()
+        try:
+            await asyncio.gather(*[task(self) for task in tasks])
+        finally:
+            self.loop = None
+
+    def run(self, tasks):
+        # tasks are callables taking the runtime and returning a coroutine
+        try:
+            asyncio.run(self.main(tasks))
+        finally:
+            for executor in self.executors.values():
+                executor.shutdown(wait=False)
+            self.executors = {}
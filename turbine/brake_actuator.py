@@ -0,0 +1,191 @@
+# Copyright 2018. Amazon Web Services, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import collections
+import queue
+import threading
+import time
+
+# Brake servo scheduler.
+# A brake command is a list of timed steps, each a phase name (apply, hold, return,
+# release), a servo duty cycle and how long to stay there. The actuator thread steps
+# through them on deadlines, so callers (shadow deltas, MQTT commands, buttons) only
+# queue a command and return. A newer command preempts the one in progress; commands
+# queued behind a newer one are superseded without running. A step with no duration
+# ends the command and leaves the servo at that duty. Completion callbacks run on a
+# separate reporting thread, so a slow shadow update never delays the next brake move.
+
+phaseIdle = 'idle'
+
+
+class BrakeCommand(object):
+    def __init__(self, name, steps, onDone=None):
+        # steps: [(phase, duty, durationSec or None)]; onDone(command, result) with
+        # result 'done', 'preempted', 'superseded' or 'failed'
+        self.name = name
+        self.steps = list(steps)
+        self.onDone = onDone
+        self.result = None
+        self.doneEvent = threading.Event()
+
+    def wait(self, timeoutSec=None):
+        # returns the result, or None if the command is still running
+        self.doneEvent.wait(timeoutSec)
+        return self.result
+
+
+def brakeOnSteps(onDuty, applySec=3.0, release=True):
+    # press for applySec, then either cut the pulses or keep holding
+    if release:
+        return [('apply', onDuty, applySec), ('release', 0, None)]
+    return [('apply', onDuty, applySec), ('hold', onDuty, None)]
+
+
+def brakeOffSteps(offDuty, moveSec=1.0):
+    return [('return', offDuty, moveSec), ('release', 0, None)]
+
+
+def brakeChangeSteps(duty, holdSec, offDuty, returnToOff=True, returnSec=0.5):
+    # partial brake pressure for holdSec, then optionally back to the off position
+    steps = [('hold', duty, holdSec)]
+    if returnToOff:
+        steps.append(('return', offDuty, returnSec))
+    steps.append(('release', 0, None))
+    return steps
+
+
+class BrakeActuator(threading.Thread):
+    def __init__(self, setDutyFunc, clock=time.monotonic):
+        threading.Thread.__init__(self, name="BrakeActuator")
+        self.daemon = True
+        # setDutyFunc(duty) drives the servo PWM, 0 stops the pulses
+        self.setDutyFunc = setDutyFunc
+        self.clock = clock
+
+        self.cond = threading.Condition()
+        self.pending = collections.deque()
+        self.current = None
+        self.stepIdx = 0
+        self.deadline = None
+        self.phase = phaseIdle
+        self.duty = 0
+        self.running = False
+
+        self.reportQueue = queue.Queue()
+        self.reporter = threading.Thread(target=self.reportLoop, name="BrakeActuatorReports")
+        self.reporter.daemon = True
+
+        self.commandCnt = 0
+        self.preemptCnt = 0
+        self.errorCnt = 0
+
+    def submit(self, command):
+        with self.cond:
+            self.pending.append(command)
+            self.commandCnt += 1
+            self.cond.notify_all()
+        return command
+
+    def isBusy(self):
+        with self.cond:
+            return self.current is not None or len(self.pending) > 0
+
+    def waitIdle(self, timeoutSec=None):
+        # True once every queued command has finished
+        end = None if timeoutSec is None else self.clock() + timeoutSec
+        with self.cond:
+            while self.current is not None or self.pending:
+                remaining = None if end is None else end - self.clock()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self.cond.wait(remaining)
+        return True
+
+    def finish(self, command, result):
+        # called with the lock held; the callback runs on the reporting thread
+        command.result = result
+        command.doneEvent.set()
+        if command.onDone is not None:
+            self.reportQueue.put((command, result))
+        self.cond.notify_all()
+
+    def startStep(self):
+        phase, duty, durationSec = self.current.steps[self.stepIdx]
+        try:
+            self.setDutyFunc(duty)
+        except Exception as e:
+            print("brake servo error: " + str(e))
+            self.errorCnt += 1
+            self.finish(self.current, 'failed')
+            self.current = None
+            self.deadline = None
+            self.phase = phaseIdle
+            return
+        self.phase = phase
+        self.duty = duty
+        if durationSec is None:
+            # final position reached; the servo stays at this duty
+            self.completeCurrent()
+        else:
+            self.deadline = self.clock() + durationSec
+
+    def completeCurrent(self):
+        self.finish(self.current, 'done')
+        self.current = None
+        self.deadline = None
+        if self.duty == 0:
+            self.phase = phaseIdle
+
+    def run(self):
+        self.running = True
+        self.reporter.start()
+        with self.cond:
+            while self.running:
+                if self.pending:
+                    command = self.pending.pop()
+                    while self.pending:
+                        self.finish(self.pending.popleft(), 'superseded')
+                    if self.current is not None:
+                        self.preemptCnt += 1
+                        self.finish(self.current, 'preempted')
+                    self.current = command
+                    self.stepIdx = 0
+                    if command.steps:
+                        self.startStep()
+                    else:
+                        self.completeCurrent()
+                elif self.deadline is not None and self.clock() >= self.deadline:
+                    self.stepIdx += 1
+                    if self.stepIdx < len(self.current.steps):
+                        self.startStep()
+                    else:
+                        self.completeCurrent()
+                else:
+                    timeout = None if self.deadline is None else max(self.deadline - self.clock(), 0)
+                    self.cond.wait(timeout)
+
+    def reportLoop(self):
+        while True:
+            command, result = self.reportQueue.get()
+            try:
+                command.onDone(command, result)
+            except Exception as e:
+                print("brake completion callback failed: " + str(e))
+
+    def stop(self, timeoutSec=2.0):
+        with self.cond:
+            self.running = False
+            self.cond.notify_all()
+        if self.is_alive():
+            self.join(timeoutSec)
@@ -0,0 +1,245 @@
+# Copyright 2018. Amazon Web Services, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import time
+
+# Brake servo auto-calibration.
+# Finds the lightest brake position (largest servo duty) that stops the turbine in
+# the current wind, then derives the on and off positions from it. The search steps
+# down in coarse steps until a probe stops the rotor and then bisects the last step
+# down to the resolution. Every probe watches a fast RPM estimate instead of sleeping
+# a fixed time: it ends as soon as the rotor has stopped, its speed has settled, or the
+# speed it is heading for is clear. The rotor approaches its new speed roughly
+# exponentially, so the means of three consecutive windows project where it will end
+# up (Aitken extrapolation) long before it gets there; a projection below stopRpm
+# counts as stopping. A probe still crawling and slowing down at the timeout also
+# counts as stopping. After a probe that stopped the rotor the brake is released only until it
+# is turning again.
+#
+# The result carries a confidence score from 0 to 1 built from how steady the
+# turbine ran without the brake, whether the position just above the stop point
+# repeats its result, and how quickly (and with how much extra force) the on
+# position stops the turbine.
+
+resultStopped = 'stopped'
+resultSettled = 'settled'
+resultSlowing = 'slowing'
+
+
+class BrakeCalibrator(object):
+    def __init__(self, setDutyFunc, readRpmFunc, sleepFunc=time.sleep, clock=time.monotonic,
+                 offDuty=10.0, minDuty=5.0, coarseStep=0.5, resolution=0.1, extraForce=0.2, offMargin=0.8,
+                 pollSec=0.1, settleWindowSec=1.0, settleTolerance=0.03, probeTimeoutSec=5.0,
+                 projectWindowSec=1.0, projectAgreeCnt=5, stopRpm=30.0, spinUpFraction=0.25,
+                 spinUpTimeoutSec=15.0, hardStopSec=7.0, extraForceSteps=4, log=print):
+        # duties are servo PWM percentages: offDuty is fully released, lower is more brake.
+        # hardStopSec allows 5 s to stop plus the RPM estimator's stall time to read 0
+        self.setDutyFunc = setDutyFunc
+        self.readRpmFunc = readRpmFunc
+        self.sleepFunc = sleepFunc
+        self.clock = clock
+        self.offDuty = offDuty
+        self.minDuty = minDuty
+        self.coarseStep = coarseStep
+        self.resolution = resolution
+        self.extraForce = extraForce
+        self.offMargin = offMargin
+        self.pollSec = pollSec
+        self.settleWindowSec = settleWindowSec
+        self.settleTolerance = settleTolerance
+        self.probeTimeoutSec = probeTimeoutSec
+        self.projectWindowSec = projectWindowSec
+        self.projectAgreeCnt = projectAgreeCnt
+        self.stopRpm = stopRpm
+        self.spinUpFraction = spinUpFraction
+        self.spinUpTimeoutSec = spinUpTimeoutSec
+        self.hardStopSec = hardStopSec
+        self.extraForceSteps = extraForceSteps
+        self.log = log
+
+        self.baselineRpm = 0
+        self.baselineSpread = 0
+        self.probes = []
+
+    def watch(self, duty, timeoutSec, untilRpm=None, early=True):
+        # applies duty and polls the speed until the rotor stops, settles (only when
+        # early), reaches untilRpm or the timeout passes; returns
+        # (result, rpm, elapsedSec, samples)
+        self.setDutyFunc(duty)
+        started = self.clock()
+        samples = []
+        verdict = None
+        agreeCnt = 0
+        while True:
+            self.sleepFunc(self.pollSec)
+            elapsed = self.clock() - started
+            rpm = self.readRpmFunc()
+            samples.append((elapsed, rpm))
+            if untilRpm is not None:
+                if rpm >= untilRpm or elapsed >= timeoutSec:
+                    return resultSettled, rpm, elapsed, samples
+                continue
+            if rpm == 0:
+                return resultStopped, rpm, elapsed, samples
+            if not early:
+                if elapsed >= timeoutSec:
+                    return resultSlowing, rpm, elapsed, samples
+                continue
+            if self.isSettled(samples):
+                return resultSettled, rpm, elapsed, samples
+            # below a few pulses per window the readings are too coarse to project
+            projected = self.projectedRpm(samples) if rpm >= 3 * self.stopRpm else None
+            current = None if projected is None else (resultSlowing if projected < self.stopRpm else resultSettled)
+            agreeCnt = agreeCnt + 1 if current is not None and current == verdict else 1
+            verdict = current
+            if verdict is not None and agreeCnt >= self.projectAgreeCnt:
+                return verdict, rpm, elapsed, samples
+            if elapsed >= timeoutSec:
+                crawling = rpm < 3 * self.stopRpm and self.trend(samples) < 0
+                return (resultSlowing if crawling else resultSettled), rpm, elapsed, samples
+
+    def projectedRpm(self, samples):
+        # where a first-order approach from the last three window means ends up, or
+        # None while the speed isn't converging
+        end = samples[-1][0]
+        if end < 3 * self.projectWindowSec:
+            return None
+        means = []
+        for i in range(3, 0, -1):
+            window = [rpm for t, rpm in samples if end - i * self.projectWindowSec < t <= end - (i - 1) *
+                      self.projectWindowSec]
+            if not window:
+                return None
+            means.append(sum(window) / len(window))
+        d1 = means[1] - means[0]
+        d2 = means[2] - means[1]
+        if d1 == 0 or not 0 < d2 / d1 < 0.9:
+            return None
+        ratio = d2 / d1
+        return means[2] + d2 * ratio / (1 - ratio)
+
+    def recent(self, samples):
+        end = samples[-1][0]
+        return [rpm for t, rpm in samples if t >= end - self.settleWindowSec]
+
+    def isSettled(self, samples):
+        # a crawling rotor reads flat between its pulses, so that is never settled
+        if samples[-1][0] < self.settleWindowSec:
+            return False
+        window = self.recent(samples)
+        level = sum(window) / len(window)
+        return level >= 3 * self.stopRpm and max(window) - min(window) <= self.settleTolerance * level
+
+    def trend(self, samples):
+        # speed change over the last settle window
+        window = self.recent(samples)
+        return window[-1] - window[0]
+
+    def probe(self, duty):
+        # True when duty stops the rotor (or is still slowing it at the timeout)
+        if self.readRpmFunc() < self.baselineRpm * self.spinUpFraction:
+            self.watch(self.offDuty, self.spinUpTimeoutSec, self.baselineRpm * self.spinUpFraction)
+        result, rpm, elapsed, samples = self.watch(duty, self.probeTimeoutSec)
+        stops = result != resultSettled
+        self.probes.append((duty, result, round(rpm, 1), round(elapsed, 2)))
+        self.log("Trying {0:.2f}: {1} at {2:.0f} RPM after {3:.1f} s".format(duty, result, rpm, elapsed))
+        return stops
+
+    def measureBaseline(self):
+        result, rpm, elapsed, samples = self.watch(self.offDuty, self.spinUpTimeoutSec + self.settleWindowSec)
+        window = self.recent(samples)
+        mean = sum(window) / len(window)
+        self.baselineRpm = mean
+        self.baselineSpread = (max(window) - min(window)) / mean if mean > 0 else 1.0
+        return mean
+
+    def findStopDuty(self):
+        # coarse steps down from the released position, then bisect the last step
+        stopping = None
+        notStopping = self.offDuty
+        duty = round(self.offDuty - self.coarseStep, 3)
+        while duty >= self.minDuty - 1e-9:
+            if self.probe(duty):
+                stopping = duty
+                break
+            notStopping = duty
+            duty = round(duty - self.coarseStep, 3)
+        if stopping is None:
+            return None, notStopping
+        while notStopping - stopping > self.resolution + 1e-9:
+            mid = round((stopping + notStopping) / 2, 3)
+            if self.probe(mid):
+                stopping = mid
+            else:
+                notStopping = mid
+        return stopping, notStopping
+
+    def hardStopTime(self, duty):
+        # seconds for duty to stop the turbine from speed, None if it doesn't within hardStopSec
+        self.watch(self.offDuty, self.spinUpTimeoutSec, self.baselineRpm * 0.8)
+        result, rpm, elapsed, samples = self.watch(duty, self.hardStopSec, early=False)
+        return elapsed if result == resultStopped else None
+
+    def calibrate(self):
+        # returns a result dict, or None when the turbine isn't turning or can't be stopped
+        started = self.clock()
+        self.probes = []
+        if self.measureBaseline() <= 0:
+            self.log("Turbine is not spinning. Can't do the auto calibrate without wind.")
+            self.setDutyFunc(0)
+            return None
+        self.log("Turbine speed: {0:.0f}".format(self.baselineRpm))
+
+        stopDuty, notStopDuty = self.findStopDuty()
+        if stopDuty is None:
+            self.log("Unable to stop the turbine down to {0:.2f}".format(self.minDuty))
+            self.setDutyFunc(0)
+            return None
+        self.log("Found a stopping point at {0:.2f}".format(stopDuty))
+
+        # the lightest position that didn't stop the rotor should repeat; the stopping
+        # side is checked by the hard stop below
+        repeated = not self.probe(notStopDuty)
+
+        onDuty = stopDuty - self.extraForce
+        stopSec = self.hardStopTime(onDuty)
+        extraSteps = 0
+        while stopSec is None and extraSteps < self.extraForceSteps and onDuty - 0.1 >= self.minDuty:
+            self.log("More braking force needed... adding force")
+            onDuty -= 0.1
+            extraSteps += 1
+            stopSec = self.hardStopTime(onDuty)
+
+        self.setDutyFunc(onDuty + self.offMargin)
+        self.sleepFunc(1)
+        self.setDutyFunc(0)
+        if stopSec is None:
+            self.log("Unable to completely stop the turbine")
+            return None
+
+        confidence = 1.0
+        confidence *= max(0.0, 1 - 5 * self.baselineSpread)
+        confidence *= 1.0 if repeated else 0.5
+        confidence *= min(1.5 - stopSec / self.hardStopSec, 1.0)
+        confidence *= 1 - 0.1 * extraSteps
+        return {
+            'onPosition': round(onDuty, 2),
+            'offPosition': round(onDuty + self.offMargin, 2),
+            'stopDuty': round(stopDuty, 3),
+            'stopSec': round(stopSec, 2),
+            'baselineRpm': round(self.baselineRpm, 1),
+            'confidence': round(max(confidence, 0.0), 2),
+            'probeCnt': len(self.probes),
+            'wallSec': round(self.clock() - started, 1)
+        }
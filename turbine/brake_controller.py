@@ -0,0 +1,163 @@
+# Copyright 2018. Amazon Web Services, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+import time
+
+# Closed-loop speed cap with the brake (target_rpm).
+# BrakePid turns the speed error into a brake percentage: more brake when the rotor
+# is above the target. The derivative acts on the measured speed so a new target
+# doesn't kick the servo. The output is clamped to 0-100% and slew-limited to what
+# the servo can follow, and the integral only accumulates while neither limit holds
+# it back (anti-windup), so the brake lets go promptly when the wind drops.
+# A safety override (vibration or overspeed) goes straight to full brake, and the
+# integral is reset so control resumes from there without a jump.
+#
+# BrakeController runs the PID at a fixed rate on its own thread while engaged,
+# reading a short-window RPM estimate and passing the percentage to applyPctFunc.
+
+
+def clamp(value, low, high):
+    return min(max(value, low), high)
+
+
+class BrakePid(object):
+    def __init__(self, kp=0.2, ki=0.1, kd=0.05, maxSlewPctPerSec=60.0, minPct=0.0, maxPct=100.0):
+        # gains are brake percent per RPM of error (and per RPM*s, RPM/s)
+        self.kp = kp
+        self.ki = ki
+        self.kd = kd
+        self.maxSlewPctPerSec = maxSlewPctPerSec
+        self.minPct = minPct
+        self.maxPct = maxPct
+        self.reset()
+
+    def reset(self, outputPct=0.0):
+        # bumpless: the integral carries the current output
+        self.integral = outputPct
+        self.output = outputPct
+        self.lastRpm = None
+
+    def update(self, rpm, targetRpm, dt):
+        error = rpm - targetRpm
+        derivative = 0.0 if self.lastRpm is None or dt <= 0 else (rpm - self.lastRpm) / dt
+        self.lastRpm = rpm
+
+        integral = self.integral + self.ki * error * dt
+        demand = self.kp * error + integral + self.kd * derivative
+
+        output = clamp(demand, self.minPct, self.maxPct)
+        maxStep = self.maxSlewPctPerSec * dt
+        output = clamp(output, self.output - maxStep, self.output + maxStep)
+
+        # hold the integral while a limit is cutting the demand in the error's direction
+        if output == demand or (demand - output) * error < 0:
+            self.integral = clamp(integral, self.minPct, self.maxPct)
+        self.output = output
+        return output
+
+    def override(self, outputPct):
+        self.reset(outputPct)
+        return outputPct
+
+
+class BrakeController(threading.Thread):
+    def __init__(self, readRpmFunc, applyPctFunc, pid=None, rateHz=10, overspeedRpm=None, safetyFunc=None,
+                 minChangePct=0.5, clock=time.monotonic):
+        threading.Thread.__init__(self, name="BrakeController")
+        self.daemon = True
+        # readRpmFunc() returns the current speed; applyPctFunc(pct) moves the brake
+        self.readRpmFunc = readRpmFunc
+        self.applyPctFunc = applyPctFunc
+        self.pid = pid or BrakePid()
+        self.periodSec = 1.0 / rateHz
+        self.overspeedRpm = overspeedRpm
+        # safetyFunc() returns True when the turbine must be fully braked
+        self.safetyFunc = safetyFunc
+        self.minChangePct = minChangePct
+        self.clock = clock
+
+        self.targetRpm = None
+        self.overrideActive = False
+        self.appliedPct = None
+        self.wakeEvent = threading.Event()
+        self.lock = threading.Lock()
+        self.running = False
+        self.tickCnt = 0
+        self.overrunCnt = 0
+
+    def engage(self, targetRpm, currentPct=0.0):
+        with self.lock:
+            if self.targetRpm is None:
+                self.pid.reset(currentPct)
+                self.appliedPct = None
+            self.targetRpm = float(targetRpm)
+        self.wakeEvent.set()
+
+    def disengage(self):
+        with self.lock:
+            self.targetRpm = None
+            self.overrideActive = False
+        self.wakeEvent.clear()
+
+    def isEngaged(self):
+        return self.targetRpm is not None
+
+    def step(self, dt):
+        # one control tick; returns the brake percentage, or None when disengaged
+        with self.lock:
+            targetRpm = self.targetRpm
+            if targetRpm is None:
+                return None
+            rpm = self.readRpmFunc()
+            override = (self.overspeedRpm is not None and rpm > self.overspeedRpm) or \
+                (self.safetyFunc is not None and self.safetyFunc())
+            if override:
+                if not self.overrideActive:
+                    print("Brake controller safety override at " + str(round(rpm)) + " RPM")
+                pct = self.pid.override(self.pid.maxPct)
+            else:
+                pct = self.pid.update(rpm, targetRpm, dt)
+            changed = override != self.overrideActive
+            self.overrideActive = override
+            if self.appliedPct is None or changed or abs(pct - self.appliedPct) >= self.minChangePct:
+                self.applyPctFunc(pct)
+                self.appliedPct = pct
+            self.tickCnt += 1
+        return pct
+
+    def run(self):
+        self.running = True
+        nextDeadline = self.clock()
+        while self.running:
+            if not self.isEngaged():
+                self.wakeEvent.wait()
+                nextDeadline = self.clock()
+                continue
+            try:
+                self.step(self.periodSec)
+            except Exception as e:
+                print("brake controller error: " + str(e))
+            nextDeadline += self.periodSec
+            delay = nextDeadline - self.clock()
+            if delay > 0:
+                time.sleep(delay)
+            elif delay < -self.periodSec:
+                self.overrunCnt += 1
+                nextDeadline = self.clock()
+
+    def stop(self):
+        self.running = False
+        self.disengage()
+        self.wakeEvent.set()
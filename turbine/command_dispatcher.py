@@ -0,0 +1,216 @@
+# Copyright 2018. Amazon Web Services, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import collections
+import concurrent.futures
+import json
+import queue
+import threading
+import time
+
+# Command routing for cmd/windfarm/turbine/<thing>/<command> topics.
+# onMessage() runs on the MQTT callback thread and only looks up the route,
+# decodes the JSON and queues it, so a burst of commands never holds up the
+# keepalive. A full queue rejects the command instead of blocking. The worker
+# thread runs the commands in arrival order, each on a small handler pool so a
+# command that overruns its timeout is reported as timed out and the next one
+# starts; the late handler is left to finish on its own.
+#
+# A message on <prefix>/batch carries {"commands": [{"cmd": "brake", ...}, ...]}
+# and runs each operation in turn. When the request has a request_id, the result
+# is published on the command topic + "/response". Those response topics are
+# under the same subscription, so they are ignored on the way in.
+#
+# Latency is measured per command from receipt on the network thread to completion.
+
+responseSuffix = "/response"
+batchCommand = "batch"
+
+
+class CommandRoute(object):
+    def __init__(self, name, handler, timeoutSec):
+        # handler(payloadDict) returns a JSON-serialisable result or None, raises on failure
+        self.name = name
+        self.handler = handler
+        self.timeoutSec = timeoutSec
+        self.count = 0
+        self.errorCnt = 0
+        self.timeoutCnt = 0
+        self.totalMs = 0.0
+        self.maxMs = 0.0
+        self.lastMs = 0.0
+        self.recentMs = collections.deque(maxlen=100)
+
+    def record(self, latencyMs, status):
+        self.count += 1
+        if status == "error":
+            self.errorCnt += 1
+        elif status == "timeout":
+            self.timeoutCnt += 1
+        self.totalMs += latencyMs
+        self.maxMs = max(self.maxMs, latencyMs)
+        self.lastMs = latencyMs
+        self.recentMs.append(latencyMs)
+
+    def stats(self):
+        recent = sorted(self.recentMs)
+        return {
+            'count': self.count,
+            'errors': self.errorCnt,
+            'timeouts': self.timeoutCnt,
+            'mean_ms': round(self.totalMs / self.count, 2) if self.count else 0,
+            'p95_ms': round(recent[min(int(len(recent) * 0.95), len(recent) - 1)], 2) if recent else 0,
+            'max_ms': round(self.maxMs, 2),
+            'last_ms': round(self.lastMs, 2)
+        }
+
+
+class CommandDispatcher(threading.Thread):
+    def __init__(self, topicPrefix, publishFunc=None, queueSize=32, defaultTimeoutSec=10.0, handlerThreads=2,
+                 clock=time.monotonic):
+        # publishFunc(topic, payloadBytes) sends a response
+        threading.Thread.__init__(self, name="CommandDispatcher")
+        self.daemon = True
+        self.topicPrefix = topicPrefix.rstrip("/") + "/"
+        self.publishFunc = publishFunc
+        self.defaultTimeoutSec = defaultTimeoutSec
+        self.clock = clock
+        self.routes = {}
+        self.queue = queue.Queue(queueSize)
+        self.handlerPool = concurrent.futures.ThreadPoolExecutor(max_workers=handlerThreads)
+        self.running = False
+
+        self.receivedCnt = 0
+        self.rejectedCnt = 0
+        self.ignoredCnt = 0
+        self.maxQueueDepth = 0
+
+    def register(self, name, handler, timeoutSec=None):
+        self.routes[name] = CommandRoute(name, handler, timeoutSec or self.defaultTimeoutSec)
+
+    def onMessage(self, topic, payload):
+        # network thread; returns True when the command was queued
+        receivedAt = self.clock()
+        if not topic.startswith(self.topicPrefix) or topic.endswith(responseSuffix):
+            self.ignoredCnt += 1
+            return False
+        name = topic[len(self.topicPrefix):]
+        if name != batchCommand and name not in self.routes:
+            print("unknown command topic: " + topic)
+            self.ignoredCnt += 1
+            return False
+        try:
+            request = json.loads(payload)
+            if not isinstance(request, dict):
+                raise ValueError("command payload must be a JSON object")
+        except ValueError as e:
+            print("bad command payload on " + topic + ": " + str(e))
+            self.rejectedCnt += 1
+            return False
+
+        self.receivedCnt += 1
+        try:
+            self.queue.put_nowait((topic, name, request, receivedAt))
+        except queue.Full:
+            self.rejectedCnt += 1
+            print("command queue full, rejecting " + name)
+            self.respond(topic, request, {'status': 'rejected', 'error': 'busy'})
+            return False
+        self.maxQueueDepth = max(self.maxQueueDepth, self.queue.qsize())
+        return True
+
+    def runOperation(self, name, request, receivedAt):
+        # one command with its timeout; returns the response entry
+        route = self.routes.get(name)
+        if route is None:
+            return {'cmd': name, 'status': 'error', 'error': 'unknown command'}
+        future = self.handlerPool.submit(route.handler, request)
+        try:
+            result = future.result(route.timeoutSec)
+            entry = {'cmd': name, 'status': 'ok'}
+            if result is not None:
+                entry['result'] = result
+        except concurrent.futures.TimeoutError:
+            print(name + " command timed out after " + str(route.timeoutSec) + " s")
+            entry = {'cmd': name, 'status': 'timeout'}
+        except Exception as e:
+            print(name + " command failed: " + str(e))
+            entry = {'cmd': name, 'status': 'error', 'error': str(e)}
+        latencyMs = (self.clock() - receivedAt) * 1000
+        route.record(latencyMs, entry['status'])
+        entry['latency_ms'] = round(latencyMs, 2)
+        return entry
+
+    def process(self, topic, name, request, receivedAt):
+        if name == batchCommand:
+            operations = request.get("commands")
+            if not isinstance(operations, list):
+                self.respond(topic, request, {'status': 'error', 'error': 'batch needs a commands list'})
+                return
+            # stops at the first failure unless the batch says otherwise
+            continueOnError = bool(request.get("continue_on_error", False))
+            results = []
+            for operation in operations:
+                entry = self.runOperation(operation.get("cmd"), operation, receivedAt) \
+                    if isinstance(operation, dict) else {'status': 'error', 'error': 'not a command object'}
+                results.append(entry)
+                if entry['status'] != 'ok' and not continueOnError:
+                    break
+            status = 'ok' if len(results) == len(operations) and all(r['status'] == 'ok' for r in results) \
+                else 'error'
+            self.respond(topic, request, {'status': status, 'results': results,
+                                          'latency_ms': round((self.clock() - receivedAt) * 1000, 2)})
+        else:
+            self.respond(topic, request, self.runOperation(name, request, receivedAt))
+
+    def respond(self, topic, request, response):
+        # only requests that carry a request_id get a response
+        if self.publishFunc is None or "request_id" not in request:
+            return
+        response['request_id'] = request["request_id"]
+        try:
+            self.publishFunc(topic + responseSuffix, json.dumps(response).encode("utf-8"))
+        except Exception as e:
+            print("command response failed: " + str(e))
+
+    def run(self):
+        self.running = True
+        while self.running:
+            item = self.queue.get()
+            if item is None:
+                break
+            try:
+                self.process(*item)
+            except Exception as e:
+                print("command dispatch error: " + str(e))
+
+    def stats(self):
+        return {
+            'received': self.receivedCnt,
+            'rejected': self.rejectedCnt,
+            'ignored': self.ignoredCnt,
+            'queued': self.queue.qsize(),
+            'max_queued': self.maxQueueDepth,
+            'commands': dict((name, route.stats()) for name, route in self.routes.items())
+        }
+
+    def stop(self, timeoutSec=2.0):
+        self.running = False
+        try:
+            self.queue.put_nowait(None)
+        except queue.Full:
+            pass
+        if self.is_alive():
+            self.join(timeoutSec)
+        self.handlerPool.shutdown(wait=False)
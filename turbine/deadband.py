@@ -0,0 +1,125 @@
+# Copyright 2018. Amazon Web Services, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import time
+import json
+
+# Report-by-exception telemetry.
+# The last published value of every field is kept and a field is only sent again
+# once it has moved beyond its deadband. A full keyframe goes out every
+# keyframeSec so consumers can resync, and carries the suppression counters.
+#
+# A deadband is a dict with any of:
+#   'abs'           - absolute change needed
+#   'pct'           - change needed as a percent of the last published value
+#   'keyframe_only' - the field is only sent in keyframes
+# With both 'abs' and 'pct' the larger threshold applies, so 'abs' acts as the
+# floor near zero. Dict and list fields count as changed when any element does.
+
+
+def exceedsDeadband(new, old, band):
+    if isinstance(new, bool) or isinstance(old, bool):
+        return new != old
+    if isinstance(new, (int, float)) and isinstance(old, (int, float)):
+        threshold = max(band.get('abs', 0), band.get('pct', 0) * abs(old) / 100.0)
+        if threshold == 0:
+            return new != old
+        return abs(new - old) > threshold
+    if isinstance(new, dict) and isinstance(old, dict):
+        if set(new) != set(old):
+            return True
+        return any(exceedsDeadband(new[key], old[key], band) for key in new)
+    if isinstance(new, list) and isinstance(old, list):
+        if len(new) != len(old):
+            return True
+        return any(exceedsDeadband(a, b, band) for a, b in zip(new, old))
+    return new != old
+
+
+def jsonSize(payload):
+    return len(json.dumps(payload))
+
+
+class DeadbandPublisher(object):
+    def __init__(self, identityFields, deadbands=None, keyframeSec=300, sizeFunc=jsonSize):
+        # identityFields are sent with every message, changed or not
+        self.identityFields = identityFields
+        self.deadbands = deadbands or {}
+        self.keyframeSec = float(keyframeSec)
+        self.sizeFunc = sizeFunc
+        self.lastValues = {}
+        self.lastKeyframe = None
+        self.sentCnt = 0
+        self.suppressedMsgCnt = 0
+        self.suppressedByteCnt = 0
+
+    def configure(self, deadbands=None, keyframeSec=None):
+        if deadbands is not None:
+            self.deadbands = deadbands
+        if keyframeSec is not None:
+            self.keyframeSec = float(keyframeSec)
+
+    def forceKeyframe(self):
+        self.lastKeyframe = None
+
+    def getDeadband(self, field):
+        return self.deadbands.get(field, self.deadbands.get('default', {}))
+
+    def filter(self, payload, now=None):
+        # returns the payload to publish (full keyframe or changed fields) or None
+        if now is None:
+            now = time.monotonic()
+
+        if self.lastKeyframe is None or now - self.lastKeyframe >= self.keyframeSec:
+            self.lastKeyframe = now
+            self.lastValues = dict(payload)
+            keyframe = dict(payload)
+            keyframe['keyframe'] = True
+            keyframe['suppressed_msgs'] = self.suppressedMsgCnt
+            keyframe['suppressed_bytes'] = self.suppressedByteCnt
+            self.sentCnt += 1
+            return keyframe
+
+        changed = {}
+        for field, value in payload.items():
+            if field in self.identityFields:
+                continue
+            band = self.getDeadband(field)
+            if band.get('keyframe_only'):
+                continue
+            if field not in self.lastValues or exceedsDeadband(value, self.lastValues[field], band):
+                changed[field] = value
+
+        fullSize = self.sizeFunc(payload)
+        if not changed:
+            self.suppressedMsgCnt += 1
+            self.suppressedByteCnt += fullSize
+            return None
+
+        # only the fields that went out become the new reference values, so a slow
+        # drift still gets reported once it adds up to more than the deadband
+        self.lastValues.update(changed)
+        for field in self.identityFields:
+            if field in payload:
+                changed[field] = payload[field]
+        self.suppressedByteCnt += max(fullSize - self.sizeFunc(changed), 0)
+        self.sentCnt += 1
+        return changed
+
+    def stats(self):
+        return {
+            'sent_msgs': self.sentCnt,
+            'suppressed_msgs': self.suppressedMsgCnt,
+            'suppressed_bytes': self.suppressedByteCnt
+        }
@@ -0,0 +1,138 @@
+# Copyright 2018. Amazon Web Services, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import socket
+import ssl
+import threading
+import time
+
+# Picks the Greengrass core address to connect to.
+# A Greengrass group can list several host:port pairs for its core, some of them
+# stale. Instead of trying each with a full MQTT connect timeout, every candidate
+# gets a TCP connect (and, given a TLS context, a handshake) probe, happy-eyeballs
+# style: the first starts at once, each next one staggerSec later or as soon as
+# nothing is in flight, all under one deadline. Once a probe succeeds the others
+# get settleSec to finish, so the ranking still covers the close runners up.
+#
+# rankEndpoints() returns every candidate: the reachable ones fastest first, then
+# the rest in candidate order with the reason they failed. Candidates come from the
+# discovery info with the previous ranking first, so the best core from the last
+# boot gets the head start.
+
+
+def endpointCandidates(ggInfo, excludeHosts=("127.0.0.1", "::1")):
+    # [(host, port)] from the discovery info, ordered by the stored ranking
+    discovered = []
+    for ggg in ggInfo.get('GGGroups', []):
+        for core in ggg.get('Cores', []):
+            for conn in core.get('Connectivity', []):
+                endpoint = (conn['HostAddress'], int(conn['PortNumber']))
+                if endpoint[0] not in excludeHosts and endpoint not in discovered:
+                    discovered.append(endpoint)
+
+    ranked = []
+    for entry in ggInfo.get('LAST_Ranking', []):
+        endpoint = (entry.get('host'), int(entry.get('port', 0)))
+        if endpoint in discovered and endpoint not in ranked and entry.get('latency_ms') is not None:
+            ranked.append(endpoint)
+    return ranked + [endpoint for endpoint in discovered if endpoint not in ranked]
+
+
+def makeTlsContext(caPath, certPath, keyPath):
+    # mutual TLS like the MQTT client; None when the files aren't usable (TCP probes only)
+    try:
+        context = ssl.create_default_context(cafile=caPath)
+        context.load_cert_chain(certPath, keyPath)
+    except (IOError, OSError, ssl.SSLError) as e:
+        print("TLS endpoint probes disabled: " + str(e))
+        return None
+    # cores are usually listed by IP address, which their certificate may not name
+    context.check_hostname = False
+    return context
+
+
+def probeEndpoint(host, port, timeoutSec, tlsContext=None):
+    # connect time in ms; raises on failure
+    start = time.monotonic()
+    sock = socket.create_connection((host, port), timeoutSec)
+    try:
+        if tlsContext is not None:
+            sock.settimeout(max(timeoutSec - (time.monotonic() - start), 0.01))
+            sock = tlsContext.wrap_socket(sock, server_hostname=host)
+        return (time.monotonic() - start) * 1000
+    finally:
+        sock.close()
+
+
+def rankEndpoints(candidates, deadlineSec=2.0, staggerSec=0.25, settleSec=0.2, tlsContext=None,
+                  probeFunc=probeEndpoint, clock=time.monotonic):
+    # [{'host', 'port', 'latency_ms', 'error'}]; reachable ones first, fastest first
+    lock = threading.Condition()
+    start = clock()
+    deadline = start + deadlineSec
+    results = {}
+    state = {'inFlight': 0, 'firstOk': None}
+
+    def probe(index, host, port):
+        try:
+            latencyMs = probeFunc(host, port, max(deadline - clock(), 0.01), tlsContext)
+            result = {'host': host, 'port': port, 'latency_ms': round(latencyMs, 1), 'error': None}
+        except Exception as e:
+            result = {'host': host, 'port': port, 'latency_ms': None, 'error': str(e) or type(e).__name__}
+        with lock:
+            if index not in results:
+                results[index] = result
+                if result['latency_ms'] is not None and state['firstOk'] is None:
+                    state['firstOk'] = clock()
+            state['inFlight'] -= 1
+            lock.notify_all()
+
+    nextIndex = 0
+    nextStart = start
+    with lock:
+        while True:
+            now = clock()
+            if now >= deadline:
+                break
+            if state['firstOk'] is not None and (now >= state['firstOk'] + settleSec or len(results) == nextIndex):
+                break
+            if nextIndex == len(candidates) and len(results) == nextIndex:
+                break
+            if nextIndex < len(candidates) and state['firstOk'] is None and \
+                    (now >= nextStart or state['inFlight'] == 0):
+                host, port = candidates[nextIndex]
+                state['inFlight'] += 1
+                worker = threading.Thread(target=probe, args=(nextIndex, host, port), name="EndpointProbe")
+                worker.daemon = True
+                worker.start()
+                nextIndex += 1
+                nextStart = now + staggerSec
+                continue
+            wakeAt = deadline
+            if state['firstOk'] is not None:
+                wakeAt = min(wakeAt, state['firstOk'] + settleSec)
+            elif nextIndex < len(candidates):
+                wakeAt = min(wakeAt, nextStart)
+            lock.wait(max(wakeAt - now, 0.001))
+
+        # probes still running past the deadline are abandoned
+        ranking = [results[i] for i in sorted(results) if results[i]['latency_ms'] is not None]
+        ranking.sort(key=lambda result: result['latency_ms'])
+        for index, (host, port) in enumerate(candidates):
+            if index not in results:
+                error = 'timeout' if index < nextIndex else 'not probed'
+                ranking.append({'host': host, 'port': port, 'latency_ms': None, 'error': error})
+            elif results[index]['latency_ms'] is None:
+                ranking.append(results[index])
+        return ranking
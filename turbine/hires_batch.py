@@ -0,0 +1,111 @@
+# Copyright 2018. Amazon Web Services, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import time
+from datetime import datetime
+import numpy as np
+
+# Batched hi-res vibration publishing.
+# Samples from consecutive vibration windows are collected and sent as one columnar
+# message: a base timestamp, the sample period and parallel x/y/z/magnitude arrays.
+# A batch is flushed when it reaches the size limit or its oldest sample the age limit.
+
+# decimals kept per sample, well below the MPU6050 noise floor
+hiResDecimals = 4
+
+
+def roundSamples(values):
+    # widen first, float32 values would serialize with spurious trailing digits
+    return np.round(values.astype(np.float64), hiResDecimals).tolist()
+
+
+class HiResBatcher(object):
+    def __init__(self, publishFunc, header, maxSamples=1000, maxAgeSec=10):
+        # publishFunc(payloadDict) sends one batch; header holds the identity fields
+        self.publishFunc = publishFunc
+        self.header = header
+        self.maxSamples = int(maxSamples)
+        self.maxAgeSec = float(maxAgeSec)
+        self.pending = []
+        self.pendingCnt = 0
+        self.lastT = None
+        self.loopCnt = 0
+        self.batchCnt = 0
+        self.sampleCnt = 0
+
+    def configure(self, maxSamples=None, maxAgeSec=None):
+        if maxSamples is not None:
+            self.maxSamples = max(int(maxSamples), 1)
+        if maxAgeSec is not None:
+            self.maxAgeSec = float(maxAgeSec)
+
+    def add(self, window, magnitude, loopCnt):
+        if len(window) == 0:
+            return
+        self.loopCnt = loopCnt
+
+        # a gap between windows (idle, sampler resync) breaks the fixed period
+        # assumption, so close out the current batch first
+        if self.lastT is not None and len(window) > 1:
+            period = (window.t[-1] - window.t[0]) / (len(window) - 1)
+            if window.t[0] - self.lastT > 2.5 * period:
+                self.flush()
+
+        self.pending.append((window.t, window.x, window.y, window.z, magnitude))
+        self.pendingCnt += len(window)
+        self.lastT = window.t[-1]
+        while self.pendingCnt >= self.maxSamples:
+            self.flush(self.maxSamples)
+
+    def flushIfDue(self):
+        if self.pendingCnt > 0 and time.monotonic() - self.pending[0][0][0] >= self.maxAgeSec:
+            self.flush()
+
+    def flush(self, sampleCnt=None):
+        if self.pendingCnt == 0:
+            return
+        t, x, y, z, mag = [np.concatenate(col) for col in zip(*self.pending)]
+        if sampleCnt is None or sampleCnt >= len(t):
+            sampleCnt = len(t)
+            self.pending = []
+            self.lastT = None
+        else:
+            # keep the remainder for the next batch
+            self.pending = [(t[sampleCnt:], x[sampleCnt:], y[sampleCnt:], z[sampleCnt:], mag[sampleCnt:])]
+            self.lastT = t[-1]
+        self.pendingCnt -= sampleCnt
+
+        self.publishFunc(self.buildPayload(t[:sampleCnt], x[:sampleCnt], y[:sampleCnt], z[:sampleCnt], mag[:sampleCnt]))
+        self.batchCnt += 1
+        self.sampleCnt += sampleCnt
+
+    def buildPayload(self, t, x, y, z, mag):
+        # sample times are monotonic, convert the first one to wall clock time
+        wallOffset = time.time() - time.monotonic()
+        if len(t) > 1:
+            periodMs = (t[-1] - t[0]) / (len(t) - 1) * 1000
+        else:
+            periodMs = 0
+        payload = dict(self.header)
+        payload.update({
+            'timestamp': str(datetime.utcfromtimestamp(t[0] + wallOffset).isoformat()),
+            'loop_cnt': self.loopCnt,
+            'sample_period_ms': round(periodMs, 4),
+            'sample_cnt': len(t),
+            'turbine_vibe_x': roundSamples(x),
+            'turbine_vibe_y': roundSamples(y),
+            'turbine_vibe_z': roundSamples(z),
+            'turbine_vibe': roundSamples(mag)
+        })
+        return payload
@@ -0,0 +1,139 @@
+# Copyright 2018. Amazon Web Services, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+
+# MPU6050 FIFO acquisition.
+# The sensor paces accelerometer samples into its 1024 byte FIFO at the configured
+# output data rate and the host drains it in block reads, instead of one set of
+# register reads per sample.
+
+try:
+    # smbus2 can issue a single combined transaction for the whole FIFO
+    from smbus2 import i2c_msg
+except ImportError:
+    i2c_msg = None
+
+# MPU6050 registers
+SMPLRT_DIV = 0x19
+CONFIG = 0x1A
+ACCEL_CONFIG = 0x1C
+FIFO_EN = 0x23
+INT_ENABLE = 0x38
+INT_STATUS = 0x3A
+USER_CTRL = 0x6A
+PWR_MGMT_1 = 0x6B
+FIFO_COUNTH = 0x72
+FIFO_R_W = 0x74
+
+ACCEL_FIFO_EN = 0x08
+FIFO_OFLOW_INT = 0x10
+USER_CTRL_FIFO_EN = 0x40
+USER_CTRL_FIFO_RESET = 0x04
+
+# with the DLPF enabled the internal sample clock is 1 kHz, divided by 1 + SMPLRT_DIV
+DLPF_CFG_184HZ = 0x01
+INTERNAL_RATE_HZ = 1000.0
+
+FIFO_SIZE = 1024
+FRAME_SIZE = 6  # accel X, Y, Z as big endian int16
+SMBUS_BLOCK_SIZE = 30  # largest whole number of frames in a 32 byte SMBus block read
+RDWR_BLOCK_SIZE = 1020  # largest whole number of frames that fits in the FIFO
+
+GRAVITY_MS2 = 9.80665
+
+# LSB per g for each ACCEL_CONFIG full scale range setting
+accelScaleLsb = {
+    0x00: 16384.0,
+    0x08: 8192.0,
+    0x10: 4096.0,
+    0x18: 2048.0
+}
+
+
+class FifoOverflow(Exception):
+    pass
+
+
+class Mpu6050Fifo(object):
+    def __init__(self, bus, address=0x68, sampleRateHz=500):
+        # bus is an smbus.SMBus/smbus2.SMBus style object, e.g. mpu6050().bus
+        self.bus = bus
+        self.address = address
+        self.divider = int(min(max(round(INTERNAL_RATE_HZ / sampleRateHz) - 1, 0), 255))
+        self.outputRateHz = INTERNAL_RATE_HZ / (1 + self.divider)
+        self.samplePeriod = 1.0 / self.outputRateHz
+        self.scale = GRAVITY_MS2 / accelScaleLsb[0x00]
+        self.offsets = (0.0, 0.0, 0.0)
+        self.overflowCnt = 0
+        self.useRdwr = i2c_msg is not None and hasattr(bus, 'i2c_rdwr')
+
+    def start(self):
+        # configure the sample rate divider and route only the accelerometer into the FIFO
+        self.bus.write_byte_data(self.address, PWR_MGMT_1, 0x00)
+        config = self.bus.read_byte_data(self.address, CONFIG)
+        self.bus.write_byte_data(self.address, CONFIG, (config & ~0x07) | DLPF_CFG_184HZ)
+        self.bus.write_byte_data(self.address, SMPLRT_DIV, self.divider)
+        accelRange = self.bus.read_byte_data(self.address, ACCEL_CONFIG) & 0x18
+        self.scale = GRAVITY_MS2 / accelScaleLsb[accelRange]
+        self.bus.write_byte_data(self.address, FIFO_EN, ACCEL_FIFO_EN)
+        self.bus.write_byte_data(self.address, INT_ENABLE, FIFO_OFLOW_INT)
+        self.reset()
+
+    def stop(self):
+        self.bus.write_byte_data(self.address, FIFO_EN, 0x00)
+        self.bus.write_byte_data(self.address, USER_CTRL, 0x00)
+
+    def reset(self):
+        # disable, flush and re-enable the FIFO; also clears a latched overflow
+        self.bus.write_byte_data(self.address, USER_CTRL, 0x00)
+        self.bus.write_byte_data(self.address, USER_CTRL, USER_CTRL_FIFO_RESET)
+        self.bus.write_byte_data(self.address, USER_CTRL, USER_CTRL_FIFO_EN)
+        self.bus.read_byte_data(self.address, INT_STATUS)
+
+    def readBlock(self, register, length):
+        if self.useRdwr:
+            write = i2c_msg.write(self.address, [register])
+            read = i2c_msg.read(self.address, length)
+            self.bus.i2c_rdwr(write, read)
+            return bytes(bytearray(read))
+        return bytes(bytearray(self.bus.read_i2c_block_data(self.address, register, length)))
+
+    def fifoCount(self):
+        countBytes = bytearray(self.bus.read_i2c_block_data(self.address, FIFO_COUNTH, 2))
+        return (countBytes[0] << 8) | countBytes[1]
+
+    def drain(self):
+        # returns calibrated (x, y, z) float32 arrays in m/s^2, oldest sample first
+        status = self.bus.read_byte_data(self.address, INT_STATUS)
+        count = self.fifoCount()
+        if status & FIFO_OFLOW_INT or count >= FIFO_SIZE:
+            # samples were dropped and the frame alignment is unknown, start over
+            self.overflowCnt += 1
+            self.reset()
+            raise FifoOverflow("MPU6050 FIFO overflow after " + str(count) + " bytes")
+
+        count -= count % FRAME_SIZE
+        blockSize = RDWR_BLOCK_SIZE if self.useRdwr else SMBUS_BLOCK_SIZE
+        chunks = []
+        while count > 0:
+            length = min(count, blockSize)
+            chunks.append(self.readBlock(FIFO_R_W, length))
+            count -= length
+
+        raw = np.frombuffer(b''.join(chunks), dtype='>i2').reshape(-1, 3)
+        accel = raw.astype(np.float32) * np.float32(self.scale)
+        return (accel[:, 0] - np.float32(self.offsets[0]),
+                accel[:, 1] - np.float32(self.offsets[1]),
+                accel[:, 2] - np.float32(self.offsets[2]))
@@ -28,6 +28,10 @@ from PIL import ImageFont
 import subprocess
 import RPi.GPIO as GPIO
 import time
+import os.path
+# modules shared with the weather program live in common/ at the top of the repo
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.sys_stats import SysStats
 
 # Raspberry Pi pin configuration:
 RST = None     # on the PiOLED this pin isnt used
@@ -35,6 +39,12 @@ lastMessage = ""
 
 # 128x64 display with hardware I2C:
 disp = Adafruit_SSD1306.SSD1306_128_64(rst=RST)
+
+# the image, drawing object and font are reused for every refresh
+image = Image.new('1', (disp.width, disp.height))
+draw = ImageDraw.Draw(image)
+font = ImageFont.load_default()
+sysStats = SysStats()
 oledConnected = False
 PulseCount=0
 HallEffect_PIN = 26 #pin 37
@@ -188,47 +198,26 @@ def processDiagResult(aResult):
 
 def updateOLED(aMessage = None):
     global lastMessage
-    # Create blank image for drawing.
-    # Make sure to create image with mode '1' for 1-bit color.
     width = disp.width
     height = disp.height
-    image = Image.new('1', (width, height))
-
-    # Get drawing object to draw on image.
-    draw = ImageDraw.Draw(image)
-
-    # Draw a black filled box to clear the image.
-    draw.rectangle((0,0,width,height), outline=0, fill=0)
 
-    # Draw some shapes.
     # First define some constants to allow easy resizing of shapes.
     padding = -2
     top = padding
-    bottom = height-padding
     # Move left to right keeping track of the current x position for drawing shapes.
     x = 0
 
-    # Load default font.
-    font = ImageFont.load_default()
-
     # Draw a black filled box to clear the image.
     draw.rectangle((0,0,width,height), outline=0, fill=0)
 
-    # Shell scripts for system monitoring from here : https://unix.stackexchange.com/questions/119126/command-to-display-memory-usage-disk-usage-and-cpu-load
-    cmd = "hostname -I | cut -d\' \' -f1"
-    IP = subprocess.check_output(cmd, shell = True )
-    cmd = "top -bn1 | grep load | awk '{printf \"CPU Load: %.2f\", $(NF-2)}'"
-    CPU = subprocess.check_output(cmd, shell = True )
-    cmd = "free -m | awk 'NR==2{printf \"Mem: %s/%sMB %.2f%%\", $3,$2,$3*100/$2 }'"
-    MemUsage = subprocess.check_output(cmd, shell = True )
-    cmd = "df -h | awk '$NF==\"/\"{printf \"Disk: %d/%dGB %s\", $3,$2,$5}'"
-    Disk = subprocess.check_output(cmd, shell = True )
+    # IP, CPU load, memory and disk usage, read in process instead of shell pipelines
+    IP, CPU, MemUsage, Disk = sysStats.lines()
 
     # Write two lines of text.
-    draw.text((x, top),       "IP: " + str(IP),  font=font, fill=255)
-    draw.text((x, top+8),     str(CPU), font=font, fill=255)
-    draw.text((x, top+16),    str(MemUsage),  font=font, fill=255)
-    draw.text((x, top+25),    str(Disk),  font=font, fill=255)
+    draw.text((x, top),       IP,  font=font, fill=255)
+    draw.text((x, top+8),     CPU, font=font, fill=255)
+    draw.text((x, top+16),    MemUsage,  font=font, fill=255)
+    draw.text((x, top+25),    Disk,  font=font, fill=255)
 
     #Diagnostic test result
     if aMessage == None:
@@ -0,0 +1,268 @@
+# Copyright 2018. Amazon Web Services, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import math
+import threading
+import time
+import numpy as np
+from PIL import Image
+from PIL import ImageDraw
+
+# Retained-mode SSD1306 renderer.
+# Static text and field labels are drawn once into a background image. Each field
+# value is rendered into its own small strip, and a strip is only redrawn when the
+# field's text changes. A frame is the background with the strips pasted on top,
+# packed into the controller's page layout (8 pixel rows per byte, LSB at the top)
+# and compared with what the panel already shows. Only the changed columns of the
+# changed pages are sent, with consecutive dirty pages merged into one
+# COLUMNADDR/PAGEADDR window, instead of the 1024 byte full buffer.
+#
+# OledRenderWorker owns the renderer on its own thread. Callers (MQTT callbacks, the
+# brake path, the sampling loop) only post field values; values posted while a frame
+# is being drawn are merged so only the newest state is drawn, at most maxFps times a
+# second. I2C errors are counted and retried with a backoff, never raised to callers.
+#
+# The column windows need the Adafruit driver's private I2C device. PanelBus is the
+# only code that touches it; a panel without one (SPI, or a driver version that no
+# longer has _i2c) gets whole frames through the public image()/display() calls.
+
+ssd1306ColumnAddr = 0x21
+ssd1306PageAddr = 0x22
+i2cDataControl = 0x40
+i2cChunkSize = 16
+
+
+def textWidth(draw, text, font):
+    # textsize() is gone from newer Pillow, textlength() is missing from older ones
+    if hasattr(draw, 'textlength'):
+        return int(math.ceil(draw.textlength(text, font=font)))
+    return draw.textsize(text, font=font)[0]
+
+
+def textHeight(draw, font):
+    if hasattr(draw, 'textbbox'):
+        return draw.textbbox((0, 0), "Ag", font=font)[3]
+    return draw.textsize("Ag", font=font)[1]
+
+
+class PanelBus(object):
+    def __init__(self, display):
+        self.display = display
+        i2c = getattr(display, '_i2c', None)
+        self.writeListFunc = getattr(i2c, 'writeList', None)
+
+    def canWriteWindows(self):
+        return self.writeListFunc is not None
+
+    def writeWindow(self, data, p0, p1, c0, c1):
+        # returns the I2C bytes written: address byte plus control byte on every write
+        for c in (ssd1306ColumnAddr, c0, c1, ssd1306PageAddr, p0, p1):
+            self.display.command(c)
+        for i in range(0, len(data), i2cChunkSize):
+            self.writeListFunc(i2cDataControl, data[i:i + i2cChunkSize])
+        return 6 * 3 + len(data) + 2 * int(math.ceil(len(data) / float(i2cChunkSize)))
+
+    def writeFrame(self, frame):
+        self.display.image(frame)
+        self.display.display()
+
+
+class OledRenderer(object):
+    def __init__(self, display, font):
+        self.display = display
+        self.bus = PanelBus(display)
+        self.font = font
+        self.width = display.width
+        self.height = display.height
+        self.pages = self.height // 8
+
+        self.background = Image.new('1', (self.width, self.height))
+        self.backgroundDraw = ImageDraw.Draw(self.background)
+        self.lineHeight = textHeight(self.backgroundDraw, font)
+
+        # name -> [x, y, strip image, current text]
+        self.fields = {}
+        self.fieldOrder = []
+        self.lastPages = None
+
+        self.updateCnt = 0
+        self.bytesSent = 0
+        self.lastBytes = 0
+        self.lastRenderMs = 0.0
+
+    def addStatic(self, x, y, text):
+        self.backgroundDraw.text((x, y), text, font=self.font, fill=255)
+        self.lastPages = None
+
+    def addField(self, name, x, y, label=""):
+        # the label goes into the background, the value is drawn right after it
+        if label:
+            self.addStatic(x, y, label)
+            x += textWidth(self.backgroundDraw, label, self.font)
+        strip = Image.new('1', (self.width - x, self.lineHeight))
+        self.fields[name] = [x, y, strip, None]
+        self.fieldOrder.append(name)
+
+    def setField(self, name, text):
+        field = self.fields[name]
+        text = str(text)
+        if text == field[3]:
+            return False
+        strip = field[2]
+        draw = ImageDraw.Draw(strip)
+        draw.rectangle((0, 0, strip.size[0], strip.size[1]), outline=0, fill=0)
+        draw.text((0, 0), text, font=self.font, fill=255)
+        field[3] = text
+        return True
+
+    def invalidate(self):
+        # resend everything next update, e.g. after something else wrote to the panel
+        self.lastPages = None
+
+    def composeFrame(self):
+        frame = self.background.copy()
+        for name in self.fieldOrder:
+            x, y, strip, text = self.fields[name]
+            if text:
+                frame.paste(255, (x, y, x + strip.size[0], y + strip.size[1]), strip)
+        return frame
+
+    def packPages(self, frame):
+        # (pages, width) bytes with bit n of a byte being row page*8+n
+        # rows reversed so the top row lands in the LSB; packbits(bitorder=) needs numpy 1.17
+        pixels = np.array(frame, dtype=np.uint8).reshape(self.pages, 8, self.width)
+        return np.packbits(pixels[:, ::-1, :], axis=1).reshape(self.pages, self.width)
+
+    def dirtyWindows(self, pages):
+        # [(firstPage, lastPage, firstColumn, lastColumn)] covering every changed byte
+        if self.lastPages is None:
+            return [(0, self.pages - 1, 0, self.width - 1)]
+        windows = []
+        changed = pages != self.lastPages
+        for page in range(self.pages):
+            columns = np.flatnonzero(changed[page])
+            if len(columns) == 0:
+                continue
+            c0, c1 = int(columns[0]), int(columns[-1])
+            if windows and windows[-1][1] == page - 1:
+                p0, p1, w0, w1 = windows[-1]
+                windows[-1] = (p0, page, min(w0, c0), max(w1, c1))
+            else:
+                windows.append((page, page, c0, c1))
+        return windows
+
+    def sendWindow(self, pages, window):
+        p0, p1, c0, c1 = window
+        # horizontal addressing wraps to the next page at the end of the column window
+        data = pages[p0:p1 + 1, c0:c1 + 1].ravel().tolist()
+        return self.bus.writeWindow(data, p0, p1, c0, c1)
+
+    def update(self, values=None):
+        # values maps field name -> text; returns the number of I2C bytes written
+        started = time.monotonic()
+        for name, text in (values or {}).items():
+            self.setField(name, text)
+        frame = self.composeFrame()
+        pages = self.packPages(frame)
+
+        sent = 0
+        if not self.bus.canWriteWindows():
+            # full buffer through the driver, only when something changed
+            if self.lastPages is None or (pages != self.lastPages).any():
+                self.bus.writeFrame(frame)
+                sent = pages.size
+        else:
+            for window in self.dirtyWindows(pages):
+                sent += self.sendWindow(pages, window)
+        self.lastPages = pages
+
+        self.updateCnt += 1
+        self.bytesSent += sent
+        self.lastBytes = sent
+        self.lastRenderMs = (time.monotonic() - started) * 1000
+        return sent
+
+
+class OledRenderWorker(threading.Thread):
+    def __init__(self, renderer, maxFps=4, maxBackoffSec=30.0):
+        threading.Thread.__init__(self, name="OledRenderWorker")
+        self.daemon = True
+        self.renderer = renderer
+        self.minIntervalSec = 1.0 / maxFps
+        self.maxBackoffSec = maxBackoffSec
+
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.wakeEvent = threading.Event()
+        self.running = False
+
+        self.postCnt = 0
+        self.renderCnt = 0
+        self.errorCnt = 0
+        self.lastError = None
+
+    def post(self, values):
+        # never blocks on the display; newer values replace pending ones
+        with self.lock:
+            self.pending.update(values)
+            self.postCnt += 1
+        self.wakeEvent.set()
+
+    def takePending(self):
+        with self.lock:
+            values = self.pending
+            self.pending = {}
+            self.wakeEvent.clear()
+        return values
+
+    def run(self):
+        self.running = True
+        lastRender = 0.0
+        backoffSec = 0.0
+        retry = False
+        while self.running:
+            if not retry:
+                self.wakeEvent.wait()
+            if not self.running:
+                break
+            # rate limit; anything posted meanwhile is folded into this frame
+            delay = lastRender + max(self.minIntervalSec, backoffSec) - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            values = self.takePending()
+            lastRender = time.monotonic()
+            try:
+                self.renderer.update(values)
+            except Exception as e:
+                # the strips already hold the new text, so a retry resends what's missing
+                self.renderer.invalidate()
+                self.errorCnt += 1
+                if self.lastError is None:
+                    print("OLED update failed, will keep retrying: " + str(e))
+                self.lastError = str(e)
+                backoffSec = min(max(backoffSec * 2, 1.0), self.maxBackoffSec)
+                retry = True
+            else:
+                if self.lastError is not None:
+                    print("OLED updates recovered after " + str(self.errorCnt) + " errors")
+                self.lastError = None
+                self.renderCnt += 1
+                backoffSec = 0.0
+                retry = False
+
+    def stop(self, timeoutSec=2.0):
+        self.running = False
+        self.wakeEvent.set()
+        if self.is_alive():
+            self.join(timeoutSec)
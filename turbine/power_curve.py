@@ -0,0 +1,140 @@
+# Copyright 2018. Amazon Web Services, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import time
+import numpy as np
+
+# On-device power curves.
+# Every publish interval is sorted into a fixed bin of an x variable (turbine speed,
+# or wind speed when a local wind source is available) and the count, mean and M2
+# of the binned values are updated with Welford's algorithm, so the table stays the
+# same size however many months of data go into it. The arrays are checkpointed to
+# disk with an atomic rename and reloaded on start, and a summary of the non-empty
+# bins goes out periodically.
+
+
+class BinnedCurve(object):
+    def __init__(self, name, binWidth, binCnt, fields):
+        self.name = name
+        self.binWidth = float(binWidth)
+        self.binCnt = int(binCnt)
+        self.fields = list(fields)
+        self.count = np.zeros(self.binCnt, dtype=np.int64)
+        self.mean = np.zeros((self.binCnt, len(self.fields)), dtype=np.float64)
+        self.m2 = np.zeros((self.binCnt, len(self.fields)), dtype=np.float64)
+
+    def binIndex(self, x):
+        # values past the last bin land in it rather than being dropped
+        return min(max(int(x // self.binWidth), 0), self.binCnt - 1)
+
+    def add(self, x, values):
+        idx = self.binIndex(x)
+        values = np.asarray(values, dtype=np.float64)
+        self.count[idx] += 1
+        delta = values - self.mean[idx]
+        self.mean[idx] += delta / self.count[idx]
+        self.m2[idx] += delta * (values - self.mean[idx])
+
+    def summary(self, decimals=4):
+        # [bin start, count, mean per field..., std per field...] for every non-empty bin
+        bins = []
+        for idx in np.flatnonzero(self.count):
+            n = int(self.count[idx])
+            std = np.sqrt(self.m2[idx] / (n - 1)) if n > 1 else np.zeros(len(self.fields))
+            bins.append([round(float(idx * self.binWidth), 3), n] +
+                        [round(float(v), decimals) for v in self.mean[idx]] +
+                        [round(float(v), decimals) for v in std])
+        return {
+            'x': self.name,
+            'bin_width': self.binWidth,
+            'fields': self.fields,
+            'bins': bins
+        }
+
+    def state(self):
+        prefix = self.name + '_'
+        return {
+            prefix + 'layout': np.array([self.binWidth, self.binCnt, len(self.fields)]),
+            prefix + 'count': self.count,
+            prefix + 'mean': self.mean,
+            prefix + 'm2': self.m2
+        }
+
+    def restore(self, saved):
+        # only a checkpoint with the same bin layout is restored
+        prefix = self.name + '_'
+        if prefix + 'layout' not in saved:
+            return False
+        binWidth, binCnt, fieldCnt = saved[prefix + 'layout']
+        if binWidth != self.binWidth or binCnt != self.binCnt or fieldCnt != len(self.fields):
+            return False
+        self.count = saved[prefix + 'count'].copy()
+        self.mean = saved[prefix + 'mean'].copy()
+        self.m2 = saved[prefix + 'm2'].copy()
+        return True
+
+
+class PowerCurveEngine(object):
+    def __init__(self, checkpointPath, rpmBinWidth=50, rpmBinCnt=40, windBinWidth=1, windBinCnt=40,
+                 checkpointSec=300, summarySec=3600):
+        self.checkpointPath = checkpointPath
+        self.checkpointSec = checkpointSec
+        self.summarySec = summarySec
+        self.rpmCurve = BinnedCurve('rpm', rpmBinWidth, rpmBinCnt, ['voltage', 'power_w'])
+        self.windCurve = BinnedCurve('wind', windBinWidth, windBinCnt, ['rpm', 'voltage', 'power_w'])
+        self.curves = [self.rpmCurve, self.windCurve]
+        self.lastCheckpoint = time.monotonic()
+        self.lastSummary = time.monotonic()
+        self.dirty = False
+
+    def load(self):
+        # returns the number of curves restored from the checkpoint
+        if not os.path.exists(self.checkpointPath):
+            return 0
+        try:
+            with np.load(self.checkpointPath) as saved:
+                return sum(1 for curve in self.curves if curve.restore(saved))
+        except Exception as e:
+            print("Power curve checkpoint could not be loaded: " + str(e))
+            return 0
+
+    def checkpoint(self):
+        # write to a temp file and rename so a power cut never leaves a torn checkpoint
+        state = {}
+        for curve in self.curves:
+            state.update(curve.state())
+        tmpPath = self.checkpointPath + '.tmp'
+        with open(tmpPath, 'wb') as outfile:
+            np.savez(outfile, **state)
+            outfile.flush()
+            os.fsync(outfile.fileno())
+        os.replace(tmpPath, self.checkpointPath)
+        self.lastCheckpoint = time.monotonic()
+        self.dirty = False
+
+    def add(self, rpm, voltage, powerW, wind=None):
+        self.rpmCurve.add(rpm, (voltage, powerW))
+        if wind is not None:
+            self.windCurve.add(wind, (rpm, voltage, powerW))
+        self.dirty = True
+        if time.monotonic() - self.lastCheckpoint >= self.checkpointSec:
+            self.checkpoint()
+
+    def summaryDue(self):
+        return time.monotonic() - self.lastSummary >= self.summarySec
+
+    def buildSummary(self):
+        self.lastSummary = time.monotonic()
+        return dict((curve.name, curve.summary()) for curve in self.curves if curve.count.any())
@@ -0,0 +1,89 @@
+# Copyright 2018. Amazon Web Services, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+
+# Rotor timing features from the rotation sensor edges of one publish interval.
+# The pulse periods give the period spread (coefficient of variation), the
+# cycle-to-cycle jitter, a histogram of period deviations and the strongest
+# autocorrelation peak of the detrended period series. A clear peak is a speed
+# ripple repeating every ripple_lag pulses, typically blade imbalance (lag equal
+# to the pulses per revolution) or a dragging brake. It costs nothing beyond the
+# edge times the speed estimate already records.
+
+# histogram bin edges, period deviation from the interval mean in percent
+periodHistEdges = [-5, -2, -1, -0.5, 0, 0.5, 1, 2, 5]
+
+
+class RevolutionAnalyzer(object):
+    def __init__(self, estimator, minPeriods=8, maxLag=16, rippleThreshold=0.5, rippleMinCv=0.005):
+        # estimator is the RpmEstimator whose edge ring is analyzed
+        self.estimator = estimator
+        self.minPeriods = minPeriods
+        self.maxLag = maxLag
+        self.rippleThreshold = rippleThreshold
+        self.rippleMinCv = rippleMinCv
+        self.readCnt = 0
+
+    def analyze(self):
+        # features for the edges since the previous call, None with too few pulses;
+        # at high speed only the newest ring's worth of edges is used
+        writeCnt = self.estimator.writeCnt
+        edges = self.estimator.recentEdges(writeCnt - self.readCnt + 1)
+        self.readCnt = writeCnt
+        periods = np.diff(np.asarray(edges, dtype=np.float64)) / 1e6
+        periods = periods[(periods > 0) & (periods < self.estimator.stallNs / 1e6)]
+        return analyzePeriods(periods, self.minPeriods, self.maxLag, self.rippleThreshold, self.rippleMinCv)
+
+
+def analyzePeriods(periods, minPeriods=8, maxLag=16, rippleThreshold=0.5, rippleMinCv=0.005):
+    # periods in milliseconds, oldest first
+    n = len(periods)
+    if n < minPeriods:
+        return None
+    mean = float(np.mean(periods))
+    std = float(np.std(periods))
+    cv = std / mean
+    jitter = float(np.sqrt(np.mean(np.square(np.diff(periods)))))
+
+    deviation = (periods - mean) / mean * 100
+    hist = np.bincount(np.searchsorted(periodHistEdges, deviation), minlength=len(periodHistEdges) + 1)
+
+    # remove the spin up/down trend so it doesn't show up as correlation at every lag
+    idx = np.arange(n)
+    detrended = periods - np.polyval(np.polyfit(idx, periods, 1), idx)
+    power = float(np.dot(detrended, detrended))
+    rippleLag = 0
+    ripple = 0.0
+    if power > 1e-12:
+        lagCnt = min(maxLag, n // 3)
+        acf = [float(np.dot(detrended[:-k], detrended[k:])) / power for k in range(1, lagCnt + 1)]
+        # strongest local peak; the ends count as peaks when the neighbour is lower
+        for k in range(len(acf)):
+            prev = acf[k - 1] if k > 0 else -1.0
+            nxt = acf[k + 1] if k + 1 < len(acf) else -1.0
+            if acf[k] >= prev and acf[k] >= nxt and acf[k] > ripple:
+                rippleLag = k + 1
+                ripple = acf[k]
+
+    return {
+        'n': n,
+        'period_ms': round(mean, 3),
+        'cv': round(cv, 5),
+        'jitter_ms': round(jitter, 3),
+        'hist': hist.tolist(),
+        'ripple_lag': rippleLag,
+        'ripple': round(ripple, 3),
+        'ripple_flag': bool(ripple >= rippleThreshold and cv >= rippleMinCv)
+    }
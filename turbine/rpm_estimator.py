@@ -0,0 +1,127 @@
+# Copyright 2018. Amazon Web Services, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import time
+
+# Turbine speed from rotation sensor edge timestamps.
+# The GPIO callback records time.monotonic_ns() edge times into a ring; the speed is
+# the average over the pulses in the last windowSec (at most maxPulses of them).
+# Below one pulse per window the last full period is used, capped by the time since
+# the last edge so a slowing rotor reads lower right away, and the speed drops to 0
+# after stallSec without a pulse. Glitches are rejected in software instead of with
+# the GPIO bouncetime, which capped the measurable speed at 3000 RPM.
+#
+# The ring is written by the GPIO callback thread only. Readers take the write
+# count first and then the entries below it, so no lock is needed.
+
+nsPerSec = 1000000000
+
+
+class RpmEstimator(object):
+    def __init__(self, pulsesPerRev=1, windowSec=2.0, maxPulses=32, stallSec=10.0, minPulseSec=0.001,
+                 glitchFraction=0.3, capacity=256, clock=time.monotonic_ns):
+        self.pulsesPerRev = pulsesPerRev
+        self.windowNs = int(windowSec * nsPerSec)
+        self.maxPulses = max(int(maxPulses), 2)
+        self.stallNs = int(stallSec * nsPerSec)
+        self.minPulseNs = int(minPulseSec * nsPerSec)
+        self.glitchFraction = glitchFraction
+        self.capacity = capacity
+        self.clock = clock
+
+        self.edges = [0] * capacity
+        self.writeCnt = 0
+        self.lastPeriodNs = 0
+        self.glitchCnt = 0
+        self.rejectRun = 0
+
+        # start of the current publish interval for intervalStats()
+        self.intervalCnt = 0
+
+    def onEdge(self, timestampNs=None):
+        # returns False when the edge was rejected as a glitch
+        if timestampNs is None:
+            timestampNs = self.clock()
+        if self.writeCnt > 0:
+            periodNs = timestampNs - self.edges[(self.writeCnt - 1) % self.capacity]
+            # an edge well inside the current period is contact bounce or noise; a real
+            # speed change can't shorten one revolution that much, but after a few
+            # rejections in a row the reference is dropped in case the speed really did jump
+            limitNs = max(self.minPulseNs, int(self.lastPeriodNs * self.glitchFraction))
+            if periodNs < limitNs and (periodNs < self.minPulseNs or self.rejectRun < 3):
+                self.glitchCnt += 1
+                self.rejectRun += 1
+                return False
+            self.lastPeriodNs = periodNs if periodNs < self.stallNs else 0
+        self.rejectRun = 0
+        self.edges[self.writeCnt % self.capacity] = timestampNs
+        self.writeCnt += 1
+        return True
+
+    def recentEdges(self, count):
+        # newest last; the ring may be overwritten while copying, so re-check the count
+        writeCnt = self.writeCnt
+        count = min(count, writeCnt, self.capacity - 8)
+        edges = [self.edges[i % self.capacity] for i in range(writeCnt - count, writeCnt)]
+        lapped = self.writeCnt - writeCnt
+        return edges[lapped:] if lapped else edges
+
+    def periodsToRpm(self, periodNs):
+        return 60.0 * nsPerSec / (periodNs * self.pulsesPerRev)
+
+    def estimate(self, now=None, windowSec=None):
+        # windowSec overrides the averaging window, e.g. shorter for the brake controller
+        if now is None:
+            now = self.clock()
+        windowNs = self.windowNs if windowSec is None else int(windowSec * nsPerSec)
+        edges = self.recentEdges(self.maxPulses)
+        if len(edges) < 2:
+            return 0
+        sinceLastNs = now - edges[-1]
+        if sinceLastNs >= self.stallNs:
+            return 0
+
+        inWindow = [t for t in edges if now - t <= windowNs]
+        if len(inWindow) >= 2:
+            rpm = self.periodsToRpm((inWindow[-1] - inWindow[0]) / (len(inWindow) - 1))
+        else:
+            # slower than one pulse per window: use the last period
+            lastPeriodNs = edges[-1] - edges[-2]
+            if lastPeriodNs >= self.stallNs:
+                return 0
+            rpm = self.periodsToRpm(lastPeriodNs)
+        # no pulse for longer than the period means the rotor is slower than that now
+        if sinceLastNs > 0:
+            rpm = min(rpm, self.periodsToRpm(sinceLastNs))
+        return rpm
+
+    def intervalStats(self, now=None):
+        # min/max/mean speed over the pulses since the previous call (one publish interval)
+        if now is None:
+            now = self.clock()
+        writeCnt = self.writeCnt
+        newCnt = writeCnt - self.intervalCnt
+        self.intervalCnt = writeCnt
+        edges = self.recentEdges(newCnt + 1)
+        periods = [b - a for a, b in zip(edges, edges[1:]) if 0 < b - a < self.stallNs]
+        current = self.estimate(now)
+        if not periods:
+            return {'min': current, 'max': current, 'mean': current}
+
+        rpms = [self.periodsToRpm(p) for p in periods]
+        return {
+            'min': min(min(rpms), current),
+            'max': max(rpms),
+            'mean': self.periodsToRpm(sum(periods) / len(periods))
+        }
@@ -0,0 +1,160 @@
+# Copyright 2018. Amazon Web Services, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+import time
+import numpy as np
+
+# Timestamped sample ring and the fixed-rate thread that fills it.
+# Shared by the vibration sampler and the voltage capture. The ring is preallocated
+# once: float64 timestamps (the monotonic clock does not fit in float32) and float32
+# value columns. Slots are written and copied out under the lock, so a reader that
+# has fallen a whole buffer behind never sees a slot the writer is part way through;
+# the samples it has lost are counted instead. discard() skips what was written while
+# nobody was going to read it, such as an idle wait.
+
+
+class SampleRing(object):
+    def __init__(self, capacity, columnCnt):
+        self.capacity = max(int(capacity), 16)
+        self.bufT = np.zeros(self.capacity, dtype=np.float64)
+        self.bufs = np.zeros((columnCnt, self.capacity), dtype=np.float32)
+        # total samples written/read; the ring index is the count modulo capacity
+        self.writeCnt = 0
+        self.readCnt = 0
+        self.lock = threading.Lock()
+
+    def write(self, t, values):
+        with self.lock:
+            idx = self.writeCnt % self.capacity
+            self.bufT[idx] = t
+            self.bufs[:, idx] = values
+            self.writeCnt += 1
+
+    def writeBlock(self, t, columns):
+        n = len(t)
+        with self.lock:
+            if n > self.capacity:
+                # only the tail fits; the rest count as written and overwritten, so the reader sees them as lost
+                self.writeCnt += n - self.capacity
+                t = t[-self.capacity:]
+                columns = [column[-self.capacity:] for column in columns]
+                n = self.capacity
+            idx = self.writeCnt % self.capacity
+            first = min(n, self.capacity - idx)
+            self.bufT[idx:idx + first] = t[:first]
+            for buf, column in zip(self.bufs, columns):
+                buf[idx:idx + first] = column[:first]
+            if first < n:
+                self.bufT[:n - first] = t[first:]
+                for buf, column in zip(self.bufs, columns):
+                    buf[:n - first] = column[first:]
+            self.writeCnt += n
+
+    def read(self):
+        # (t, [column, ...], lostCnt) for every sample written since the previous call
+        with self.lock:
+            end = self.writeCnt
+            start = self.readCnt
+            lostCnt = 0
+            if end - start > self.capacity:
+                # the reader fell behind by more than the buffer holds; the oldest were overwritten
+                lostCnt = end - self.capacity - start
+                start = end - self.capacity
+            self.readCnt = end
+
+            # copy out as at most two contiguous slices when the window wraps the ring
+            first = start % self.capacity
+            cnt = end - start
+            if first + cnt <= self.capacity:
+                part = slice(first, first + cnt)
+                return self.bufT[part].copy(), [buf[part].copy() for buf in self.bufs], lostCnt
+            head = slice(first, self.capacity)
+            tail = slice(0, first + cnt - self.capacity)
+            return (np.concatenate((self.bufT[head], self.bufT[tail])),
+                    [np.concatenate((buf[head], buf[tail])) for buf in self.bufs], lostCnt)
+
+    def discard(self):
+        # move the read cursor up to the writer; returns the number of samples skipped
+        with self.lock:
+            skipped = self.writeCnt - self.readCnt
+            self.readCnt = self.writeCnt
+        return skipped
+
+    def pendingCount(self):
+        with self.lock:
+            return min(self.writeCnt - self.readCnt, self.capacity)
+
+
+class RingSampler(threading.Thread):
+    def __init__(self, name, readFunc, sampleRateHz, capacity, columnCnt):
+        threading.Thread.__init__(self, name=name)
+        self.daemon = True
+
+        # readFunc returns a tuple of columnCnt values or raises on a bus error
+        self.readFunc = readFunc
+        self.sampleRateHz = float(sampleRateHz)
+        self.samplePeriod = 1.0 / self.sampleRateHz
+        if capacity is None:
+            capacity = int(self.sampleRateHz * 30)
+        self.ring = SampleRing(capacity, columnCnt)
+        self.capacity = self.ring.capacity
+        self.lock = self.ring.lock
+
+        self.errorCnt = 0
+        self.overrunCnt = 0
+        self.lastGoodRead = 0
+        self.running = False
+
+    def run(self):
+        self.running = True
+        nextDeadline = time.monotonic()
+        while self.running:
+            self.sampleOnce()
+            nextDeadline = self.waitForDeadline(nextDeadline)
+
+    def sampleOnce(self):
+        try:
+            values = self.readFunc()
+        except Exception:
+            self.errorCnt += 1
+            return
+        now = time.monotonic()
+        self.ring.write(now, values)
+        self.lastGoodRead = now
+
+    def waitForDeadline(self, nextDeadline):
+        # sleep until the next deadline rather than for a fixed period so that
+        # the time spent on the bus does not stretch the sample interval
+        nextDeadline += self.samplePeriod
+        delay = nextDeadline - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        elif delay < -self.samplePeriod:
+            # fell more than a full period behind, resync instead of bursting
+            self.overrunCnt += 1
+            nextDeadline = time.monotonic()
+        return nextDeadline
+
+    def stop(self):
+        self.running = False
+
+    def isHealthy(self, maxAgeSec=1.0):
+        return self.lastGoodRead > 0 and (time.monotonic() - self.lastGoodRead) < maxAgeSec
+
+    def discard(self):
+        return self.ring.discard()
+
+    def pendingCount(self):
+        return self.ring.pendingCount()
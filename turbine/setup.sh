@@ -14,3 +14,11 @@ if wget -O /home/pi/certs/bundle.zip "$1"; then
 else
    echo "An error occurred. Make sure the presigned url provided is wrapped in double-quotes and not expired" 
 fi
+# the turbine program needs numpy (the Raspbian python3-numpy package is recent enough,
+# nothing here relies on numpy 1.17+ features such as packbits(bitorder=)) and Pillow
+echo "Checking Python packages"
+if python3 -c "import numpy, PIL; print('numpy ' + numpy.__version__)"; then
+   echo "numpy and Pillow found"
+else
+   echo "numpy and Pillow are required: sudo apt-get install python3-numpy python3-pil"
+fi
@@ -0,0 +1,127 @@
+# Copyright 2018. Amazon Web Services, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import threading
+
+# Local copy of the device shadow.
+# Keeps the last accepted reported state, the last desired state seen and the
+# shadow version in a JSON file, so the turbine starts with its settings before
+# (or without) a connection. Every change is written to a temp file, synced and
+# renamed over the cache, so a power cut leaves either the old or the new copy.
+# A missing or unreadable cache just means starting from the defaults.
+#
+# Once connected, reconcile() compares the cloud shadow's version with the cached
+# one: a newer cloud shadow replaces the cache, an equal one needs nothing, and an
+# older one (the shadow was deleted or recreated) means the cloud should be given
+# the cached reported state back. An equal version only counts when the cache holds
+# the whole document: it was filled from a shadow get and every change since moved
+# the version on by exactly one, so nothing was missed in between.
+
+reconcileCloud = 'cloud'
+reconcileSame = 'same'
+reconcileLocal = 'local'
+
+
+def mergeState(state, changes):
+    # shadow semantics: a None value removes the key
+    for key, value in changes.items():
+        if value is None:
+            state.pop(key, None)
+        else:
+            state[key] = value
+
+
+class ShadowCache(object):
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.reported = {}
+        self.desired = {}
+        self.version = None
+        # True while the cache matches the whole cloud document at self.version
+        self.complete = False
+        self.saveCnt = 0
+
+    def load(self):
+        # True when a cached shadow was found
+        try:
+            with open(self.path) as infile:
+                cached = json.load(infile)
+            reported = cached.get('reported') or {}
+            desired = cached.get('desired') or {}
+            version = cached.get('version')
+            complete = bool(cached.get('complete'))
+        except (IOError, OSError):
+            return False
+        except (ValueError, AttributeError) as e:
+            print("Ignoring unreadable shadow cache " + self.path + ": " + str(e))
+            return False
+        with self.lock:
+            self.reported = reported
+            self.desired = desired
+            self.version = version
+            self.complete = complete
+        return True
+
+    def save(self):
+        # called with the lock held
+        tmpPath = self.path + '.tmp'
+        with open(tmpPath, 'w') as outfile:
+            json.dump({'reported': self.reported, 'desired': self.desired, 'version': self.version,
+                       'complete': self.complete}, outfile)
+            outfile.flush()
+            os.fsync(outfile.fileno())
+        os.replace(tmpPath, self.path)
+        self.saveCnt += 1
+
+    def update(self, reported=None, desired=None, version=None):
+        # merges accepted changes; acknowledgements can arrive out of order, so the
+        # version only ever moves forward
+        with self.lock:
+            mergeState(self.reported, reported or {})
+            mergeState(self.desired, desired or {})
+            if version is not None and (self.version is None or version > self.version):
+                if self.version is None or version != self.version + 1:
+                    self.complete = False
+                self.version = version
+            try:
+                self.save()
+            except (IOError, OSError) as e:
+                print("Shadow cache write failed: " + str(e))
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.reported), dict(self.desired), self.version
+
+    def reconcile(self, document):
+        # document is a shadow get response; returns reconcileCloud, reconcileSame or reconcileLocal
+        version = document.get('version')
+        state = document.get('state', {})
+        with self.lock:
+            if version is not None and self.version is not None:
+                if version == self.version and self.complete:
+                    return reconcileSame
+                if version < self.version:
+                    return reconcileLocal
+            self.reported = dict(state.get('reported') or {})
+            self.desired = dict(state.get('desired') or {})
+            self.version = version
+            self.complete = version is not None
+            try:
+                self.save()
+            except (IOError, OSError) as e:
+                print("Shadow cache write failed: " + str(e))
+            return reconcileCloud
@@ -0,0 +1,267 @@
+# Copyright 2018. Amazon Web Services, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import threading
+import time
+
+# Coalesced, asynchronous device shadow updates.
+# Callers hand reported (or desired) values to report() and return at once. The
+# reporter thread waits flushWindowSec after the first change so a shadow delta
+# that touches several settings goes out as one update document, later values for
+# the same key replacing earlier ones. One update is in flight at a time. When it
+# times out, is rejected with a retryable error, or can't be sent (offline), its
+# values are merged back under anything reported since and retried with
+# exponential backoff. A rejection the service won't accept on retry (4xx) is
+# dropped.
+#
+# The shadow version from each acknowledgement is tracked. Acknowledgements for
+# an update that was already given up on, or carrying a version older than the
+# last one seen, are stale and ignored. onAcceptedFunc(state, version) is told
+# about every accepted update, outside the reporter's lock.
+
+
+def mergeSections(older, newer):
+    # {section: {key: value}}; newer values win
+    merged = dict((section, dict(values)) for section, values in older.items())
+    for section, values in newer.items():
+        merged.setdefault(section, {}).update(values)
+    return merged
+
+
+class ShadowReporter(threading.Thread):
+    def __init__(self, updateFunc, connectedEvent=None, flushWindowSec=0.2, timeoutSec=5,
+                 initialBackoffSec=1.0, maxBackoffSec=32.0, onAcceptedFunc=None, clock=time.monotonic):
+        # updateFunc(document, callback, timeoutSec) sends a shadow update and returns
+        # its token, like the SDK's shadowUpdate
+        threading.Thread.__init__(self, name="ShadowReporter")
+        self.daemon = True
+        self.updateFunc = updateFunc
+        self.connectedEvent = connectedEvent
+        self.flushWindowSec = flushWindowSec
+        self.timeoutSec = timeoutSec
+        self.initialBackoffSec = initialBackoffSec
+        self.maxBackoffSec = maxBackoffSec
+        self.onAcceptedFunc = onAcceptedFunc
+        self.clock = clock
+
+        self.lock = threading.Condition()
+        self.pending = {}
+        self.pendingSince = None
+        self.inFlight = None
+        self.inFlightToken = None
+        self.inFlightDeadline = None
+        # acknowledgements that arrive before updateFunc has returned the token
+        self.earlyAcks = {}
+        # accepted updates waiting for onAcceptedFunc
+        self.accepted = []
+        self.notifyLock = threading.Lock()
+        self.backoffSec = 0.0
+        self.retryAt = None
+        self.version = None
+        self.running = False
+
+        self.reportCnt = 0
+        self.sentCnt = 0
+        self.acceptedCnt = 0
+        self.retryCnt = 0
+        self.droppedCnt = 0
+        self.staleCnt = 0
+
+    def report(self, values, section="reported"):
+        # never blocks on the network
+        with self.lock:
+            self.pending = mergeSections(self.pending, {section: values})
+            if self.pendingSince is None:
+                self.pendingSince = self.clock()
+            self.reportCnt += 1
+            self.lock.notify_all()
+
+    def isIdle(self):
+        with self.lock:
+            return not self.pending and self.inFlight is None
+
+    def flush(self, timeoutSec):
+        # waits for everything reported so far to be acknowledged; False on timeout
+        end = self.clock() + timeoutSec
+        with self.lock:
+            self.pendingSince = self.clock() - self.flushWindowSec if self.pending else None
+            self.retryAt = None
+            self.lock.notify_all()
+            while self.pending or self.inFlight is not None or self.accepted:
+                remaining = end - self.clock()
+                if remaining <= 0:
+                    return False
+                self.lock.wait(min(remaining, 0.1))
+        return True
+
+    def observeVersion(self, version):
+        # True if version is newer than anything seen so far
+        if version is None:
+            return True
+        with self.lock:
+            if self.version is not None and version < self.version:
+                return False
+            self.version = version
+            return True
+
+    def onAck(self, payload, responseStatus, token):
+        # SDK callback thread
+        with self.lock:
+            if self.inFlight is None or (self.inFlightToken is not None and token != self.inFlightToken):
+                self.staleCnt += 1
+                return
+            if self.inFlightToken is None:
+                self.earlyAcks[token] = (payload, responseStatus)
+                return
+            self.handleAck(payload, responseStatus)
+        self.notifyAccepted()
+
+    def handleAck(self, payload, responseStatus):
+        # called with the lock held for the update in flight
+        try:
+            document = json.loads(payload) if payload else {}
+        except ValueError:
+            document = {}
+        version = document.get("version")
+        if responseStatus == "accepted":
+            if version is not None and self.version is not None and version < self.version:
+                # a duplicate of an older reply; the timeout resends if ours never comes
+                self.staleCnt += 1
+                return
+            if version is not None:
+                self.version = version
+            if self.onAcceptedFunc is not None:
+                self.accepted.append((self.inFlight, version))
+            self.acceptedCnt += 1
+            self.backoffSec = 0.0
+            self.clearInFlight()
+        elif responseStatus == "rejected" and 400 <= int(document.get("code", 500)) < 500 and \
+                int(document.get("code", 500)) != 429:
+            print("Shadow update rejected: " + str(document.get("message", payload)))
+            self.droppedCnt += 1
+            self.clearInFlight()
+        else:
+            self.retryInFlight("Shadow update " + str(responseStatus))
+
+    def notifyAccepted(self):
+        # called without the lock held, from the SDK or the reporter thread; in order,
+        # and an entry stays queued until its callback is done so flush() waits for it
+        with self.notifyLock:
+            while True:
+                with self.lock:
+                    if not self.accepted:
+                        return
+                    state, version = self.accepted[0]
+                try:
+                    self.onAcceptedFunc(state, version)
+                except Exception as e:
+                    print("shadow accepted callback failed: " + str(e))
+                with self.lock:
+                    self.accepted.pop(0)
+                    self.lock.notify_all()
+
+    def clearInFlight(self):
+        self.inFlight = None
+        self.inFlightToken = None
+        self.inFlightDeadline = None
+        self.lock.notify_all()
+
+    def retryInFlight(self, reason):
+        # put the values back under anything newer and back off
+        if self.backoffSec == 0:
+            print(reason + ", will retry")
+        self.pending = mergeSections(self.inFlight, self.pending)
+        if self.pendingSince is None:
+            self.pendingSince = self.clock()
+        self.retryCnt += 1
+        self.backoffSec = min(max(self.backoffSec * 2, self.initialBackoffSec), self.maxBackoffSec)
+        self.retryAt = self.clock() + self.backoffSec
+        self.clearInFlight()
+
+    def nextWakeup(self, now):
+        # seconds until something is due, None to wait for a report
+        if self.inFlight is not None:
+            return max(self.inFlightDeadline - now, 0)
+        if not self.pending:
+            return None
+        due = self.pendingSince + self.flushWindowSec
+        if self.retryAt is not None:
+            due = max(due, self.retryAt)
+        return max(due - now, 0)
+
+    def send(self):
+        # called with the lock held; the SDK call itself runs without it
+        values = self.pending
+        self.pending = {}
+        self.pendingSince = None
+        self.retryAt = None
+        self.inFlight = values
+        self.inFlightToken = None
+        self.inFlightDeadline = self.clock() + self.timeoutSec + 1
+        document = json.dumps({"state": values}).encode("utf-8")
+        self.lock.release()
+        try:
+            token = self.updateFunc(document, self.onAck, self.timeoutSec)
+            error = None
+        except Exception as e:
+            token = None
+            error = e
+        finally:
+            self.lock.acquire()
+        self.sentCnt += 1
+        if error is not None or token is None:
+            self.retryInFlight("Shadow update failed" + ("" if error is None else ": " + str(error)))
+            return
+        self.inFlightToken = token
+        early = self.earlyAcks.pop(token, None)
+        self.earlyAcks.clear()
+        if early is not None:
+            self.handleAck(*early)
+
+    def run(self):
+        self.running = True
+        with self.lock:
+            while self.running:
+                now = self.clock()
+                if self.inFlight is not None and now >= self.inFlightDeadline:
+                    # the SDK reports timeouts itself; this covers a lost callback
+                    self.retryInFlight("Shadow update unacknowledged")
+                    continue
+                wait = self.nextWakeup(now)
+                if wait is None or wait > 0:
+                    self.lock.wait(wait)
+                    continue
+                if self.connectedEvent is not None and not self.connectedEvent.is_set():
+                    # nothing can be sent until the client is online again
+                    self.lock.release()
+                    try:
+                        self.connectedEvent.wait(1)
+                    finally:
+                        self.lock.acquire()
+                    continue
+                self.send()
+                if self.accepted:
+                    self.lock.release()
+                    try:
+                        self.notifyAccepted()
+                    finally:
+                        self.lock.acquire()
+
+    def stop(self, timeoutSec=2.0):
+        with self.lock:
+            self.running = False
+            self.lock.notify_all()
+        if self.is_alive():
+            self.join(timeoutSec)
@@ -1,2 +1,2 @@
-python ~/WindEnergyWorkshop2019/turbine/turbine.py --config ~/certs/config.json 
+python3 ~/WindEnergyWorkshop2019/turbine/turbine.py --config ~/certs/config.json 
 
@@ -1,17 +1,19 @@
+#!/usr/bin/env python3
 import RPi.GPIO as GPIO
-import time
 import sys
 import getopt
 import os
 import json
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from brake_calibration import BrakeCalibrator
+from rpm_estimator import RpmEstimator
+
 # Turbine rotation speed sensor
 turbine_rotation_sensor_pin = 26  # pin 37
-turbineRPM = 0
-turbineRpmElapse = 0
-turbineRotationCnt = 0
-lastTurbineRotationCnt = 0
-start_timer = time.time()
+# calibration reads a short window and reads 0 after 2 s without a pulse
+rpmEstimator = RpmEstimator(stallSec=2.0)
+rpmWindowSec = 0.5
 
 # Servo control for turbine brake
 turbine_servo_brake_pin = 15  # pin 10
@@ -26,24 +28,14 @@ def initTurbineGPIO():
 def initTurbineRPMSensor():
     global GPIO
     GPIO.setup(turbine_rotation_sensor_pin, GPIO.IN, GPIO.PUD_UP)
-    GPIO.add_event_detect(turbine_rotation_sensor_pin, GPIO.FALLING, callback=calculateTurbineElapse, bouncetime=20)
+    GPIO.add_event_detect(turbine_rotation_sensor_pin, GPIO.FALLING, callback=turbineRotationEdge)
     print("Turbine rotation sensor is connected")
 
-def calculateTurbineElapse(channel):  # callback function
-    global turbineRotationCnt, start_timer, turbineRpmElapse
-    turbineRotationCnt += 1  # increase cnt by 1 whenever interrupt occurred
-    turbineRpmElapse = time.time() - start_timer  # time elapsed for every 1 complete rotation
-    start_timer = time.time()  # let current time equal to start_timer
+def turbineRotationEdge(channel):  # callback function
+    rpmEstimator.onEdge()
 
 def calculateTurbineSpeed():
-    global turbineRPM, lastTurbineRotationCnt
-    if turbineRpmElapse != 0:  # to avoid DivisionByZero error
-        turbineRPM = 1 / turbineRpmElapse * 60
-    if turbineRotationCnt == lastTurbineRotationCnt:
-        turbineRPM = 0
-    else:
-        lastTurbineRotationCnt = turbineRotationCnt
-    return turbineRPM
+    return rpmEstimator.estimate(windowSec=rpmWindowSec)
 
 def initTurbineBrake():
     global brakeServo, GPIO
@@ -52,106 +44,39 @@ def initTurbineBrake():
     brakeServo.start(0)
     print("Turbine brake connected")
 
-brakePin = 10
-pwm_off = 10
-stopped_at_pwm = 10
+def setBrakeDuty(duty):
+    brakeServo.ChangeDutyCycle(duty)
+
 configFile = ''
 
 def main():
-    global stopped_at_pwm, pwm_off
-    successCnt = 0
+    result = None
     initTurbineGPIO()
     initTurbineRPMSensor()
     initTurbineBrake()
 
     try:
         print("Ensure the turbine is spinning relatively fast. The turbine brake will be applied to determine the optimal min and max position. Do not change the wind source while this takes place.")
-
-        pwm_start = 10
-        pwm = pwm_start
-        brakeServo.start(pwm_start)
-        calculateTurbineSpeed()
-        time.sleep(5)
-        calculateTurbineSpeed()
-        print("Turbine speed: " + str(turbineRPM))
-        starting_turbine_speed = turbineRPM
-
-        if turbineRPM == 0:
-            print("Turbine is not spinning. Can't do the auto calibrate without wind.")
-        else:
-            for i in range(1, pwm_start*10):
-                if turbineRPM < (starting_turbine_speed * .8):
-                    pwm -= 0.1
-                else:
-                    pwm -= 0.2
-                print("Trying {0:.1f}".format(pwm))
-                brakeServo.ChangeDutyCycle(pwm)
-                time.sleep(2)
-                calculateTurbineSpeed()
-                print("Turbine speed: " + str(turbineRPM))
-                if turbineRPM == 0:
-                    print("Found an initial stopping point at " + str(pwm))
-                    stopped_at_pwm = pwm - 0.2
-                    print("Applying a little extra stopping pressure")
-                    break
-
-        #Off
-        print("Letting the turbine speed up again...")
-        brakeServo.ChangeDutyCycle(pwm_start)
-        time.sleep(7)
-        calculateTurbineSpeed()
-        print("Turbine speed: " + str(turbineRPM))
-
-        #test if the stop point can provide hard braking
-        print("Applying full braking force to test hard stopping")
-        brakeServo.ChangeDutyCycle(stopped_at_pwm)
-        time.sleep(5)
-        calculateTurbineSpeed()
-        time.sleep(5)
-        calculateTurbineSpeed()
-        print("Turbine speed: " + str(turbineRPM))
-
-        if turbineRPM == 0:
-            print("That value looks good for quick stopping")
-            successCnt = 1
-        else:
-            for i in range (1, 5):
-                print("More braking force needed... adding force")
-                stopped_at_pwm -= 0.1
-                time.sleep(5)
-                print("Trying {0:.1f}".format(stopped_at_pwm))
-                brakeServo.ChangeDutyCycle(stopped_at_pwm)
-                time.sleep(5)
-                calculateTurbineSpeed()
-                print("Turbine speed: " + str(turbineRPM))
-                if turbineRPM == 0:
-                    print("That value looks good for quick stopping")
-                    successCnt = 1
-                    break
-                else:
-                    print("Unable to completely stop the turbine")
-
-        #off
-        pwm_off = stopped_at_pwm + 0.8 
-        brakeServo.ChangeDutyCycle(pwm_off)
-        time.sleep(1)
-        brakeServo.ChangeDutyCycle(0)
-
+        calibrator = BrakeCalibrator(setBrakeDuty, calculateTurbineSpeed)
+        result = calibrator.calibrate()
     except Exception as e:
         s = str(e)
         print(s)
+        brakeServo.ChangeDutyCycle(0)
 
     GPIO.cleanup()
 
-    if successCnt == 1:
-        print("Success")
-        print("Brake on  position determined to be: {0:.1f}".format(stopped_at_pwm))
-        print("Brake off position determined to be: {0:.1f}".format(pwm_off))
+    if result is not None:
+        print("Success after {0:.0f} s and {1} probes".format(result['wallSec'], result['probeCnt']))
+        print("Brake on  position determined to be: {0:.2f}".format(result['onPosition']))
+        print("Brake off position determined to be: {0:.2f}".format(result['offPosition']))
+        print("Confidence: {0:.2f}".format(result['confidence']))
 
         with open(configFile, 'r+') as f:
             myConfig = json.load(f)
-            myConfig['settings']['brakeServo']['onPosition'] = round(stopped_at_pwm,2)
-            myConfig['settings']['brakeServo']['offPosition'] = round(pwm_off,2)
+            myConfig['settings']['brakeServo']['onPosition'] = result['onPosition']
+            myConfig['settings']['brakeServo']['offPosition'] = result['offPosition']
+            myConfig['settings']['brakeServo']['confidence'] = result['confidence']
             f.seek(0)
             f.truncate()
             json.dump(myConfig, f)
@@ -167,7 +92,7 @@ if __name__ == "__main__":
     # Usage
     usageInfo = """Usage:
 
-    python auto_cal_brake.py --config <config json file>
+    python3 auto_cal_brake.py --config <config json file>
     """
 
     # Read in command-line parameters
@@ -0,0 +1,173 @@
+
+# Runs the target_rpm brake controller against a simulated rotor and reports the
+# settling time, overshoot and steady-state error for a few wind scenarios, plus how
+# fast it lets go when the wind drops with and without anti-windup.
+#
+# Rotor model (speeds in RPM, accelerations in RPM/s): the wind accelerates the rotor
+# towards a free-running speed proportional to the wind speed, with a torque that
+# grows with the square of the wind speed, the brake decelerates
+# it once the pads touch (past 15%), and the servo follows its command with a lag.
+# Speed is measured the way the turbine does it: one pulse per revolution into an
+# RpmEstimator read with a short window.
+from sim_harness import check, finish
+from brake_controller import BrakeController, BrakePid
+from rpm_estimator import RpmEstimator, nsPerSec
+
+simStepSec = 0.001
+controlRateHz = 10
+settleBandFraction = 0.05
+
+
+class RotorSim(object):
+    def __init__(self, rpm, windFunc, windAccel=150.0, rpmPerWind=60.0, brakeDecel=400.0, padContactPct=15.0,
+                 servoLagSec=0.2):
+        self.rpm = rpm
+        self.windFunc = windFunc
+        self.windAccel = windAccel
+        self.rpmPerWind = rpmPerWind
+        self.brakeDecel = brakeDecel
+        self.padContactPct = padContactPct
+        self.servoLagSec = servoLagSec
+        self.t = 0.0
+        self.commandPct = 0.0
+        self.brakePct = 0.0
+        self.revs = 0.0
+        self.estimator = RpmEstimator(windowSec=2.0, clock=lambda: int(self.t * nsPerSec))
+
+    def step(self, dt):
+        wind = self.windFunc(self.t)
+        freeRpm = self.rpmPerWind * wind
+        self.brakePct += (self.commandPct - self.brakePct) * dt / self.servoLagSec
+        contact = max(self.brakePct - self.padContactPct, 0) / (100.0 - self.padContactPct)
+        accel = self.windAccel * (wind / 10.0) ** 2 * (1 - self.rpm / freeRpm if freeRpm > 0 else -1)
+        if self.rpm > 0:
+            accel -= self.brakeDecel * contact
+        self.rpm = max(self.rpm + accel * dt, 0.0)
+        self.t += dt
+        # one pulse per revolution
+        self.revs += self.rpm / 60.0 * dt
+        if self.revs >= 1:
+            self.revs -= 1
+            self.estimator.onEdge(int(self.t * nsPerSec))
+
+
+def runScenario(windFunc, target, durationSec, startRpm, pid=None, safetyFunc=None, targetFunc=None):
+    rotor = RotorSim(startRpm, windFunc)
+    # settle the pulse stream before the controller starts
+    for i in range(int(2.0 / simStepSec)):
+        rotor.step(simStepSec)
+    rotor.t = 0.0
+    rotor.estimator = RpmEstimator(windowSec=2.0, clock=lambda: int(rotor.t * nsPerSec))
+    for i in range(int(1.0 / simStepSec)):
+        rotor.step(simStepSec)
+    rotor.t = 0.0
+
+    def applyPct(pct):
+        rotor.commandPct = pct
+
+    controller = BrakeController(lambda: rotor.estimator.estimate(windowSec=0.5), applyPct,
+                                 pid=pid or BrakePid(), rateHz=controlRateHz, safetyFunc=safetyFunc,
+                                 clock=lambda: rotor.t)
+    controller.engage(target)
+    trace = []
+    stepsPerTick = int(round(1.0 / controlRateHz / simStepSec))
+    for i in range(int(durationSec / simStepSec)):
+        if i % stepsPerTick == 0:
+            if targetFunc is not None:
+                controller.targetRpm = targetFunc(rotor.t)
+            pct = controller.step(1.0 / controlRateHz)
+            trace.append((rotor.t, rotor.rpm, pct))
+        rotor.step(simStepSec)
+    return trace
+
+
+def settleStats(trace, target, startSec=0.0):
+    # settling time into the band (and staying there), overshoot below the target,
+    # and the mean error over the last 2 s
+    trace = [row for row in trace if row[0] >= startSec]
+    band = target * settleBandFraction
+    settled = None
+    for t, rpm, pct in trace:
+        if abs(rpm - target) > band:
+            settled = None
+        elif settled is None:
+            settled = t - startSec
+    minRpm = min(rpm for t, rpm, pct in trace)
+    overshoot = max(target - minRpm, 0) * 100.0 / target
+    tail = [rpm for t, rpm, pct in trace if t >= trace[-1][0] - 2]
+    finalError = sum(tail) / len(tail) - target
+    return settled, overshoot, finalError
+
+
+def maxSlew(trace):
+    return max(abs(b[2] - a[2]) / (b[0] - a[0]) for a, b in zip(trace, trace[1:]))
+
+
+print("{0:>26} {1:>10} {2:>11} {3:>10} {4:>12}".format("scenario", "settle s", "overshoot%", "error rpm",
+                                                        "slew pct/s"))
+
+
+def report(name, trace, target, startSec=0.0):
+    settled, overshoot, finalError = settleStats(trace, target, startSec)
+    print("{0:>26} {1:>10} {2:>11.1f} {3:>10.1f} {4:>12.1f}".format(
+        name, "never" if settled is None else "{0:.1f}".format(settled), overshoot, finalError, maxSlew(trace)))
+    return settled, overshoot
+
+
+steadyWind = lambda t: 10.0
+for target in [450, 400, 300]:
+    trace = runScenario(steadyWind, target, 20, 600)
+    settled, overshoot = report("600 -> " + str(target) + " RPM, 10 m/s", trace, target)
+    check("settles to " + str(target) + " RPM within 8 s", settled is not None and settled < 8, str(settled))
+    check("overshoot at " + str(target) + " RPM under 10%", overshoot < 10, str(overshoot))
+
+gust = lambda t: 10.0 if t < 15 else 13.0
+trace = runScenario(gust, 400, 35, 600)
+settled, overshoot = report("gust 10 -> 13 m/s at 15 s", trace, 400, 15)
+check("recovers from a gust within 8 s", settled is not None and settled < 8, str(settled))
+check("slew limit holds", maxSlew(trace) <= BrakePid().maxSlewPctPerSec + 1e-6, str(maxSlew(trace)))
+
+
+def naiveUpdate(pid, rpm, target, dt):
+    # the same PID with an unclamped integral, for comparison
+    error = rpm - target
+    pid.integral += pid.ki * error * dt
+    demand = pid.kp * error + pid.integral
+    output = min(max(demand, pid.minPct), pid.maxPct)
+    maxStep = pid.maxSlewPctPerSec * dt
+    pid.output = min(max(output, pid.output - maxStep), pid.output + maxStep)
+    return pid.output
+
+
+# a gale the full brake can't hold at 100 RPM saturates the controller for 20 s,
+# then the wind drops and the brake should ease off right away
+lull = lambda t: 18.0 if t < 20 else 5.0
+releaseSec = {}
+for name in ["anti-windup", "no anti-windup"]:
+    pid = BrakePid()
+    if name == "no anti-windup":
+        pid.update = lambda rpm, target, dt, pid=pid: naiveUpdate(pid, rpm, target, dt)
+    trace = runScenario(lull, 100, 45, 1000, pid=pid)
+    releaseAt = next((t for t, rpm, pct in trace if t >= 20 and pct < 50), None)
+    releaseSec[name] = None if releaseAt is None else releaseAt - 20
+    settled, overshoot = report("lull, " + name, trace, 100, 20)
+    print("{0:>26} brake below 50% {1} s after the wind drops".format(
+        "", "never" if releaseSec[name] is None else "{0:.1f}".format(releaseSec[name])))
+check("anti-windup releases within 5 s", releaseSec["anti-windup"] is not None and releaseSec["anti-windup"] < 5,
+      str(releaseSec["anti-windup"]))
+check("anti-windup releases sooner than a wound-up integral",
+      releaseSec["no anti-windup"] is None or releaseSec["no anti-windup"] > 2 * releaseSec["anti-windup"],
+      str(releaseSec))
+
+# vibration alarm part way through: full brake on the next tick (bypassing the slew
+# limit), then control resumes from a standstill
+alarm = lambda: 12.0 <= rotorTime[0] < 14.0
+rotorTime = [0.0]
+trace = runScenario(steadyWind, 400, 25, 600, safetyFunc=alarm,
+                    targetFunc=lambda t: rotorTime.__setitem__(0, t) or 400)
+overridePct = [pct for t, rpm, pct in trace if 12.0 <= t < 14.0]
+check("safety override applies full brake", len(overridePct) > 0 and min(overridePct) == 100, str(overridePct[:3]))
+settled, overshoot = report("after safety override", trace, 400, 14)
+check("control resumes after the override", settled is not None and settled < 10, str(settled))
+
+finish("Brake controller")
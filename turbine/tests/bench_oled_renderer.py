@@ -0,0 +1,220 @@
+import time
+import random
+import socket
+from PIL import Image
+from PIL import ImageDraw
+from PIL import ImageFont
+
+# Compares the old full OLED redraw in turbine.py with the retained-mode renderer:
+# I2C bytes per update and redraw time for a run of typical display updates. The
+# panel is a stand-in SSD1306 that counts I2C bytes (address + control + payload per
+# write) and applies commands and data to its own display RAM, so the benchmark also
+# checks that the partial updates leave the same picture as the full redraws.
+from sim_harness import check, finish
+from oled_renderer import OledRenderer
+
+updateCnt = 200
+random.seed(3)
+
+
+class CountingI2c(object):
+    def __init__(self, panel):
+        self.panel = panel
+        self.bytesSent = 0
+
+    def write8(self, control, value):
+        self.bytesSent += 3
+        self.panel.receive(control, [value])
+
+    def writeList(self, control, data):
+        self.bytesSent += 2 + len(data)
+        self.panel.receive(control, data)
+
+
+class CountingSsd1306(object):
+    # the parts of Adafruit_SSD1306.SSD1306_128_64 the display code uses, over a counting bus;
+    # exposeI2c=False stands in for a driver without the private _i2c device
+    def __init__(self, exposeI2c=True):
+        self.width = 128
+        self.height = 64
+        self._pages = 8
+        self._spi = None
+        self.bus = CountingI2c(self)
+        if exposeI2c:
+            self._i2c = self.bus
+        self._buffer = [0] * (self.width * self._pages)
+        self.ram = [0] * (self.width * self._pages)
+        self.window = [0, self.width - 1, 0, self._pages - 1]
+        self.column = 0
+        self.page = 0
+        self.pendingCommand = []
+
+    def receive(self, control, data):
+        for value in data:
+            if control == 0x40:
+                self.ram[self.page * self.width + self.column] = value
+                self.column += 1
+                if self.column > self.window[1]:
+                    self.column = self.window[0]
+                    self.page = self.page + 1 if self.page < self.window[3] else self.window[2]
+                continue
+            self.pendingCommand.append(value)
+            if self.pendingCommand[0] in (0x21, 0x22) and len(self.pendingCommand) == 3:
+                code, start, end = self.pendingCommand
+                if code == 0x21:
+                    self.window[0:2] = [start, end]
+                    self.column = start
+                else:
+                    self.window[2:4] = [start, end]
+                    self.page = start
+                self.pendingCommand = []
+            elif self.pendingCommand[0] not in (0x21, 0x22):
+                self.pendingCommand = []
+
+    def command(self, c):
+        self.bus.write8(0x00, c)
+
+    def display(self):
+        self.command(0x21)
+        self.command(0)
+        self.command(self.width - 1)
+        self.command(0x22)
+        self.command(0)
+        self.command(self._pages - 1)
+        for i in range(0, len(self._buffer), 16):
+            self.bus.writeList(0x40, self._buffer[i:i + 16])
+
+    def image(self, image):
+        # same pixel loop as the Adafruit library
+        pix = image.load()
+        index = 0
+        for page in range(self._pages):
+            for x in range(self.width):
+                bits = 0
+                for bit in [0, 1, 2, 3, 4, 5, 6, 7]:
+                    bits = bits << 1
+                    bits |= 0 if pix[(x, page * 8 + 7 - bit)] == 0 else 1
+                self._buffer[index] = bits
+                index += 1
+
+
+def getIp():
+    IP = '0.0.0.0'
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        s.connect(('10.255.255.255', 1))
+        IP = s.getsockname()[0]
+    except Exception:
+        pass
+    finally:
+        s.close()
+    return IP
+
+
+thingName = 'WindTurbine-07'
+oledTop = -2
+font = ImageFont.load_default()
+
+
+def makeStates():
+    # the speed and vibration move every loop, the voltage most loops, the rest rarely
+    states = []
+    speed, voltage = 380.0, 1.6
+    for i in range(updateCnt):
+        speed = max(speed + random.gauss(0, 6), 0)
+        if random.random() < 0.7:
+            voltage = max(voltage + random.gauss(0, 0.05), 0)
+        states.append({
+            'iot': 'ON' if i < updateCnt - 20 else 'OFF',
+            'speed': "{0:.1f}".format(speed),
+            'voltage': "{0:.1f}".format(voltage),
+            'vibe_peak': "{0:.2f}".format(abs(random.gauss(0.5, 0.1))),
+            'brake': 'OFF' if i % 100 < 90 else 'ON',
+            'brake_pct': '0' if i % 100 < 90 else '100'
+        })
+    return states
+
+
+def fullRedraw(display, image, draw, state):
+    # the old updateOledDisplay()
+    draw.rectangle((0, 0, display.width, display.height), outline=0, fill=0)
+    x = 0
+    draw.text((x, oledTop), thingName, font=font, fill=255)
+    draw.text((x, oledTop + 8), "IP: " + getIp(), font=font, fill=255)
+    draw.text((x, oledTop + 16), "IoT:" + state['iot'], font=font, fill=255)
+    draw.text((x, oledTop + 26), "Speed: " + state['speed'], font=font, fill=255)
+    draw.text((x, oledTop + 36), "Voltage: " + state['voltage'], font=font, fill=255)
+    draw.text((x, oledTop + 46), "Peak Vibe: " + state['vibe_peak'], font=font, fill=255)
+    draw.text((x, oledTop + 56), "Brake:" + state['brake'] + " Pct: " + state['brake_pct'], font=font, fill=255)
+    display.image(image)
+    display.display()
+
+
+def makeRenderer(display):
+    renderer = OledRenderer(display, font)
+    renderer.addStatic(0, oledTop, thingName)
+    renderer.addField('ip', 0, oledTop + 8, "IP: ")
+    renderer.addField('iot', 0, oledTop + 16, "IoT:")
+    renderer.addField('speed', 0, oledTop + 26, "Speed: ")
+    renderer.addField('voltage', 0, oledTop + 36, "Voltage: ")
+    renderer.addField('vibe_peak', 0, oledTop + 46, "Peak Vibe: ")
+    renderer.addField('brake', 0, oledTop + 56, "Brake:")
+    renderer.addField('brake_pct', 64, oledTop + 56, "Pct: ")
+    return renderer
+
+
+states = makeStates()
+
+fullDisplay = CountingSsd1306()
+fullImage = Image.new('1', (fullDisplay.width, fullDisplay.height))
+fullDraw = ImageDraw.Draw(fullImage)
+started = time.monotonic()
+for state in states:
+    fullRedraw(fullDisplay, fullImage, fullDraw, state)
+fullMs = (time.monotonic() - started) * 1000 / updateCnt
+fullBytes = fullDisplay._i2c.bytesSent / float(updateCnt)
+
+retainedDisplay = CountingSsd1306()
+renderer = makeRenderer(retainedDisplay)
+ip = getIp()
+renderer.update({'ip': ip})
+initialBytes = retainedDisplay._i2c.bytesSent
+retainedDisplay._i2c.bytesSent = 0
+started = time.monotonic()
+for state in states:
+    values = dict(state)
+    values['ip'] = ip
+    renderer.update(values)
+retainedMs = (time.monotonic() - started) * 1000 / updateCnt
+retainedBytes = retainedDisplay._i2c.bytesSent / float(updateCnt)
+
+print("OLED update benchmark (" + str(updateCnt) + " updates)")
+print("{0:>12} {1:>14} {2:>12}".format("renderer", "I2C bytes/upd", "ms/upd"))
+print("{0:>12} {1:>14.0f} {2:>12.2f}".format("full", fullBytes, fullMs))
+print("{0:>12} {1:>14.0f} {2:>12.2f}".format("retained", retainedBytes, retainedMs))
+print("first retained frame: " + str(initialBytes) + " bytes")
+
+unchanged = renderer.update(dict(states[-1], ip=ip))
+check("unchanged update sends nothing", unchanged == 0, str(unchanged))
+check("retained update sends fewer bytes", retainedBytes < fullBytes / 2,
+      str(retainedBytes) + " vs " + str(fullBytes))
+
+# the panels must show the same picture; the field layout differs from the old
+# single Brake/Pct string, so compare against a full redraw of the renderer's own frame
+referenceDisplay = CountingSsd1306()
+referenceDisplay.image(renderer.composeFrame())
+check("partial updates match a full redraw", retainedDisplay.ram == referenceDisplay._buffer)
+
+# without the private I2C device the renderer falls back to whole frames
+fallbackDisplay = CountingSsd1306(exposeI2c=False)
+fallbackRenderer = makeRenderer(fallbackDisplay)
+for state in states[:20]:
+    fallbackRenderer.update(dict(state, ip=ip))
+framesSent = fallbackDisplay.bus.bytesSent
+fallbackRenderer.update(dict(states[19], ip=ip))
+referenceDisplay = CountingSsd1306()
+referenceDisplay.image(fallbackRenderer.composeFrame())
+check("fallback panel gets full frames with the same picture", fallbackDisplay.ram == referenceDisplay._buffer)
+check("fallback skips unchanged frames", fallbackDisplay.bus.bytesSent == framesSent)
+
+finish("OLED renderer")
@@ -0,0 +1,109 @@
+import os
+import sys
+import timeit
+import random
+from datetime import datetime
+
+# Reports bytes per message and encode time per message for each payload encoding
+# on the payload shapes turbine.py and weather.py publish. Encodings whose library
+# is not installed (msgpack, cbor2) are skipped.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from common.payload_codec import encodePayload, decodePayload, availableEncodings, payloadEncodings
+
+repeatCnt = 200
+random.seed(7)
+thingName = 'WindTurbine-07'
+deviceId = '202481596543210'
+timestamp = str(datetime.utcnow().isoformat())
+
+telemetry = {
+    'thing_name': thingName,
+    'deviceID': deviceId,
+    'timestamp': timestamp,
+    'loop_cnt': 1234,
+    'turbine_speed': 412.6281,
+    'turbine_rev_cnt': 98321,
+    'turbine_voltage': 1.73,
+    'turbine_vibe_x': 0.41230,
+    'turbine_vibe_y': 0.29811,
+    'turbine_vibe_z': 0.38817,
+    'turbine_vibe_peak': 0.61123,
+    'turbine_vibe_avg': 0.21734,
+    'turbine_vibe_rms': 0.24410,
+    'turbine_vibe_crest': 2.5039,
+    'turbine_vibe_kurtosis': 3.1182,
+    'turbine_sample_cnt': 1000,
+    'turbine_sample_rate': 199.9,
+    'turbine_sample_jitter_ms': 0.212,
+    'brake_pct': 0,
+    'spectral': {
+        'fs': 199.9, 'res_hz': 0.2, 'rot_hz': 6.877,
+        'order_energy': [0.012731, 0.001931, 0.000412],
+        'order_ratio': [0.5121, 0.0777, 0.0166],
+        'dom_hz': [6.8, 6.8, 13.8], 'centroid_hz': [21.33, 19.87, 25.1], 'energy': 0.024861
+    }
+}
+
+hiResBatch = {
+    'thing_name': thingName,
+    'deviceID': deviceId,
+    'timestamp': timestamp,
+    'loop_cnt': 1234,
+    'sample_period_ms': 5.0003,
+    'sample_cnt': 1000,
+    'turbine_vibe_x': [round(random.gauss(0, 0.3), 4) for i in range(1000)],
+    'turbine_vibe_y': [round(random.gauss(0, 0.3), 4) for i in range(1000)],
+    'turbine_vibe_z': [round(random.gauss(0, 0.3), 4) for i in range(1000)],
+    'turbine_vibe': [round(abs(random.gauss(0, 0.5)), 4) for i in range(1000)]
+}
+
+hiResSample = {
+    'thing_name': thingName,
+    'deviceID': deviceId,
+    'timestamp': timestamp,
+    'loop_cnt': '1234',
+    'turbine_vibe_x': 0.1128173,
+    'turbine_vibe_y': -0.0812733,
+    'turbine_vibe_z': 0.0412876,
+    'turbine_vibe': 0.1442219
+}
+
+weather = {
+    'thing_name': 'WeatherStation-01',
+    'deviceID': deviceId,
+    'location': 'windfarm-a',
+    'timestamp': timestamp,
+    'loop_cnt': 1234,
+    'wind_speed': 12.47
+}
+
+shapes = [('telemetry', telemetry), ('hires', hiResBatch), ('hires_sample', hiResSample), ('weather', weather)]
+encodings = [encoding for encoding in payloadEncodings if encoding in availableEncodings()]
+failCnt = 0
+
+print("Payload encoding benchmark (" + str(repeatCnt) + " encodes per shape)")
+for kind, payload in shapes:
+    print("")
+    print(kind)
+    print("{0:>10} {1:>10} {2:>10} {3:>12}".format("encoding", "bytes", "vs json", "encode us"))
+    jsonSize = len(encodePayload(payload, kind, 'json'))
+    for encoding in encodings:
+        encoded = encodePayload(payload, kind, encoding)
+        encodeUs = timeit.timeit(lambda: encodePayload(payload, kind, encoding), number=repeatCnt) / repeatCnt * 1e6
+        print("{0:>10} {1:>10} {2:>9.0f}% {3:>12.1f}".format(encoding, len(encoded), 100.0 * len(encoded) / jsonSize, encodeUs))
+
+        # every encoding must round trip the identity and counter fields
+        decoded = decodePayload(encoded, encoding)
+        if str(decoded['deviceID']) != deviceId or int(decoded['loop_cnt']) != 1234:
+            print("Round trip failed for " + kind + " with " + encoding)
+            failCnt += 1
+
+if len(encodings) < len(payloadEncodings):
+    print("")
+    print("Skipped (not installed): " + ", ".join(e for e in payloadEncodings if e not in encodings))
+
+if failCnt == 0:
+    print("All payload encodings round trip")
+    sys.exit(0)
+else:
+    sys.exit(1)
@@ -0,0 +1,73 @@
+import os
+import sys
+import time
+import subprocess
+
+# Reports the CPU time (this process plus its children) and wall time of one status
+# display refresh: the four shell pipelines myip_oled.py used to run, and the
+# in-process SysStats reads that replaced them. Runs under Python 2 or 3 on Linux.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from common.sys_stats import SysStats
+
+refreshCnt = 20
+# os.times() counts in clock ticks, so the cheap path needs many more rounds to register
+statsRefreshCnt = 2000
+# refreshes every 5 s, so over a minute the TTL caches are hit like this
+refreshPeriodSec = 5
+
+shellCommands = [
+    "hostname -I | cut -d\' \' -f1",
+    "top -bn1 | grep load | awk '{printf \"CPU Load: %.2f\", $(NF-2)}'",
+    "free -m | awk 'NR==2{printf \"Mem: %s/%sMB %.2f%%\", $3,$2,$3*100/$2 }'",
+    "df -h | awk '$NF==\"/\"{printf \"Disk: %d/%dGB %s\", $3,$2,$5}'"
+]
+
+
+def shellRefresh():
+    return [subprocess.check_output(cmd, shell=True) for cmd in shellCommands]
+
+
+def cpuSeconds():
+    t = os.times()
+    return t[0] + t[1] + t[2] + t[3]
+
+
+def measure(refreshFunc, count):
+    cpuStart = cpuSeconds()
+    wallStart = time.time()
+    for i in range(count):
+        refreshFunc()
+    cpuMs = (cpuSeconds() - cpuStart) * 1000 / count
+    wallMs = (time.time() - wallStart) * 1000 / count
+    return cpuMs, wallMs
+
+
+simTime = [0.0]
+stats = SysStats(clock=lambda: simTime[0])
+
+
+def statsRefresh():
+    simTime[0] += refreshPeriodSec
+    return stats.lines()
+
+
+print("Status refresh benchmark, per refresh")
+print("{0:>10} {1:>12} {2:>12}".format("source", "cpu ms", "wall ms"))
+try:
+    shellCpu, shellWall = measure(shellRefresh, refreshCnt)
+    print("{0:>10} {1:>12.2f} {2:>12.2f}".format("shell", shellCpu, shellWall))
+except (OSError, subprocess.CalledProcessError) as e:
+    shellCpu = None
+    print("{0:>10} skipped: {1}".format("shell", e))
+statsCpu, statsWall = measure(statsRefresh, statsRefreshCnt)
+print("{0:>10} {1:>12.3f} {2:>12.3f}".format("in-process", statsCpu, statsWall))
+
+print("")
+for line in stats.lines():
+    print(line)
+
+if shellCpu is None or statsCpu < shellCpu:
+    sys.exit(0)
+else:
+    print("In-process stats are not cheaper than the shell pipelines")
+    sys.exit(1)
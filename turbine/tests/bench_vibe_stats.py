@@ -0,0 +1,88 @@
+import math
+import timeit
+import numpy as np
+
+# Compares the original per-sample vibration loop from turbine.py main() with the
+# two ways vibe_stats.py computes the window statistics: the plain loop used for
+# short windows and the numpy path used for long ones. Both are timed with the
+# magnitude passed in, as turbine.py does. No hardware is needed.
+from sim_harness import check, finish
+from vibe_stats import computeVibeStats, loopVibeStats, numpyVibeStats, vibeMagnitude, loopMaxSamples
+
+windowSizes = [25, 50, 100, 1000, 5000]
+repeatCnt = 20
+
+
+def legacyVibeLoop(xs, ys, zs):
+    peakVibe = 0
+    peakVibe_x = 0
+    peakVibe_y = 0
+    peakVibe_z = 0
+    vibeDataList = []
+    for i in range(len(xs)):
+        accelX = xs[i]
+        accelY = ys[i]
+        accelZ = zs[i]
+        currentVibe = math.sqrt(accelX ** 2 + accelY ** 2 + accelZ ** 2)
+        peakVibe = max(peakVibe, currentVibe)
+        vibeDataList.append(currentVibe)
+        peakVibe_x = max(peakVibe_x, abs(accelX))
+        peakVibe_y = max(peakVibe_y, abs(accelY))
+        peakVibe_z = max(peakVibe_z, abs(accelZ))
+    avgVibe = sum(vibeDataList) / len(vibeDataList)
+    return peakVibe, avgVibe, peakVibe_x, peakVibe_y, peakVibe_z
+
+
+def timeUs(func):
+    # best of 5 so a busy machine doesn't decide the comparison
+    return min(timeit.repeat(func, number=repeatCnt, repeat=5)) / repeatCnt * 1e6
+
+
+def agrees(a, b):
+    return all(abs(a[key] - b[key]) <= 1e-4 * max(abs(b[key]), 1) for key in b)
+
+
+print("Vibration window statistics benchmark (best of 5 x " + str(repeatCnt) + " runs per size)")
+print("{0:>8} {1:>11} {2:>11} {3:>11} {4:>8}".format("samples", "legacy us", "loop us", "numpy us", "uses"))
+
+rng = np.random.RandomState(42)
+timings = {}
+for windowSize in windowSizes:
+    x = rng.normal(0, 0.5, windowSize).astype(np.float32)
+    y = rng.normal(0, 0.5, windowSize).astype(np.float32)
+    z = rng.normal(0, 0.5, windowSize).astype(np.float32)
+    magnitude = vibeMagnitude(x, y, z)
+    xs = [float(v) for v in x]
+    ys = [float(v) for v in y]
+    zs = [float(v) for v in z]
+
+    legacyUs = timeUs(lambda: legacyVibeLoop(xs, ys, zs))
+    loopUs = timeUs(lambda: loopVibeStats(x, y, z, magnitude))
+    numpyUs = timeUs(lambda: numpyVibeStats(x, y, z, magnitude))
+    timings[windowSize] = (loopUs, numpyUs)
+    uses = "loop" if windowSize < loopMaxSamples else "numpy"
+    print("{0:>8} {1:>11.1f} {2:>11.1f} {3:>11.1f} {4:>8}".format(windowSize, legacyUs, loopUs, numpyUs, uses))
+
+    loopStats = loopVibeStats(x, y, z)
+    numpyStats = numpyVibeStats(x, y, z)
+    check(str(windowSize) + " samples: loop and numpy statistics agree", agrees(loopStats, numpyStats),
+          str((loopStats, numpyStats)))
+    check(str(windowSize) + " samples: a passed magnitude gives the same statistics",
+          agrees(computeVibeStats(x, y, z, magnitude), numpyStats))
+
+    # the shared payload fields must agree with the original loop
+    legacy = legacyVibeLoop(xs, ys, zs)
+    stats = computeVibeStats(x, y, z)
+    current = (stats['turbine_vibe_peak'], stats['turbine_vibe_avg'],
+               stats['turbine_vibe_x'], stats['turbine_vibe_y'], stats['turbine_vibe_z'])
+    check(str(windowSize) + " samples: match the original loop",
+          all(abs(a - b) < 1e-4 for a, b in zip(legacy, current)), str((legacy, current)))
+
+smallest = timings[windowSizes[0]]
+largest = timings[windowSizes[-1]]
+check("the loop wins below the threshold", smallest[0] < smallest[1], str(smallest))
+check("numpy wins on long windows", largest[1] < largest[0], str(largest))
+check("an empty window has zero statistics", computeVibeStats(np.zeros(0, np.float32), np.zeros(0, np.float32),
+                                                              np.zeros(0, np.float32))['turbine_sample_cnt'] == 0)
+
+finish("Vibration statistics")
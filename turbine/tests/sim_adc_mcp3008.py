@@ -0,0 +1,67 @@
+import math
+import random
+
+# Runs the ADC scanner against a fake MCP3008 so it can run on any machine: a
+# rippling generator voltage on channel 0 and a steady reference on channel 3.
+from sim_harness import check, finish
+from adc_mcp3008 import AdcScanner, FakeMcp3008
+
+random.seed(11)
+
+
+simTime = [0.0]
+
+
+def signal(channel, t):
+    if channel == 0:
+        return 1.5 + 0.5 * math.sin(2 * math.pi * 7.3 * t)
+    if channel == 3:
+        return 1.2
+    return 0.0
+
+
+device = FakeMcp3008(signal, noiseCounts=2.0, clock=lambda: simTime[0])
+scanner = AdcScanner(device, channels=[0, 3], oversample=1)
+for i in range(500):
+    simTime[0] += 0.0101
+    scanner.scan()
+stats = scanner.intervalStats()
+check("channel scan reads every channel", device.readCnt == 1000, str(device.readCnt))
+check("interval min/max follow the ripple",
+      abs(stats[0]['min'] - 1.0) < 0.03 and abs(stats[0]['max'] - 2.0) < 0.03, str(stats[0]))
+check("interval mean", abs(stats[0]['mean'] - 1.5) < 0.02 and abs(stats[3]['mean'] - 1.2) < 0.01, str(stats))
+check("interval resets", scanner.intervalCnt == 0)
+
+
+def spread(scanner, channel, count):
+    values = [scanner.scan()[channel] for i in range(count)]
+    mean = sum(values) / len(values)
+    return math.sqrt(sum((v - mean) ** 2 for v in values) / len(values))
+
+
+noisy = spread(AdcScanner(device, channels=[3], oversample=1), 3, 400)
+averaged = spread(AdcScanner(device, channels=[3], oversample=16), 3, 400)
+check("16x oversampling cuts the noise about 4x", averaged < noisy / 3, str(noisy) + " -> " + str(averaged))
+
+decimated = AdcScanner(device, channels=[3], oversample=16, mode='decimate')
+value = decimated.scan()[3]
+check("decimation adds resolution", decimated.extraBits == 2 and abs(value - 1.2) < 0.01, str(value))
+check("64x decimation adds 3 bits", AdcScanner(device, channels=[3], oversample=64, mode='decimate').extraBits == 3)
+rounded = AdcScanner(device, channels=[3], oversample=20, mode='decimate')
+device.readCnt = 0
+value = rounded.scan()[3]
+check("decimation rounds the oversample down to a power of 4", rounded.oversample == 16 and rounded.extraBits == 2
+      and device.readCnt == 16 and abs(value - 1.2) < 0.01, str((rounded.oversample, device.readCnt, value)))
+
+# a divider on channel 0: scans, interval stats and single conversions share the scale
+scaled = AdcScanner(device, channels=[0, 3], oversample=4, scales={0: 6.0})
+for i in range(200):
+    simTime[0] += 0.0101
+    scaled.scan()
+stats = scaled.intervalStats()
+single = scaled.countsToVolts(device.readRaw(0), channel=0)
+check("channel scale applies to the interval stats", abs(stats[0]['mean'] - 9.0) < 0.15 and
+      abs(stats[0]['max'] - 12.0) < 0.3 and abs(stats[3]['mean'] - 1.2) < 0.01, str(stats))
+check("channel scale applies to single conversions", 5.4 <= single <= 12.6, str(single))
+
+finish("ADC scanner")
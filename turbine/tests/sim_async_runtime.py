@@ -0,0 +1,117 @@
+import time
+import asyncio
+import threading
+
+# Runs the AsyncRuntime with stand-in tasks: a sampler that queues messages faster
+# than a slow publisher sends them (the oldest are dropped and counted, the rest go
+# out in order), blocking calls kept in order per resource while different resources
+# overlap, commands and LED flashes requested from other threads, button presses
+# submitted once per press, and a task failure shutting the runtime down cleanly.
+from sim_harness import check, finish
+from async_runtime import AsyncRuntime
+
+events = []
+sent = []
+
+
+def slowSend(topic, payload):
+    time.sleep(0.05)
+    sent.append((topic, payload))
+
+
+class Stop(Exception):
+    pass
+
+
+async def samplerTask(runtime):
+    # a burst of windows while the publisher is stuck in its first send
+    for i in range(20):
+        runtime.publish(slowSend, 'telemetry', i)
+        await asyncio.sleep(0.001)
+    await asyncio.sleep(0.4)
+    events.append(('published', list(sent), runtime.droppedPublishCnt))
+
+    # one resource runs its calls in order, two resources overlap
+    start = time.monotonic()
+    await asyncio.gather(runtime.runBlocking('spi', time.sleep, 0.1), runtime.runBlocking('spi', time.sleep, 0.1))
+    sameResource = time.monotonic() - start
+    start = time.monotonic()
+    await asyncio.gather(runtime.runBlocking('spi', time.sleep, 0.1), runtime.runBlocking('i2c', time.sleep, 0.1))
+    events.append(('timing', sameResource, time.monotonic() - start))
+
+    # requests from an SDK callback thread
+    done = threading.Event()
+    threading.Thread(target=lambda: (runtime.submitCommand(lambda: (events.append(
+        ('command', threading.current_thread().name)), done.set())), runtime.requestFlash())).start()
+    await runtime.runBlocking('wait', done.wait, 1)
+    await asyncio.sleep(0.1)
+
+    # the sampler keeps going while a command takes seconds
+    runtime.submitCommand(time.sleep, 0.5)
+    ticks = 0
+    start = time.monotonic()
+    while time.monotonic() - start < 0.3:
+        await asyncio.sleep(0.01)
+        ticks += 1
+    events.append(('ticks', ticks))
+    raise Stop()
+
+
+buttonReads = iter([[], ['A'], ['A'], ['A'], [], ['A', 'B'], ['B']])
+
+
+def readButtons():
+    return next(buttonReads, [])
+
+
+def ledOn():
+    events.append(('led', 'on'))
+
+
+def ledOff():
+    events.append(('led', 'off'))
+
+
+runtime = AsyncRuntime(publishQueueSize=4, ledFlashSec=0.01)
+stopped = False
+try:
+    runtime.run([
+        samplerTask,
+        lambda runtime: runtime.publishTask(),
+        lambda runtime: runtime.commandTask(),
+        lambda runtime: runtime.ledTask(ledOn, ledOff),
+        lambda runtime: runtime.buttonTask(readButtons, lambda button: events.append(('button', button)), 0.01)
+    ])
+except Stop:
+    stopped = True
+
+
+def eventsOf(kind):
+    return [event[1:] for event in events if event[0] == kind]
+
+
+published, dropped = eventsOf('published')[0]
+print("sent " + str([payload for topic, payload in published]) + ", dropped " + str(dropped))
+check("a slow publisher drops the oldest queued items", dropped > 0 and len(published) + dropped == 20,
+      str((len(published), dropped)))
+check("the newest items are sent in order", [payload for topic, payload in published][-4:] == [16, 17, 18, 19] and
+      published == sorted(published, key=lambda item: item[1]), str(published))
+
+sameResource, twoResources = eventsOf('timing')[0]
+check("calls on one resource run in order", sameResource >= 0.19, str(sameResource))
+check("calls on different resources overlap", twoResources < 0.15, str(twoResources))
+
+check("a command from another thread runs on the command worker",
+      [name.startswith('async-command') for (name,) in eventsOf('command')] == [True], str(eventsOf('command')))
+check("a flash request turns the LED off then on", eventsOf('led')[:2] == [('off',), ('on',)], str(eventsOf('led')))
+check("the loop keeps running during a long command", eventsOf('ticks')[0][0] > 15, str(eventsOf('ticks')))
+check("each button press is submitted once", eventsOf('button') == [('A',), ('A',), ('B',)], str(eventsOf('button')))
+
+check("a failing task stops the runtime", stopped)
+check("the loop is released after shutdown", runtime.loop is None)
+check("the executors are released after shutdown", runtime.executors == {})
+ran = []
+runtime.submitCommand(ran.append, 'inline')
+check("commands run inline without a loop", ran == ['inline'])
+
+finish("Async runtime")
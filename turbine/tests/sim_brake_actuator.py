@@ -0,0 +1,97 @@
+import time
+import threading
+
+# Drives the brake scheduler against a recording servo: steps run in order on their
+# deadlines, a newer command preempts the one in progress within a tick, commands
+# queued behind a newer one are superseded without touching the servo, a servo error
+# fails only its own command, and a slow completion callback doesn't hold up the
+# next brake move.
+from sim_harness import check, finish
+from brake_actuator import BrakeActuator, BrakeCommand, brakeOnSteps, brakeOffSteps, brakeChangeSteps, phaseIdle
+
+onDuty = 7.5
+offDuty = 3.5
+moves = []
+
+
+def setDuty(duty):
+    if duty == 99:
+        raise IOError("servo not responding")
+    moves.append((time.monotonic(), duty))
+
+
+def duties(since=0):
+    return [duty for t, duty in moves if t >= since]
+
+
+actuator = BrakeActuator(setDuty)
+actuator.start()
+
+start = time.monotonic()
+command = actuator.submit(BrakeCommand('brake_on', brakeOnSteps(onDuty, applySec=0.1)))
+check("a command finishes", command.wait(1) == 'done')
+check("steps run in order", duties(start) == [onDuty, 0], str(duties(start)))
+applied = moves[-1][0] - moves[-2][0]
+check("each step lasts its duration", 0.09 <= applied < 0.15, str(applied))
+check("a released brake is idle", actuator.phase == phaseIdle and not actuator.isBusy())
+
+start = time.monotonic()
+command = actuator.submit(BrakeCommand('hold', brakeOnSteps(onDuty, applySec=0.1, release=False)))
+check("a held brake stays at its duty", command.wait(1) == 'done' and actuator.phase == 'hold' and
+      actuator.duty == onDuty)
+
+# an off command while a long hold is in progress
+start = time.monotonic()
+slow = actuator.submit(BrakeCommand('change', brakeChangeSteps(5.0, 2.0, offDuty)))
+time.sleep(0.05)
+submitted = time.monotonic()
+off = actuator.submit(BrakeCommand('brake_off', brakeOffSteps(offDuty, moveSec=0.05)))
+check("the command in progress is preempted", slow.wait(1) == 'preempted' and actuator.preemptCnt == 1)
+check("the newer command runs to the end", off.wait(1) == 'done' and duties(start) == [5.0, offDuty, 0],
+      str(duties(start)))
+latency = [t for t, duty in moves if t >= submitted][0] - submitted
+check("preemption moves the servo right away", latency < 0.02, str(latency))
+
+# three commands land before the actuator gets to them
+start = time.monotonic()
+with actuator.cond:
+    first = actuator.submit(BrakeCommand('first', [('hold', 4.0, 0.05), ('release', 0, None)]))
+    second = actuator.submit(BrakeCommand('second', [('hold', 4.5, 0.05), ('release', 0, None)]))
+    last = actuator.submit(BrakeCommand('last', [('hold', 6.0, 0.05), ('release', 0, None)]))
+check("only the newest queued command runs", last.wait(1) == 'done' and duties(start) == [6.0, 0], str(duties(start)))
+check("the older queued commands are superseded", first.result == 'superseded' and second.result == 'superseded')
+check("superseding is not preempting", actuator.preemptCnt == 1)
+
+broken = actuator.submit(BrakeCommand('broken', [('apply', 99, 0.1), ('release', 0, None)]))
+check("a servo error fails the command", broken.wait(1) == 'failed' and actuator.errorCnt == 1)
+after = actuator.submit(BrakeCommand('after', brakeOffSteps(offDuty, moveSec=0.01)))
+check("the actuator keeps going after a servo error", after.wait(1) == 'done')
+check("a command with no steps is done", actuator.submit(BrakeCommand('empty', [])).wait(1) == 'done')
+
+# completion callbacks run on the reporting thread
+reports = []
+reported = threading.Event()
+
+
+def slowReport(command, result):
+    time.sleep(0.3)
+    reports.append((command.name, result, threading.current_thread().name))
+    reported.set()
+
+
+start = time.monotonic()
+actuator.submit(BrakeCommand('reported', brakeOffSteps(offDuty, moveSec=0.01), onDone=slowReport))
+actuator.waitIdle(1)
+nextCommand = actuator.submit(BrakeCommand('next', brakeOffSteps(offDuty, moveSec=0.01)))
+check("a slow callback doesn't delay the next move", nextCommand.wait(0.2) == 'done')
+check("the callback reports the result", reported.wait(1) and
+      reports == [('reported', 'done', 'BrakeActuatorReports')], str(reports))
+actuator.submit(BrakeCommand('long', brakeOnSteps(onDuty, 0.5)))
+check("waitIdle times out while a command runs", not actuator.waitIdle(0.05))
+check("waitIdle returns once it finishes", actuator.waitIdle(1))
+check("commands are counted", actuator.commandCnt == 13, str(actuator.commandCnt))
+
+actuator.stop()
+check("the actuator thread stops", not actuator.is_alive())
+
+finish("Brake actuator")
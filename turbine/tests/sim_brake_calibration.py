@@ -0,0 +1,209 @@
+import random
+
+# Replays brake auto-calibration against a simulated rotor on a simulated clock and
+# reports the wall time of the old linear sweep (the previous auto_cal_brake.py logic
+# with its single-period speed reading) next to the BrakeCalibrator search, along with
+# the positions each one found. Nothing sleeps for real, so a run takes a few seconds.
+#
+# Rotor model (speeds in RPM, accelerations in RPM/s): the wind accelerates the rotor
+# towards its free-running speed, the pads touch below contactDuty and their
+# deceleration grows linearly as the duty drops, and the servo follows with a lag.
+# Below stopDuty the brake beats the wind at a standstill, so that is the lightest
+# position that stops the turbine. Wind noise is seeded so every run is the same.
+from sim_harness import check, finish
+from brake_calibration import BrakeCalibrator
+from rpm_estimator import RpmEstimator, nsPerSec
+
+simStepSec = 0.002
+
+
+class RotorSim(object):
+    def __init__(self, freeRpm=600.0, windAccel=150.0, contactDuty=8.0, decelPerDuty=500.0, servoLagSec=0.2,
+                 windNoise=0.0, seed=1):
+        self.freeRpm = freeRpm
+        self.windAccel = windAccel
+        self.contactDuty = contactDuty
+        self.decelPerDuty = decelPerDuty
+        self.servoLagSec = servoLagSec
+        self.windNoise = windNoise
+        self.random = random.Random(seed)
+        self.gust = 0.0
+        self.t = 0.0
+        self.rpm = freeRpm
+        self.commandDuty = 0.0
+        self.duty = 10.0
+        self.revs = 0.0
+        self.estimator = RpmEstimator(stallSec=2.0, clock=lambda: int(self.t * nsPerSec))
+        self.edgeTimes = []
+
+    def stopDuty(self):
+        # the brake holds the rotor at a standstill below this duty
+        return self.contactDuty - self.windAccel / self.decelPerDuty
+
+    def setDuty(self, duty):
+        # 0 stops the servo pulses and the pads stay where they are
+        if duty > 0:
+            self.commandDuty = duty
+
+    def step(self, dt):
+        if self.windNoise:
+            self.gust += (self.random.gauss(0, self.windNoise) - self.gust) * dt / 0.5
+        self.duty += (self.commandDuty - self.duty) * dt / self.servoLagSec if self.commandDuty else 0
+        # a gust raises both the torque and the free-running speed
+        wind = self.windAccel * (1 + self.gust)
+        decel = max(self.contactDuty - self.duty, 0) * self.decelPerDuty
+        accel = wind * (1 - self.rpm / (self.freeRpm * (1 + self.gust)))
+        # at a standstill the pads hold the rotor unless the wind beats them
+        if self.rpm > 0 or accel > decel:
+            accel -= decel
+        else:
+            accel = 0.0
+        self.rpm = max(self.rpm + accel * dt, 0.0)
+        self.t += dt
+        self.revs += self.rpm / 60.0 * dt
+        if self.revs >= 1:
+            self.revs -= 1
+            self.estimator.onEdge(int(self.t * nsPerSec))
+            self.edgeTimes.append(self.t)
+
+    def sleep(self, sec):
+        for i in range(int(round(sec / simStepSec))):
+            self.step(simStepSec)
+
+
+class SinglePeriodSpeed(object):
+    # the old calculateTurbineSpeed(): the last revolution's period, 0 if no new pulse
+    def __init__(self, rotor):
+        self.rotor = rotor
+        self.lastCnt = 0
+        self.rpm = 0
+
+    def read(self):
+        edges = self.rotor.edgeTimes
+        if len(edges) >= 2:
+            self.rpm = 60.0 / (edges[-1] - edges[-2])
+        if len(edges) == self.lastCnt:
+            self.rpm = 0
+        else:
+            self.lastCnt = len(edges)
+        return self.rpm
+
+
+def legacyCalibrate(rotor):
+    # the previous auto_cal_brake.py main(), on the simulated clock
+    speed = SinglePeriodSpeed(rotor)
+    started = rotor.t
+    pwm_start = 10
+    pwm = pwm_start
+    stopped_at_pwm = 10
+    rotor.setDuty(pwm_start)
+    speed.read()
+    rotor.sleep(5)
+    turbineRPM = speed.read()
+    starting_turbine_speed = turbineRPM
+    for i in range(1, pwm_start * 10):
+        if turbineRPM < (starting_turbine_speed * .8):
+            pwm -= 0.1
+        else:
+            pwm -= 0.2
+        rotor.setDuty(pwm)
+        rotor.sleep(2)
+        turbineRPM = speed.read()
+        if turbineRPM == 0:
+            stopped_at_pwm = pwm - 0.2
+            break
+    rotor.setDuty(pwm_start)
+    rotor.sleep(7)
+    speed.read()
+    rotor.setDuty(stopped_at_pwm)
+    rotor.sleep(5)
+    speed.read()
+    rotor.sleep(5)
+    turbineRPM = speed.read()
+    success = turbineRPM == 0
+    if not success:
+        for i in range(1, 5):
+            stopped_at_pwm -= 0.1
+            rotor.sleep(5)
+            rotor.setDuty(stopped_at_pwm)
+            rotor.sleep(5)
+            if speed.read() == 0:
+                success = True
+                break
+    pwm_off = stopped_at_pwm + 0.8
+    rotor.setDuty(pwm_off)
+    rotor.sleep(1)
+    rotor.setDuty(0)
+    return {'onPosition': round(stopped_at_pwm, 2), 'offPosition': round(pwm_off, 2), 'success': success,
+            'wallSec': round(rotor.t - started, 1)}
+
+
+def newCalibrate(rotor):
+    calibrator = BrakeCalibrator(rotor.setDuty, lambda: rotor.estimator.estimate(windowSec=0.5),
+                                 sleepFunc=rotor.sleep, clock=lambda: rotor.t, log=lambda msg: None)
+    return calibrator.calibrate()
+
+
+def settle(rotor):
+    # turbine spinning freely before calibration starts
+    rotor.setDuty(10)
+    rotor.sleep(3)
+    return rotor
+
+
+def stopsWithin(rotorArgs, duty, sec):
+    rotor = settle(RotorSim(**rotorArgs))
+    rotor.setDuty(duty)
+    rotor.sleep(sec)
+    return rotor.rpm == 0
+
+
+scenarios = [
+    ("steady wind", {}),
+    ("light wind", {'freeRpm': 350.0, 'windAccel': 90.0}),
+    ("strong wind", {'freeRpm': 900.0, 'windAccel': 260.0, 'decelPerDuty': 600.0}),
+    ("gusty wind", {'windNoise': 0.15, 'seed': 7}),
+    ("stiff brake", {'contactDuty': 6.5}),
+]
+
+print("{0:>12} {1:>8} {2:>8} {3:>8} {4:>8} {5:>8} {6:>11}".format(
+    "scenario", "method", "wall s", "on", "off", "stop at", "confidence"))
+for name, rotorArgs in scenarios:
+    trueStop = RotorSim(**rotorArgs).stopDuty()
+    old = legacyCalibrate(settle(RotorSim(**rotorArgs)))
+    new = newCalibrate(settle(RotorSim(**rotorArgs)))
+    print("{0:>12} {1:>8} {2:>8.1f} {3:>8.2f} {4:>8.2f} {5:>8.2f} {6:>11}".format(
+        name, "sweep", old['wallSec'], old['onPosition'], old['offPosition'], trueStop,
+        "-" if old['success'] else "failed"))
+    if new is None:
+        check(name + ": calibration succeeds", False)
+        continue
+    print("{0:>12} {1:>8} {2:>8.1f} {3:>8.2f} {4:>8.2f} {5:>8.2f} {6:>11.2f}".format(
+        name, "search", new['wallSec'], new['onPosition'], new['offPosition'], trueStop, new['confidence']))
+    check(name + ": faster than the sweep", new['wallSec'] < old['wallSec'],
+          str((new['wallSec'], old['wallSec'])))
+    check(name + ": stop point within 0.15 of the true one", abs(new['stopDuty'] - trueStop) <= 0.15,
+          str((new['stopDuty'], trueStop)))
+    check(name + ": on position stops the turbine within 7 s",
+          stopsWithin(rotorArgs, new['onPosition'], 7), str(new['onPosition']))
+    check(name + ": off position clears the pads", new['offPosition'] >= rotorArgs.get('contactDuty', 8.0),
+          str(new['offPosition']))
+    if rotorArgs.get('windNoise'):
+        steady = newCalibrate(settle(RotorSim()))
+        check(name + ": lower confidence than steady wind", new['confidence'] < steady['confidence'],
+              str((new['confidence'], steady['confidence'])))
+    else:
+        check(name + ": confidence above 0.6", new['confidence'] > 0.6, str(new['confidence']))
+
+# no wind: nothing to calibrate against
+still = RotorSim(freeRpm=600.0)
+still.rpm = 0.0
+still.windAccel = 0.0
+check("no wind is reported instead of calibrated", newCalibrate(still) is None)
+
+# replaying the same scenario gives the same result
+first = newCalibrate(settle(RotorSim(windNoise=0.15, seed=3)))
+second = newCalibrate(settle(RotorSim(windNoise=0.15, seed=3)))
+check("replay is deterministic", first == second, str((first, second)))
+
+finish("Brake calibration")
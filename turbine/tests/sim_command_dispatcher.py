@@ -0,0 +1,142 @@
+import json
+import time
+import threading
+
+# Drives CommandDispatcher the way the MQTT callback does: checks that a burst of
+# slow commands doesn't hold up the callback thread (the old inline handling is timed
+# for comparison), routing by topic suffix, the bounded queue, per-command timeouts,
+# batches, responses and that the device's own response topics are ignored.
+from sim_harness import check, finish
+from command_dispatcher import CommandDispatcher
+
+prefix = "cmd/windfarm/turbine/turbine-1"
+commandSec = 0.05
+
+
+class FakeBroker(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.published = []
+
+    def publish(self, topic, payload):
+        with self.lock:
+            self.published.append((topic, json.loads(payload.decode("utf-8"))))
+
+    def responses(self):
+        with self.lock:
+            return dict((response["request_id"], (topic, response)) for topic, response in self.published)
+
+
+def slowBrake(payloadDict):
+    time.sleep(commandSec)
+    return {'brake_pct': float(payloadDict["brake_pct"])}
+
+
+def newDispatcher(broker, **kw):
+    dispatcher = CommandDispatcher(prefix, broker.publish, **kw)
+    dispatcher.register("brake", slowBrake)
+    dispatcher.register("target_rpm", lambda payloadDict: {'target_rpm': float(payloadDict["target_rpm"])})
+    dispatcher.register("hang", lambda payloadDict: time.sleep(1), 0.1)
+    dispatcher.register("fail", lambda payloadDict: 1 / 0)
+    dispatcher.start()
+    return dispatcher
+
+
+def waitFor(condition, timeoutSec=3):
+    end = time.time() + timeoutSec
+    while not condition() and time.time() < end:
+        time.sleep(0.01)
+    return condition()
+
+
+def message(payload):
+    return json.dumps(payload).encode("utf-8")
+
+
+burst = 10
+
+# old: each command ran on the callback thread
+start = time.time()
+for i in range(burst):
+    slowBrake({"brake_pct": i})
+oldBlockedMs = (time.time() - start) * 1000
+
+# new: the callback only queues
+broker = FakeBroker()
+dispatcher = newDispatcher(broker)
+start = time.time()
+for i in range(burst):
+    dispatcher.onMessage(prefix + "/brake", message({"brake_pct": i, "request_id": "b" + str(i)}))
+newBlockedMs = (time.time() - start) * 1000
+done = waitFor(lambda: len(broker.published) == burst)
+print("callback thread blocked for a burst of {0}: old {1:.1f} ms, new {2:.2f} ms".format(burst, oldBlockedMs,
+                                                                                       newBlockedMs))
+check("burst doesn't hold the callback thread", newBlockedMs < 10, str(newBlockedMs))
+responses = broker.responses()
+check("every command is answered in order", done and
+      [r["result"]["brake_pct"] for t, r in sorted(responses.values(), key=lambda x: int(x[1]["request_id"][1:]))] ==
+      [float(i) for i in range(burst)], str(broker.published))
+check("responses go to the command's response topic", responses["b0"][0] == prefix + "/brake/response")
+stats = dispatcher.stats()
+brakeStats = stats['commands']['brake']
+print("brake latency: " + str(brakeStats))
+check("latency covers queueing", brakeStats['count'] == burst and brakeStats['max_ms'] >= commandSec * 1000 * burst * 0.9,
+      str(brakeStats))
+
+# routing and loop protection
+check("response topics are ignored", not dispatcher.onMessage(prefix + "/brake/response", message({"status": "ok"})))
+check("unknown commands are ignored", not dispatcher.onMessage(prefix + "/launch", message({})))
+check("bad JSON is rejected", not dispatcher.onMessage(prefix + "/brake", b"{brake"))
+check("other things' commands are ignored",
+      not dispatcher.onMessage("cmd/windfarm/turbine/turbine-2/brake", message({"brake_pct": 1})))
+dispatcher.onMessage(prefix + "/target_rpm", message({"target_rpm": 300}))
+check("commands without a request_id get no response", waitFor(lambda: dispatcher.stats()['commands']['target_rpm']
+                                                                ['count'] == 1) and len(broker.published) == burst)
+
+# timeouts and failures are reported and the queue moves on
+dispatcher.onMessage(prefix + "/hang", message({"request_id": "h"}))
+dispatcher.onMessage(prefix + "/fail", message({"request_id": "f"}))
+dispatcher.onMessage(prefix + "/target_rpm", message({"target_rpm": 250, "request_id": "t"}))
+waitFor(lambda: "t" in broker.responses())
+responses = broker.responses()
+check("a hung command times out", responses.get("h", (None, {}))[1].get("status") == "timeout" and
+      responses["h"][1]["latency_ms"] < 300, str(responses.get("h")))
+check("a failing command reports its error", responses.get("f", (None, {}))[1].get("status") == "error",
+      str(responses.get("f")))
+check("the next command still runs", responses.get("t", (None, {}))[1].get("result") == {'target_rpm': 250.0},
+      str(responses.get("t")))
+
+# batches
+dispatcher.onMessage(prefix + "/batch", message({"request_id": "batch1", "commands": [
+    {"cmd": "target_rpm", "target_rpm": 0}, {"cmd": "brake", "brake_pct": 30}]}))
+dispatcher.onMessage(prefix + "/batch", message({"request_id": "batch2", "commands": [
+    {"cmd": "fail"}, {"cmd": "brake", "brake_pct": 30}]}))
+dispatcher.onMessage(prefix + "/batch", message({"request_id": "batch3", "continue_on_error": True, "commands": [
+    {"cmd": "fail"}, {"cmd": "target_rpm", "target_rpm": 100}]}))
+waitFor(lambda: "batch3" in broker.responses())
+responses = broker.responses()
+batch1 = responses.get("batch1", (None, {}))[1]
+check("batch runs every operation", batch1.get("status") == "ok" and
+      [r["cmd"] for r in batch1.get("results", [])] == ["target_rpm", "brake"], str(batch1))
+check("batch response goes to the batch response topic", responses["batch1"][0] == prefix + "/batch/response")
+batch2 = responses.get("batch2", (None, {}))[1]
+check("batch stops at the first failure", batch2.get("status") == "error" and len(batch2.get("results", [])) == 1,
+      str(batch2))
+batch3 = responses.get("batch3", (None, {}))[1]
+check("continue_on_error runs the rest", len(batch3.get("results", [])) == 2 and
+      batch3["results"][1]["status"] == "ok", str(batch3))
+dispatcher.stop()
+
+# a full queue rejects instead of blocking the callback thread
+broker = FakeBroker()
+dispatcher = newDispatcher(broker, queueSize=2)
+accepted = [dispatcher.onMessage(prefix + "/brake", message({"brake_pct": i, "request_id": str(i)})) for i in range(6)]
+waitFor(lambda: len(broker.published) == 6)
+rejected = [r for t, r in broker.published if r.get("status") == "rejected"]
+print("queued: " + str(accepted))
+check("a full queue rejects the excess", accepted.count(False) >= 2 and len(rejected) == accepted.count(False) and
+      dispatcher.rejectedCnt == len(rejected), str(accepted))
+check("queue depth stays bounded", dispatcher.stats()['max_queued'] <= 2)
+dispatcher.stop()
+
+finish("Command dispatcher")
@@ -0,0 +1,118 @@
+import json
+
+# Feeds the report-by-exception filter a scripted series of payloads on a fake
+# clock: fields inside their abs/pct bands are suppressed, a crossing sends only the
+# fields that moved, a slow drift is reported once it adds up, keyframe-only fields
+# wait for the keyframe, a keyframe is forced after keyframeSec carrying the
+# suppression counters, and the identity fields go out with every message.
+from sim_harness import check, finish
+from deadband import DeadbandPublisher, exceedsDeadband, jsonSize
+
+identityFields = ['thing_name', 'deviceID', 'timestamp', 'loop_cnt']
+deadbands = {
+    'turbine_speed': {'abs': 2, 'pct': 2},
+    'turbine_voltage': {'abs': 0.05},
+    'brake_pct': {'abs': 0},
+    'turbine_sample_rate': {'keyframe_only': True},
+    'spectral': {'abs': 0.001, 'pct': 20},
+    'default': {'pct': 10}
+}
+
+# the larger of the two thresholds applies
+check("abs floor near zero", not exceedsDeadband(1.5, 0.0, {'abs': 2, 'pct': 2}) and
+      exceedsDeadband(2.5, 0.0, {'abs': 2, 'pct': 2}))
+check("pct band at high values", not exceedsDeadband(1018, 1000, {'abs': 2, 'pct': 2}) and
+      exceedsDeadband(1021, 1000, {'abs': 2, 'pct': 2}))
+check("no band means any change", exceedsDeadband(3, 2, {}) and not exceedsDeadband(2, 2, {}))
+check("booleans ignore the band", exceedsDeadband(True, False, {'abs': 5}) and not exceedsDeadband(False, False, {}))
+check("nested values change on any element or key", exceedsDeadband({'a': [1.0, 2.0]}, {'a': [1.0, 3.0]}, {'pct': 20})
+      and not exceedsDeadband({'a': [1.0, 2.0]}, {'a': [1.0, 2.1]}, {'pct': 20}) and
+      exceedsDeadband({'a': 1.0}, {'b': 1.0}, {}) and exceedsDeadband([1.0], [1.0, 2.0], {}))
+
+# the turbine state; each payload() is the next loop's message with some fields moved
+current = {
+    'thing_name': 'turbine-1',
+    'deviceID': 'dev-1',
+    'loop_cnt': 0,
+    'turbine_speed': 500,
+    'turbine_voltage': 6.0,
+    'brake_pct': 0,
+    'turbine_sample_rate': 200.0,
+    'turbine_vibe_peak': 1.0,
+    'spectral': {'bands': [0.1, 0.2]}
+}
+
+
+def payload(**fields):
+    current['loop_cnt'] += 1
+    current['timestamp'] = '2018-01-01T00:00:%02d' % current['loop_cnt']
+    current.update(fields)
+    return dict(current)
+
+
+publisher = DeadbandPublisher(identityFields, deadbands, keyframeSec=60)
+first = publisher.filter(payload(), now=0)
+check("the first message is a full keyframe", first['keyframe'] and first['turbine_speed'] == 500 and
+      first['suppressed_msgs'] == 0 and first['suppressed_bytes'] == 0)
+
+suppressedBytes = 0
+quiet = [payload(turbine_speed=509, turbine_voltage=6.04, turbine_sample_rate=150.0, turbine_vibe_peak=1.09,
+                 spectral={'bands': [0.11, 0.22]}),
+         payload(turbine_speed=491, turbine_voltage=5.96)]
+results = [publisher.filter(message, now=5 * (i + 1)) for i, message in enumerate(quiet)]
+suppressedBytes += sum(jsonSize(message) for message in quiet)
+check("changes inside every band are suppressed", results == [None, None], str(results))
+check("suppressed counters", publisher.suppressedMsgCnt == 2 and publisher.suppressedByteCnt == suppressedBytes,
+      str(publisher.stats()))
+
+crossing = payload(turbine_speed=515, turbine_voltage=6.04, brake_pct=10)
+sent = publisher.filter(crossing, now=15)
+check("a crossing sends only the fields that moved",
+      sorted(sent) == sorted(identityFields + ['turbine_speed', 'brake_pct']), str(sorted(sent)))
+check("identity fields go out with a delta", all(sent[field] == crossing[field] for field in identityFields))
+check("a delta is not a keyframe", 'keyframe' not in sent)
+suppressedBytes += jsonSize(crossing) - jsonSize(sent)
+check("bytes saved by the delta are counted", publisher.suppressedByteCnt == suppressedBytes and
+      publisher.suppressedMsgCnt == 2)
+
+# the reference only moves when a field is sent, so a slow drift adds up
+drift = []
+for step in range(1, 4):
+    message = payload(turbine_voltage=6.0 + 0.02 * step)
+    drift.append(publisher.filter(message, now=15 + step))
+    suppressedBytes += jsonSize(message) - (jsonSize(drift[-1]) if drift[-1] is not None else 0)
+check("a slow drift is reported once it crosses the band", drift[0] is None and drift[1] is None and
+      drift[2] is not None and sorted(drift[2]) == sorted(identityFields + ['turbine_voltage']), str(drift))
+
+message = payload(turbine_sample_rate=100.0)
+check("a keyframe-only field never triggers a delta", publisher.filter(message, now=30) is None)
+suppressedBytes += jsonSize(message)
+sent = publisher.filter(payload(turbine_vibe_peak=1.2), now=31)
+check("fields without their own band use the default", sent is not None and 'turbine_vibe_peak' in sent and
+      'turbine_sample_rate' not in sent, str(sent))
+suppressedBytes += jsonSize(current) - jsonSize(sent)
+
+keyframe = publisher.filter(payload(), now=60)
+check("a keyframe is forced after keyframeSec even with nothing changed", keyframe is not None and keyframe['keyframe'])
+check("the keyframe carries every field", keyframe['turbine_sample_rate'] == 100.0 and
+      all(keyframe[field] == current[field] for field in identityFields))
+check("the keyframe carries the suppression counters", keyframe['suppressed_msgs'] == 5 and
+      keyframe['suppressed_bytes'] == suppressedBytes, str((keyframe['suppressed_msgs'], keyframe['suppressed_bytes'],
+                                                            suppressedBytes)))
+check("the keyframe resets the reference values", publisher.filter(payload(), now=61) is None)
+check("sent count covers keyframes and deltas", publisher.stats()['sent_msgs'] == 5, str(publisher.stats()))
+
+publisher.forceKeyframe()
+check("a forced keyframe goes out on the next message", publisher.filter(payload(), now=62)['keyframe'])
+publisher.configure(keyframeSec=10)
+check("a shorter keyframe interval takes effect", publisher.filter(payload(), now=71) is None and
+      publisher.filter(payload(), now=72)['keyframe'])
+
+# the size function of the encoding in use is what gets counted
+publisher = DeadbandPublisher(identityFields, deadbands, sizeFunc=lambda message: 100)
+publisher.filter(payload(), now=0)
+publisher.filter(payload(), now=1)
+check("suppressed bytes use the encoded size", publisher.suppressedByteCnt == 100)
+print(json.dumps(publisher.stats()))
+
+finish("Deadband publisher")
@@ -0,0 +1,119 @@
+import time
+import socket
+
+# Ranks Greengrass core addresses with rankEndpoints(). Fake probes with set connect
+# times (a stale address hangs until the deadline) check the ordering, staggering and
+# deadline and compare the time to pick a core with the old serial ping-then-connect
+# loop. Finishes with real TCP probes against a local listener and a closed port.
+from sim_harness import check, finish
+from endpoint_probe import endpointCandidates, probeEndpoint, rankEndpoints
+
+# the old loop: 2 s ping of the last host, then a 10 s MQTT connect timeout per dead address
+legacyPingSec = 2
+legacyConnectTimeoutSec = 10
+
+
+def fakeProbe(latencies, started):
+    # latencies: {host: seconds, or None for an address that never answers}
+    def probe(host, port, timeoutSec, tlsContext):
+        started.append((host, time.monotonic()))
+        latency = latencies[host]
+        if latency is None or latency > timeoutSec:
+            time.sleep(timeoutSec)
+            raise socket.timeout("timed out")
+        if latency < 0:
+            time.sleep(-latency)
+            raise ConnectionRefusedError("connection refused")
+        time.sleep(latency)
+        return latency * 1000
+    return probe
+
+
+def groupInfo(hosts, ranking=None):
+    info = {'GGGroups': [{'Cores': [{'Connectivity': [{'HostAddress': host, 'PortNumber': 8883} for host in hosts]}]}]}
+    if ranking is not None:
+        info['LAST_Ranking'] = ranking
+    return info
+
+
+# candidates: discovery order, localhost dropped, last ranking first
+info = groupInfo(["127.0.0.1", "10.0.0.5", "192.168.1.20", "10.0.0.5", "fd00::5"],
+                 [{'host': "192.168.1.20", 'port': 8883, 'latency_ms': 4.1},
+                  {'host': "10.0.0.9", 'port': 8883, 'latency_ms': 2.0},
+                  {'host': "fd00::5", 'port': 8883, 'latency_ms': None}])
+candidates = endpointCandidates(info)
+check("candidates follow the last ranking", candidates == [("192.168.1.20", 8883), ("10.0.0.5", 8883), ("fd00::5", 8883)],
+      str(candidates))
+check("no discovery info, no candidates", endpointCandidates({}) == [])
+
+scenarios = [
+    # name, hosts in discovery order, connect seconds (None = stale)
+    ("stale first", ["10.0.0.5", "192.168.1.20", "172.16.0.3"], {"10.0.0.5": None, "192.168.1.20": 0.03, "172.16.0.3": 0.08}),
+    ("two stale", ["10.0.0.5", "10.0.0.6", "192.168.1.20"], {"10.0.0.5": None, "10.0.0.6": None, "192.168.1.20": 0.02}),
+    ("refused first", ["10.0.0.5", "192.168.1.20"], {"10.0.0.5": -0.01, "192.168.1.20": 0.05}),
+    ("all reachable", ["10.0.0.5", "192.168.1.20"], {"10.0.0.5": 0.12, "192.168.1.20": 0.02}),
+]
+print("{0:>14} {1:>10} {2:>10}  winner".format("", "old sec", "new sec"))
+for name, hosts, latencies in scenarios:
+    legacySec = legacyPingSec
+    for host in hosts:
+        if latencies[host] is not None and latencies[host] >= 0:
+            legacySec += latencies[host]
+            break
+        legacySec += legacyConnectTimeoutSec if latencies[host] is None else -latencies[host]
+    started = []
+    start = time.monotonic()
+    ranking = rankEndpoints([(host, 8883) for host in hosts], deadlineSec=1.0, staggerSec=0.05, settleSec=0.1,
+                            probeFunc=fakeProbe(latencies, started))
+    newSec = time.monotonic() - start
+    print("{0:>14} {1:>10.2f} {2:>10.2f}  {3}".format(name, legacySec, newSec, ranking[0]['host']))
+    fastest = min((h for h in hosts if latencies[h] is not None and latencies[h] >= 0), key=lambda h: latencies[h])
+    check(name + ": fastest core wins", ranking[0]['host'] == fastest and ranking[0]['latency_ms'] is not None,
+          str(ranking))
+    check(name + ": picked well before the deadline", newSec < 0.6, str(newSec))
+    check(name + ": every candidate is ranked", sorted(r['host'] for r in ranking) == sorted(hosts), str(ranking))
+
+# staggered starts, and a failure starts the next probe at once
+started = []
+rankEndpoints([("a", 1), ("b", 1), ("c", 1)], deadlineSec=1.0, staggerSec=0.1, settleSec=0.05,
+              probeFunc=fakeProbe({"a": None, "b": None, "c": 0.01}, started))
+gaps = [round(b[1] - a[1], 2) for a, b in zip(started, started[1:])]
+check("probes start staggered", [h for h, t in started] == ["a", "b", "c"] and all(0.08 <= g <= 0.15 for g in gaps),
+      str(gaps))
+started = []
+rankEndpoints([("a", 1), ("b", 1)], deadlineSec=1.0, staggerSec=0.5, settleSec=0.05,
+              probeFunc=fakeProbe({"a": -0.01, "b": 0.01}, started))
+check("a refused probe starts the next at once", len(started) == 2 and started[1][1] - started[0][1] < 0.1,
+      str(started))
+
+# nothing reachable: bounded by the deadline, reasons kept
+start = time.monotonic()
+ranking = rankEndpoints([("a", 1), ("b", 1)], deadlineSec=0.3, staggerSec=0.1,
+                        probeFunc=fakeProbe({"a": None, "b": -0.01}, []))
+elapsed = time.monotonic() - start
+check("unreachable cores are bounded by the deadline", elapsed < 0.45 and
+      all(r['latency_ms'] is None for r in ranking), str((elapsed, ranking)))
+errors = dict((r['host'], r['error']) for r in ranking)
+check("failure reasons are kept", errors["b"] == "connection refused" and errors["a"] in ("timed out", "timeout"),
+      str(ranking))
+check("no candidates is an empty ranking", rankEndpoints([]) == [])
+
+# real TCP probes
+listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+listener.bind(("127.0.0.1", 0))
+listener.listen(4)
+openPort = listener.getsockname()[1]
+closed = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+closed.bind(("127.0.0.1", 0))
+closedPort = closed.getsockname()[1]
+closed.close()
+try:
+    latencyMs = probeEndpoint("127.0.0.1", openPort, 1.0)
+    check("TCP probe measures a listening port", 0 <= latencyMs < 500, str(latencyMs))
+    ranking = rankEndpoints([("127.0.0.1", closedPort), ("127.0.0.1", openPort)], deadlineSec=1.0)
+    check("TCP ranking puts the listening port first", ranking[0]['port'] == openPort and
+          ranking[1]['latency_ms'] is None, str(ranking))
+finally:
+    listener.close()
+
+finish("Endpoint probe")
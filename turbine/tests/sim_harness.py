@@ -0,0 +1,33 @@
+import os
+import sys
+
+# Shared by the sim_*.py and bench_*.py scripts. Importing it puts the turbine
+# directory and the repo root (for common/) on the path, so import it before the
+# modules under test. check() prints PASS/FAIL for each named check and finish()
+# exits 0 only if all of them passed, like the hardware tests that test_hardware.sh
+# runs.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+successCnt = 0
+testCnt = 0
+
+
+def check(name, passed, detail=""):
+    global successCnt, testCnt
+    testCnt += 1
+    if passed:
+        successCnt += 1
+        print("PASS " + name)
+    else:
+        print("FAIL " + name + " " + detail)
+    return passed
+
+
+def finish(subject):
+    if successCnt == testCnt:
+        print(subject + " is working")
+        sys.exit(0)
+    else:
+        print(subject + " is NOT working")
+        sys.exit(1)
@@ -0,0 +1,67 @@
+import time
+import random
+import threading
+
+# Measures how long the idle wait takes to wake up once a simulated rotation
+# sensor starts pulsing, and compares it with the old loop of 5 second sleeps
+# with a speed check in between (plus the extra 5 second sleep after it saw motion).
+from sim_harness import check, finish
+from common.idle_wait import IdleWaiter
+
+random.seed(5)
+
+
+def pulseSource(waiter, rpm, startDelaySec, pulseCnt, firstPulse):
+    time.sleep(startDelaySec)
+    periodSec = 60.0 / rpm
+    for i in range(pulseCnt):
+        if i == 0:
+            firstPulse.append(time.time())
+        waiter.notify()
+        time.sleep(periodSec)
+
+
+def oldLoopLatency(motionAt):
+    # the old loop checked the speed every 5 s and slept 5 s more after seeing motion
+    return (5 - motionAt % 5) + 5
+
+
+print("{0:>8} {1:>12} {2:>12} {3:>12}".format("rpm", "period ms", "wake ms", "old loop ms"))
+for rpm in [30, 120, 600, 3000]:
+    waiter = IdleWaiter()
+    firstPulse = []
+    startDelay = random.uniform(0.2, 0.5)
+    source = threading.Thread(target=pulseSource, args=(waiter, rpm, startDelay, 4, firstPulse))
+    source.start()
+    woke = waiter.waitForMotion(10)
+    latencyMs = (time.time() - firstPulse[0]) * 1000
+    source.join()
+    periodMs = 60000.0 / rpm
+    oldMs = oldLoopLatency(random.uniform(0, 60)) * 1000
+    print("{0:>8} {1:>12.1f} {2:>12.1f} {3:>12.0f}".format(rpm, periodMs, latencyMs, oldMs))
+    # the second pulse gives the first full period, so wake one period after motion
+    check("wakes within one pulse period at " + str(rpm) + " RPM", woke and latencyMs <= periodMs + 50,
+          str(latencyMs) + " ms")
+
+waiter = IdleWaiter()
+pollCnt = [0]
+
+
+def countPoll():
+    pollCnt[0] += 1
+
+
+started = time.time()
+woke = waiter.waitForMotion(0.5, countPoll)
+elapsed = time.time() - started
+check("heartbeat timeout without motion", not woke and 0.5 <= elapsed < 0.6 and waiter.heartbeatCnt == 1,
+      str(elapsed))
+check("buttons polled while idle", pollCnt[0] >= 4, str(pollCnt[0]))
+
+waiter = IdleWaiter()
+threading.Timer(0.2, waiter.cancel).start()
+started = time.time()
+woke = waiter.waitForMotion(10)
+check("cancel releases the wait", not woke and time.time() - started < 0.5)
+
+finish("Idle wake")
@@ -0,0 +1,79 @@
+import os
+import shutil
+import tempfile
+import numpy as np
+
+# Checks the on-device power curves: the Welford count, mean and std of every bin
+# against numpy on the same samples, out-of-range x values landing in the edge bins,
+# the checkpoint round trip through its atomic rename, and a checkpoint written with
+# a different bin layout being ignored rather than restored into the wrong bins.
+from sim_harness import check, finish
+from power_curve import BinnedCurve, PowerCurveEngine
+
+np.random.seed(3)
+
+rpm = np.random.uniform(0, 1000, 5000)
+voltage = 0.012 * rpm + np.random.normal(0, 0.3, len(rpm))
+power = voltage * voltage / 10.0
+curve = BinnedCurve('rpm', 50, 20, ['voltage', 'power_w'])
+for i in range(len(rpm)):
+    curve.add(rpm[i], (voltage[i], power[i]))
+
+bins = np.minimum((rpm // 50).astype(int), 19)
+worst = 0.0
+for idx in range(20):
+    inBin = bins == idx
+    values = np.column_stack((voltage[inBin], power[inBin]))
+    worst = max(worst, np.max(np.abs(curve.mean[idx] - values.mean(axis=0))),
+                np.max(np.abs(np.sqrt(curve.m2[idx] / (inBin.sum() - 1)) - values.std(axis=0, ddof=1))))
+check("bin counts match", list(curve.count) == [int((bins == idx).sum()) for idx in range(20)])
+check("welford mean and std match numpy", worst < 1e-9, str(worst))
+
+summary = curve.summary()
+firstBin = summary['bins'][0]
+check("summary rows are bin start, count, means, stds", summary['fields'] == ['voltage', 'power_w'] and
+      len(firstBin) == 6 and firstBin[0] == 0.0 and firstBin[1] == curve.count[0], str(firstBin))
+
+edges = BinnedCurve('wind', 1, 10, ['power_w'])
+edges.add(-3, (1.0,))
+edges.add(25, (2.0,))
+edges.add(25, (4.0,))
+check("out of range values land in the edge bins", edges.count[0] == 1 and edges.count[9] == 2 and
+      edges.mean[9][0] == 3.0 and edges.count.sum() == 3)
+check("empty bins are left out of the summary", [row[0] for row in edges.summary()['bins']] == [0.0, 9.0])
+check("single sample bins report zero std", edges.summary()['bins'][0][-1] == 0.0)
+
+tmpDir = tempfile.mkdtemp()
+try:
+    path = os.path.join(tmpDir, 'power-curve.npz')
+    engine = PowerCurveEngine(path, rpmBinWidth=50, rpmBinCnt=20, windBinWidth=1, windBinCnt=25)
+    check("no checkpoint restores nothing", engine.load() == 0)
+    for i in range(500):
+        engine.add(rpm[i], voltage[i], power[i], wind=rpm[i] / 50.0 if i % 2 else None)
+    check("additions mark the engine dirty", engine.dirty)
+    engine.checkpoint()
+    check("checkpoint written with no temp file left", os.path.exists(path) and not os.path.exists(path + '.tmp')
+          and not engine.dirty)
+
+    restored = PowerCurveEngine(path, rpmBinWidth=50, rpmBinCnt=20, windBinWidth=1, windBinCnt=25)
+    check("both curves restored", restored.load() == 2)
+    check("restored curves match the saved ones", all(
+        np.array_equal(a.count, b.count) and np.array_equal(a.mean, b.mean) and np.array_equal(a.m2, b.m2)
+        for a, b in zip(engine.curves, restored.curves)))
+    check("only intervals with wind are in the wind curve", restored.windCurve.count.sum() == 250 and
+          restored.rpmCurve.count.sum() == 500)
+    restored.add(500, 6.0, 3.6)
+    check("a restored curve keeps accumulating", restored.rpmCurve.count.sum() == 501)
+
+    # a changed bin layout in the settings must not reuse the old arrays
+    changed = PowerCurveEngine(path, rpmBinWidth=25, rpmBinCnt=40, windBinWidth=1, windBinCnt=25)
+    check("layout mismatch skips that curve only", changed.load() == 1 and changed.rpmCurve.count.sum() == 0 and
+          changed.windCurve.count.sum() == 250)
+
+    with open(path, 'wb') as outfile:
+        outfile.write(b'not a checkpoint')
+    check("unreadable checkpoint restores nothing", PowerCurveEngine(path).load() == 0)
+finally:
+    shutil.rmtree(tmpDir)
+
+finish("Power curve")
@@ -0,0 +1,74 @@
+import numpy as np
+
+# Checks the rotor timing features on synthetic period series: spread and jitter of
+# a steady rotor, a once-per-revolution speed ripple found at the right lag and
+# flagged, a spin-up ramp that must not read as ripple, the deviation histogram,
+# and the analyzer taking only the new edges from the RPM estimator's ring each
+# interval, without the periods across a stall.
+from sim_harness import check, finish
+from rpm_estimator import RpmEstimator, nsPerSec
+from rev_analysis import RevolutionAnalyzer, analyzePeriods, periodHistEdges
+
+np.random.seed(5)
+
+check("too few periods give no features", analyzePeriods(np.full(7, 100.0)) is None)
+
+steady = 100.0 * (1 + np.random.normal(0, 0.001, 200))
+features = analyzePeriods(steady)
+print("steady: " + str(features))
+check("steady rotor period and spread", abs(features['period_ms'] - 100) < 0.05 and features['cv'] < 0.002,
+      str(features))
+check("steady rotor is not flagged", not features['ripple_flag'])
+check("histogram counts every period", sum(features['hist']) == 200 and
+      len(features['hist']) == len(periodHistEdges) + 1)
+
+alternating = np.tile([99.0, 101.0], 20)
+features = analyzePeriods(alternating)
+check("cycle-to-cycle jitter", abs(features['jitter_ms'] - 2.0) < 1e-6, str(features['jitter_ms']))
+check("deviations land in the right bins", features['hist'][periodHistEdges.index(-1)] == 20 and
+      features['hist'][periodHistEdges.index(1)] == 20, str(features['hist']))
+
+# three pulses per revolution, one blade slower: the pattern repeats every 3 periods
+pattern = np.array([1.0, 0.0, -1.0])
+imbalance = 100.0 * (1 + 0.02 * np.tile(pattern, 40) + np.random.normal(0, 0.002, 120))
+features = analyzePeriods(imbalance)
+print("imbalance: " + str(features))
+check("ripple found at the pulses per revolution", features['ripple_lag'] == 3 and features['ripple'] > 0.8,
+      str(features))
+check("ripple flagged", features['ripple_flag'])
+check("ripple too small to matter is not flagged",
+      not analyzePeriods(100.0 * (1 + 0.001 * np.tile(pattern, 40)))['ripple_flag'])
+
+ramp = np.linspace(120, 80, 120) + np.random.normal(0, 0.2, 120)
+features = analyzePeriods(ramp)
+print("ramp: " + str(features))
+check("a spin-up ramp is not a ripple", not features['ripple_flag'] and features['ripple'] < 0.5, str(features))
+check("a constant period has no ripple", analyzePeriods(np.full(50, 100.0))['ripple_lag'] == 0)
+
+
+def feed(estimator, startNs, periodsMs):
+    t = startNs
+    for period in periodsMs:
+        t += int(period * 1e6)
+        estimator.onEdge(t)
+    return t
+
+
+estimator = RpmEstimator(pulsesPerRev=3, capacity=64)
+analyzer = RevolutionAnalyzer(estimator)
+t = feed(estimator, 0, imbalance[:40])
+features = analyzer.analyze()
+check("first interval uses its edges", features is not None and features['n'] == 39, str(features and features['n']))
+check("no new edges, no features", analyzer.analyze() is None)
+t = feed(estimator, t, imbalance[40:60])
+check("the next interval starts at the last edge read", analyzer.analyze()['n'] == 20)
+
+t = feed(estimator, t, imbalance[60:120])
+features = analyzer.analyze()
+check("a lapped ring keeps only the newest edges", features['n'] == estimator.capacity - 9, str(features['n']))
+
+t = feed(estimator, t + 20 * nsPerSec, steady[:30])
+features = analyzer.analyze()
+check("the gap across a stall is left out", features['n'] == 29 and features['period_ms'] < 101, str(features))
+
+finish("Revolution analysis")
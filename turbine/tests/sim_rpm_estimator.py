@@ -0,0 +1,86 @@
+import random
+
+# Feeds synthetic rotation sensor pulse trains into the RPM estimator on a
+# simulated clock: steady speeds with timing jitter, contact bounce, speeds above
+# the old 3000 RPM bouncetime cap, very slow rotation and a stop.
+from sim_harness import check, finish
+from rpm_estimator import RpmEstimator, nsPerSec
+
+random.seed(3)
+
+
+def pulseTrain(estimator, startNs, rpm, durationSec, jitterPct=0.0, bounceCnt=0, bounceNs=300000):
+    # returns the time of the last pulse; bounceCnt extra edges follow each real one
+    periodNs = 60.0 * nsPerSec / (rpm * estimator.pulsesPerRev)
+    t = startNs
+    endNs = startNs + durationSec * nsPerSec
+    while t + periodNs <= endNs:
+        t += periodNs * (1 + random.gauss(0, jitterPct / 100.0))
+        estimator.onEdge(int(t))
+        for i in range(bounceCnt):
+            estimator.onEdge(int(t + (i + 1) * bounceNs))
+    return int(t)
+
+
+def near(value, expected, pct):
+    return abs(value - expected) <= expected * pct / 100.0
+
+
+estimator = RpmEstimator()
+lastNs = pulseTrain(estimator, 0, 600, 10)
+rpm = estimator.estimate(lastNs + 1000)
+check("steady 600 RPM", near(rpm, 600, 0.1), str(rpm))
+
+estimator = RpmEstimator()
+lastNs = pulseTrain(estimator, 0, 600, 10, jitterPct=5)
+rpm = estimator.estimate(lastNs + 1000)
+check("600 RPM with 5% period jitter averages out", near(rpm, 600, 3), str(rpm))
+
+estimator = RpmEstimator()
+lastNs = pulseTrain(estimator, 0, 300, 10, bounceCnt=3)
+rpm = estimator.estimate(lastNs + 1000)
+check("contact bounce is rejected", near(rpm, 300, 0.1) and estimator.glitchCnt > 100,
+      str(rpm) + " glitches " + str(estimator.glitchCnt))
+
+estimator = RpmEstimator()
+lastNs = pulseTrain(estimator, 0, 6000, 5)
+rpm = estimator.estimate(lastNs + 1000)
+check("6000 RPM, above the old bouncetime cap", near(rpm, 6000, 0.1), str(rpm))
+
+estimator = RpmEstimator(pulsesPerRev=4)
+lastNs = pulseTrain(estimator, 0, 900, 5)
+rpm = estimator.estimate(lastNs + 1000)
+check("4 pulses per revolution", near(rpm, 900, 0.1), str(rpm))
+
+# 10 RPM is one pulse every 6 seconds, slower than the 2 second window
+estimator = RpmEstimator()
+lastNs = pulseTrain(estimator, 0, 10, 30)
+rpm = estimator.estimate(lastNs + nsPerSec)
+check("below one pulse per window uses the last period", near(rpm, 10, 0.1), str(rpm))
+rpm = estimator.estimate(lastNs + 8 * nsPerSec)
+check("overdue pulse lowers the estimate", near(rpm, 60.0 / 8, 0.1), str(rpm))
+rpm = estimator.estimate(lastNs + 11 * nsPerSec)
+check("no pulse for stallSec reads as stopped", rpm == 0, str(rpm))
+
+# spin up, publish interval stats, then coast down and stop
+estimator = RpmEstimator()
+lastNs = pulseTrain(estimator, 0, 200, 5)
+estimator.intervalStats(lastNs)
+t = lastNs
+for rpm in range(200, 801, 50):
+    t = pulseTrain(estimator, t, rpm, 0.5)
+stats = estimator.intervalStats(t + 1000)
+check("interval stats track the spin up",
+      near(stats['min'], 200, 10) and near(stats['max'], 800, 10) and stats['min'] < stats['mean'] < stats['max'],
+      str(stats))
+stats = estimator.intervalStats(t + 20 * nsPerSec)
+check("interval stats after a stop", stats == {'min': 0, 'max': 0, 'mean': 0}, str(stats))
+
+# a genuine jump in speed must not lock the glitch filter out
+estimator = RpmEstimator()
+t = pulseTrain(estimator, 0, 100, 10)
+t = pulseTrain(estimator, t, 1000, 3)
+rpm = estimator.estimate(t + 1000)
+check("recovers from a step change in speed", near(rpm, 1000, 1), str(rpm))
+
+finish("RPM estimator")
@@ -0,0 +1,91 @@
+import os
+import json
+import time
+import shutil
+import tempfile
+import threading
+
+# Exercises ShadowCache: the time from start to having the settings, atomic writes
+# surviving a torn temp file, version-ordered merges, and reconciling against a
+# cloud shadow get. Finishes with the ShadowReporter keeping the cache current
+# from its accepted updates.
+from sim_harness import check, finish
+from shadow_cache import ShadowCache, reconcileCloud, reconcileSame, reconcileLocal
+from shadow_reporter import ShadowReporter
+
+
+tmpDir = tempfile.mkdtemp()
+cachePath = os.path.join(tmpDir, 'shadow-cache.json')
+settings = {"data_path": "fast", "data_fast_interval": 2, "vibe_limit": 4.5, "hires_publish_mode": "on",
+            "deadband": {"turbine_speed": {"abs": 5}}, "target_rpm": 350}
+
+try:
+    cache = ShadowCache(cachePath)
+    check("missing cache loads as empty", not cache.load() and cache.snapshot() == ({}, {}, None))
+
+    cache.reconcile({"state": {"reported": settings, "desired": {"vibe_limit": 4.5}}, "version": 10})
+    start = time.time()
+    startup = ShadowCache(cachePath)
+    loaded = startup.load()
+    loadMs = (time.time() - start) * 1000
+    print("settings available {0:.2f} ms after start".format(loadMs))
+    check("cached settings load at startup", loaded and startup.snapshot() == (settings, {"vibe_limit": 4.5}, 10),
+          str(startup.snapshot()))
+    check("settings load well under a second", loadMs < 100, str(loadMs))
+
+    # a power cut while writing leaves a torn temp file; the cache itself is intact
+    with open(cachePath + '.tmp', 'w') as f:
+        f.write('{"reported": {"data_pa')
+    torn = ShadowCache(cachePath)
+    check("torn write keeps the previous copy", torn.load() and torn.version == 10)
+    with open(cachePath, 'w') as f:
+        f.write('{"reported": ')
+    check("unreadable cache falls back to defaults", not ShadowCache(cachePath).load())
+
+    cache = ShadowCache(cachePath)
+    cache.reconcile({"state": {"reported": settings}, "version": 10})
+    cache.update(reported={"vibe_limit": 3.0, "target_rpm": None}, version=11)
+    reloaded = ShadowCache(cachePath)
+    reloaded.load()
+    check("update is written through", reloaded.reported.get("vibe_limit") == 3.0 and reloaded.version == 11)
+    check("null removes a setting", "target_rpm" not in reloaded.reported)
+    cache.update(reported={"spectral_mode": "off"}, version=9)
+    check("an older acknowledgement doesn't move the version back", cache.version == 11 and
+          cache.reported.get("spectral_mode") == "off")
+
+    check("same version is already in sync", cache.reconcile({"state": {"reported": {}}, "version": 11}) == reconcileSame)
+    check("older cloud shadow asks for the cache to be reported",
+          cache.reconcile({"state": {"reported": {}}, "version": 3}) == reconcileLocal)
+    cloud = {"state": {"reported": {"data_path": "slow"}, "desired": {"data_path": "slow"}}, "version": 14}
+    check("newer cloud shadow wins", cache.reconcile(cloud) == reconcileCloud and
+          cache.snapshot() == ({"data_path": "slow"}, {"data_path": "slow"}, 14), str(cache.snapshot()))
+
+    # a change nobody saw (versions 15-16) means an equal version can't be trusted
+    cache.update(reported={"vibe_limit": 5}, version=17)
+    check("a gap in versions forces a full reconcile",
+          cache.reconcile({"state": {"reported": {"vibe_limit": 5, "data_path": "fast"}}, "version": 17}) ==
+          reconcileCloud and cache.reported.get("data_path") == "fast")
+
+    # accepted reporter updates keep the cache current
+    version = [17]
+
+    def shadowUpdate(document, callback, timeoutSec):
+        version[0] += 1
+        payload = json.dumps({"state": json.loads(document.decode("utf-8"))["state"], "version": version[0]})
+        threading.Timer(0.01, callback, (payload, "accepted", "token-" + str(version[0]))).start()
+        return "token-" + str(version[0])
+
+    reporter = ShadowReporter(shadowUpdate, flushWindowSec=0.02,
+                              onAcceptedFunc=lambda state, v: cache.update(state.get("reported"), state.get("desired"), v))
+    reporter.start()
+    reporter.report({"brake_status": "OFF", "report_mode": "exception"})
+    reporter.flush(2)
+    reporter.stop()
+    reloaded = ShadowCache(cachePath)
+    reloaded.load()
+    check("accepted reports reach the cache", reloaded.version == 18 and
+          reloaded.reported.get("brake_status") == "OFF" and reloaded.complete, str(reloaded.snapshot()))
+finally:
+    shutil.rmtree(tmpDir)
+
+finish("Shadow cache")
@@ -0,0 +1,167 @@
+import json
+import time
+import threading
+
+# Drives ShadowReporter against a fake shadow service that acknowledges from its own
+# thread after a delay and can be told to time out, reject, fail or send a late
+# duplicate. Checks that a multi-setting delta goes out as one document, that
+# report() never blocks, and how failures are retried, and compares the round trips
+# and caller blocking time with the old one-blocking-update-per-setting approach.
+from sim_harness import check, finish
+from shadow_reporter import ShadowReporter
+
+ackDelaySec = 0.05
+
+
+class FakeShadow(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.documents = []
+        self.sendTimes = []
+        self.state = {}
+        self.version = 0
+        # one entry per update: 'accept', 'timeout', 'reject400', 'reject500', 'raise', 'late'
+        self.script = []
+        self.lateAcks = []
+
+    def shadowUpdate(self, document, callback, timeoutSec):
+        with self.lock:
+            mode = self.script.pop(0) if self.script else 'accept'
+            self.sendTimes.append(time.time())
+            if mode == 'raise':
+                raise RuntimeError("not connected")
+            token = "token-" + str(len(self.sendTimes))
+            state = json.loads(document.decode("utf-8"))["state"]
+            self.documents.append(state)
+        threading.Timer(ackDelaySec, self.reply, (state, callback, token, mode)).start()
+        return token
+
+    def reply(self, state, callback, token, mode):
+        with self.lock:
+            if mode in ('accept', 'late'):
+                for section, values in state.items():
+                    self.state.setdefault(section, {}).update(values)
+                self.version += 1
+                payload = json.dumps({"state": state, "version": self.version})
+        if mode == 'accept':
+            callback(payload, "accepted", token)
+        elif mode == 'late':
+            # the ack goes missing now and turns up after the retry was accepted
+            self.lateAcks.append((payload, callback, token))
+            callback(None, "timeout", token)
+        elif mode == 'timeout':
+            callback(None, "timeout", token)
+        elif mode == 'reject400':
+            callback(json.dumps({"code": 400, "message": "Payload contains invalid json"}), "rejected", token)
+        elif mode == 'reject500':
+            callback(json.dumps({"code": 500, "message": "Internal service failure"}), "rejected", token)
+
+
+def newReporter(shadow, connected=None, **kw):
+    kw.setdefault('flushWindowSec', 0.05)
+    kw.setdefault('initialBackoffSec', 0.05)
+    kw.setdefault('maxBackoffSec', 0.4)
+    reporter = ShadowReporter(shadow.shadowUpdate, connected, **kw)
+    reporter.start()
+    return reporter
+
+
+delta = [("data_path", "fast"), ("data_fast_interval", 2), ("vibe_limit", 4.5), ("spectral_mode", "off"),
+         ("report_mode", "exception")]
+
+# old: one blocking update per setting, each waiting for its acknowledgement
+shadow = FakeShadow()
+start = time.time()
+for key, value in delta:
+    done = threading.Event()
+    shadow.shadowUpdate(json.dumps({"state": {"reported": {key: value}}}).encode("utf-8"),
+                        lambda payload, status, token: done.set(), 5)
+    done.wait(5)
+oldBlockedMs = (time.time() - start) * 1000
+oldTrips = len(shadow.documents)
+
+# new: report() returns at once, one merged document
+shadow = FakeShadow()
+reporter = newReporter(shadow)
+start = time.time()
+for key, value in delta:
+    reporter.report({key: value})
+newBlockedMs = (time.time() - start) * 1000
+flushed = reporter.flush(2)
+reporter.stop()
+print("{0:>8} {1:>12} {2:>16}".format("", "round trips", "caller blocked ms"))
+print("{0:>8} {1:>12} {2:>16.1f}".format("old", oldTrips, oldBlockedMs))
+print("{0:>8} {1:>12} {2:>16.2f}".format("new", len(shadow.documents), newBlockedMs))
+check("five settings go out as one document", len(shadow.documents) == 1 and
+      shadow.documents[0] == {"reported": dict(delta)}, str(shadow.documents))
+check("report() doesn't wait for the network", newBlockedMs < 5, str(newBlockedMs))
+check("flush confirms the update", flushed and reporter.acceptedCnt == 1 and shadow.version == 1)
+check("reporter tracks the shadow version", reporter.version == 1, str(reporter.version))
+
+# a timeout is retried, and values reported meanwhile ride along (newer wins)
+shadow = FakeShadow()
+shadow.script = ['timeout']
+reporter = newReporter(shadow)
+reporter.report({"brake_status": "ON", "vibe_limit": 5})
+time.sleep(0.08)
+reporter.report({"brake_status": "OFF"})
+reporter.flush(2)
+reporter.stop()
+check("timed out update is retried", reporter.retryCnt == 1 and len(shadow.documents) == 2, str(shadow.documents))
+check("retry carries the newest values", shadow.state.get("reported") == {"brake_status": "OFF", "vibe_limit": 5},
+      str(shadow.state))
+
+# send failures back off exponentially up to the cap
+shadow = FakeShadow()
+shadow.script = ['raise'] * 5
+reporter = newReporter(shadow)
+reporter.report({"brake_status": "ON"})
+reporter.flush(3)
+reporter.stop()
+gaps = [round(b - a, 2) for a, b in zip(shadow.sendTimes, shadow.sendTimes[1:])]
+print("retry gaps: " + str(gaps))
+check("backoff doubles", all(b >= a * 1.6 for a, b in zip(gaps[:3], gaps[1:4])), str(gaps))
+check("backoff is capped", max(gaps) < 0.4 + 0.1, str(gaps))
+check("delivered after the failures", shadow.state.get("reported") == {"brake_status": "ON"}, str(shadow.state))
+
+# rejected as invalid is dropped, a service error is retried
+shadow = FakeShadow()
+shadow.script = ['reject400', 'reject500']
+reporter = newReporter(shadow)
+reporter.report({"deadband": "bad"})
+reporter.flush(1)
+reporter.report({"keyframe_sec": 60})
+reporter.flush(2)
+reporter.stop()
+check("4xx rejection is dropped", reporter.droppedCnt == 1 and "deadband" not in shadow.state.get("reported", {}),
+      str(shadow.documents))
+check("5xx rejection is retried", shadow.state.get("reported") == {"keyframe_sec": 60} and reporter.retryCnt == 1,
+      str(shadow.documents))
+
+# a late acknowledgement for an update already retried is ignored
+shadow = FakeShadow()
+shadow.script = ['late']
+reporter = newReporter(shadow)
+reporter.report({"brake_status": "ON"})
+reporter.flush(2)
+versionBefore = reporter.version
+payload, callback, token = shadow.lateAcks[0]
+callback(payload, "accepted", token)
+reporter.stop()
+check("stale acknowledgement is ignored", reporter.staleCnt == 1 and reporter.version == versionBefore,
+      str((reporter.staleCnt, reporter.version, versionBefore)))
+check("older shadow versions are recognised", not reporter.observeVersion(1) and reporter.observeVersion(5))
+
+# nothing is sent while offline
+shadow = FakeShadow()
+connected = threading.Event()
+reporter = newReporter(shadow, connected)
+reporter.report({"brake_status": "ON"})
+time.sleep(0.3)
+offlineSent = len(shadow.sendTimes)
+connected.set()
+reporter.flush(3)
+reporter.stop()
+check("waits for the connection", offlineSent == 0 and len(shadow.documents) == 1, str(offlineSent))
+
+finish("Shadow reporter")
@@ -0,0 +1,147 @@
+import os
+import time
+import shutil
+import sqlite3
+import tempfile
+import threading
+
+# Exercises the store-and-forward queue on a temporary database: eviction order and
+# byte accounting at the disk cap, writes reaching the disk while the telemetry has
+# stopped, replay after the database is reopened, the drainer deleting each
+# replayed batch in one transaction, and close() stopping a drainer part way through
+# a replay before the database goes away.
+from sim_harness import check, finish
+from common.store_forward import StoreForwardQueue, StoreForwardDrainer
+
+
+def storedBytes(queue):
+    with queue.lock:
+        return queue.db.execute('SELECT COALESCE(SUM(size), 0) FROM messages').fetchone()[0]
+
+
+def committedCount(dbPath):
+    # a second connection only sees committed rows
+    db = sqlite3.connect(dbPath)
+    try:
+        return db.execute('SELECT COUNT(*) FROM messages').fetchone()[0]
+    finally:
+        db.close()
+
+
+tmpDir = tempfile.mkdtemp()
+try:
+    # eviction: lowest priority first, oldest first within it, until back under the cap
+    dbPath = os.path.join(tmpDir, 'evict.db')
+    topic = 'dt/windfarm/turbine/t1'
+    size = 100 + len(topic)
+    queue = StoreForwardQueue(dbPath, maxBytes=size * 10)
+    for i in range(6):
+        queue.put(topic, b'L%03d' % i + b'x' * 96, priority=0)
+    for i in range(6):
+        queue.put(topic, b'H%03d' % i + b'x' * 96, priority=2)
+    queue.flush()
+    remaining = [bytes(payload)[:4] for rowId, t, payload, qos in queue.peek(100)]
+    check("eviction drops the oldest low priority messages", remaining ==
+          [b'H000', b'H001', b'H002', b'H003', b'H004', b'H005', b'L002', b'L003', b'L004', b'L005'], str(remaining))
+    check("evicted count", queue.evictedCnt == 2 and queue.count() == 10)
+    check("byte accounting matches the database", queue.totalBytes == storedBytes(queue) == size * 10,
+          str((queue.totalBytes, storedBytes(queue))))
+    for i in range(4):
+        queue.put(topic, b'M%03d' % i + b'x' * 96, priority=1)
+    queue.flush()
+    remaining = [bytes(payload)[:1] for rowId, t, payload, qos in queue.peek(100)]
+    check("higher priority arrivals push out the remaining low priority ones",
+          remaining.count(b'L') == 0 and remaining.count(b'M') == 4, str(remaining))
+    rows = queue.peek(3)
+    queue.removeMany([rowId for rowId, t, payload, qos in rows] + [999999])
+    check("removal keeps the byte count, unknown ids ignored", queue.totalBytes == storedBytes(queue) == size * 7,
+          str((queue.totalBytes, storedBytes(queue))))
+    queue.close()
+
+    # writes stop while offline: the drainer's wait commits them without another put
+    dbPath = os.path.join(tmpDir, 'idle.db')
+    queue = StoreForwardQueue(dbPath, syncBatch=50, syncIntervalSec=0.2)
+    offline = threading.Event()
+    drainer = StoreForwardDrainer(queue, lambda topic, payload, qos: True, offline)
+    drainer.start()
+    queue.put(topic, b'first')
+    for i in range(5):
+        queue.put(topic, b'last %d' % i)
+    uncommitted = committedCount(dbPath)
+    time.sleep(0.6)
+    committed = committedCount(dbPath)
+    drainer.stop()
+    check("the last writes are committed while nothing else arrives", uncommitted < 6 and committed == 6,
+          str((uncommitted, committed)))
+
+    # replay after reopening: same order, same byte count
+    queue.put(topic, b'high', priority=2)
+    queue.put(topic, b'low', priority=0)
+    queue.close()
+    queue = StoreForwardQueue(dbPath)
+    check("reopened queue keeps its messages and bytes", queue.count() == 8 and queue.totalBytes == storedBytes(queue))
+    sent = []
+    online = threading.Event()
+    online.set()
+    drainer = StoreForwardDrainer(queue, lambda topic, payload, qos: sent.append(payload), online, drainRate=1000,
+                                  batchSize=3)
+    commitsBefore = queue.commitCnt
+    drainer.start()
+    end = time.time() + 3
+    while queue.count() > 0 and time.time() < end:
+        time.sleep(0.01)
+    drainer.stop()
+    check("replay after reopening sends everything in priority order",
+          sent == [b'high', b'first'] + [b'last %d' % i for i in range(5)] + [b'low'], str(sent))
+    check("replayed messages are removed and the bytes released", queue.count() == 0 and queue.totalBytes == 0)
+    check("one delete transaction per replayed batch", queue.commitCnt - commitsBefore == 3,
+          str(queue.commitCnt - commitsBefore))
+
+    # a failed publish leaves the rest of the batch queued
+    queue.put(topic, b'a')
+    queue.put(topic, b'b')
+    failing = [0]
+
+    def failSecond(topic, payload, qos):
+        failing[0] += 1
+        return failing[0] != 2
+
+    drainer = StoreForwardDrainer(queue, failSecond, online, drainRate=1000)
+    drainer.start()
+    time.sleep(0.3)
+    check("a failed publish stays queued", [bytes(p) for r, t, p, q in queue.peek(10)] == [b'b'])
+    drainer.stop()
+    queue.close()
+
+    # closing while the drainer is replaying a slow batch
+    dbPath = os.path.join(tmpDir, 'close.db')
+    queue = StoreForwardQueue(dbPath)
+    for i in range(20):
+        queue.put(topic, b'slow %d' % i)
+    sent = []
+    threadErrors = []
+    threading.excepthook = lambda args: threadErrors.append(args.exc_value)
+
+    def slowPublish(topic, payload, qos):
+        time.sleep(0.05)
+        sent.append(payload)
+
+    drainer = StoreForwardDrainer(queue, slowPublish, online, drainRate=1000)
+    drainer.start()
+    time.sleep(0.2)
+    started = time.time()
+    queue.close()
+    closeSec = time.time() - started
+    time.sleep(0.1)
+    check("close stops and joins the drainer", not drainer.is_alive() and closeSec < 0.5, str(closeSec))
+    check("the drainer never touches the closed database", threadErrors == [], str(threadErrors))
+    queue = StoreForwardQueue(dbPath)
+    check("messages sent before the close are removed, the rest stay queued", 0 < len(sent) < 20 and
+          queue.count() == 20 - len(sent), str((len(sent), queue.count())))
+    queue.close()
+    queue.close()
+    check("closing twice is harmless", queue.closed)
+finally:
+    shutil.rmtree(tmpDir)
+
+finish("Store-and-forward queue")
@@ -0,0 +1,137 @@
+import time
+import threading
+import numpy as np
+
+# Checks the VibeSampler ring buffer: windows that wrap the end of the ring, a reader
+# that falls more than a buffer behind (the oldest samples are skipped and counted in
+# lostCnt), an idle wait longer than the ring skipped with discard(), and a writer
+# racing a slow reader. Every sample carries its index in X,
+# so a torn, reordered or duplicated slot shows up as a break in the sequence.
+from sim_harness import check, finish
+from vibe_sampler import VibeSampler
+
+capacity = 16
+
+
+def block(start, n):
+    values = np.arange(start, start + n, dtype=np.float32)
+    return np.arange(start, start + n, dtype=np.float64), values, values, values
+
+
+def consecutive(window):
+    return len(window) == 0 or bool(np.all(np.diff(window.x) == 1) and np.all(window.x == window.t))
+
+
+sampler = VibeSampler(lambda: (0.0, 0.0, 0.0), 200, capacity=capacity)
+sampler.writeBlock(*block(0, 10))
+window = sampler.readWindow()
+check("window holds the samples written", list(window.x) == list(range(10)) and window.lostCnt == 0)
+check("nothing new reads as an empty window", len(sampler.readWindow()) == 0)
+
+sampler.writeBlock(*block(10, 12))
+window = sampler.readWindow()
+check("window wrapping the ring end stays in order", list(window.x) == list(range(10, 22)) and window.lostCnt == 0,
+      str(window.x))
+
+sampler.writeBlock(*block(22, 16))
+window = sampler.readWindow()
+check("a full buffer is read without loss", list(window.x) == list(range(22, 38)) and window.lostCnt == 0,
+      str(window.x))
+
+sampler.writeBlock(*block(38, 40))
+check("pending count is capped at the capacity", sampler.pendingCount() == capacity)
+window = sampler.readWindow()
+check("overflow keeps the newest samples", list(window.x) == list(range(62, 78)), str(window.x))
+check("overflow counts the samples lost", window.lostCnt == 24, str(window.lostCnt))
+sampler.writeBlock(*block(78, 3))
+window = sampler.readWindow()
+check("reading resumes after an overflow", list(window.x) == [78, 79, 80] and window.lostCnt == 0)
+
+sampler.writeBlock(*block(81, 100))
+window = sampler.readWindow()
+check("a block larger than the ring keeps its tail", list(window.x) == list(range(165, 181)) and
+      window.lostCnt == 84, str((window.x, window.lostCnt)))
+
+# an idle wait longer than the ring: the samples written meanwhile are skipped, not lost
+sampler.writeBlock(*block(181, 50))
+check("discard skips everything pending", sampler.discard() == 50 and sampler.pendingCount() == 0)
+sampler.writeBlock(*block(231, 5))
+window = sampler.readWindow()
+check("the window after an idle wait is fresh and lossless", list(window.x) == list(range(231, 236)) and
+      window.lostCnt == 0, str((window.x, window.lostCnt)))
+
+# a writer racing a reader that is sometimes a whole buffer behind
+sampler = VibeSampler(lambda: (0.0, 0.0, 0.0), 200, capacity=256)
+written = [0]
+stopWriter = threading.Event()
+
+
+def writer():
+    while not stopWriter.is_set():
+        n = 1 + written[0] % 7
+        sampler.writeBlock(*block(written[0], n))
+        written[0] += n
+
+
+writerThread = threading.Thread(target=writer)
+writerThread.start()
+readCnt = 0
+lostCnt = 0
+windowCnt = 0
+broken = 0
+nextExpected = 0
+lossWindows = 0
+end = time.time() + 1.0
+while time.time() < end:
+    window = sampler.readWindow()
+    windowCnt += 1
+    readCnt += len(window)
+    lostCnt += window.lostCnt
+    lossWindows += window.lostCnt > 0
+    if not consecutive(window) or (len(window) > 0 and window.x[0] != nextExpected + window.lostCnt):
+        broken += 1
+    if len(window) > 0:
+        nextExpected = int(window.x[-1]) + 1
+    # stalls now and then, long enough for the writer to lap the ring
+    time.sleep(0.002 if windowCnt % 10 else 0.02)
+stopWriter.set()
+writerThread.join()
+window = sampler.readWindow()
+readCnt += len(window)
+lostCnt += window.lostCnt
+print("{0} windows, {1} samples read, {2} lost in {3} windows".format(windowCnt, readCnt, lostCnt, lossWindows))
+check("the racing writer overran the reader", lossWindows > 0)
+check("no window has a torn or out-of-order slot", broken == 0, str(broken))
+check("every sample is either read or counted lost", readCnt + lostCnt == written[0],
+      str((readCnt, lostCnt, written[0])))
+
+# the per-sample thread against the same ring
+counter = [0]
+
+
+def countingRead():
+    counter[0] += 1
+    return (float(counter[0]), 0.0, 0.0)
+
+
+sampler = VibeSampler(countingRead, 500, capacity=capacity)
+sampler.start()
+time.sleep(0.3)
+window = sampler.readWindow()
+sampler.stop()
+check("a slow reader of the sampler thread loses only the overwritten samples",
+      len(window) == capacity and window.lostCnt > 0 and bool(np.all(np.diff(window.x) == 1)) and
+      window.x[0] == window.lostCnt + 1, str((len(window), window.lostCnt, window.x[:3])))
+
+# the sampler thread keeps writing through an idle wait several rings long
+sampler = VibeSampler(countingRead, 500, capacity=64)
+sampler.start()
+time.sleep(0.5)
+sampler.discard()
+time.sleep(0.02)
+window = sampler.readWindow()
+sampler.stop()
+check("resync after idle keeps the next window lossless", 0 < len(window) < 64 and window.lostCnt == 0,
+      str((len(window), window.lostCnt)))
+
+finish("Vibration sampler")
@@ -0,0 +1,136 @@
+import time
+import random
+import threading
+import numpy as np
+
+# Checks the generator waveform features on synthetic signals (RMS, peak-to-peak,
+# ripple frequency from hysteresis crossings on jittered sample times, power into the
+# load) and then runs the capture thread against an ADC that a scanner thread keeps
+# busy with oversampled scans, comparing the longest capture gap when the scan holds
+# the device for a whole pass (the old locking) with one transfer at a time, and
+# finally the lost count and idle resync of the capture ring.
+from sim_harness import check, finish
+from adc_mcp3008 import AdcScanner, FakeMcp3008
+from voltage_capture import VoltageCapture, computeVoltageFeatures, rippleFrequency
+
+random.seed(7)
+np.random.seed(7)
+
+
+def waveform(rippleHz, sampleRateHz=1000, durationSec=2.0, dc=6.0, amplitude=0.5, noise=0.0, jitterSec=0.0):
+    n = int(durationSec * sampleRateHz)
+    t = np.arange(n) / float(sampleRateHz) + np.random.uniform(0, jitterSec, n)
+    t.sort()
+    v = dc + amplitude * np.sin(2 * np.pi * rippleHz * t)
+    if noise:
+        v = v + np.random.normal(0, noise, n)
+    return t, v
+
+
+t, v = waveform(45)
+features = computeVoltageFeatures(t, v, 450, 10.0)
+print("features: " + str(features))
+check("rms of dc plus ripple", abs(features['turbine_vrms'] - np.sqrt(36 + 0.125)) < 0.01, str(features))
+check("peak-to-peak ripple", abs(features['turbine_vpp'] - 1.0) < 0.02, str(features))
+check("ripple frequency", abs(features['turbine_ripple_hz'] - 45) < 0.5, str(features))
+check("ripple cycles per revolution", abs(features['turbine_ripple_per_rev'] - 6) < 0.1, str(features))
+check("power into the load is mean square over ohms", abs(features['turbine_power_w'] - (36 + 0.125) / 10) < 0.01,
+      str(features))
+check("capture rate and gap from the sample times", abs(features['turbine_capture_rate'] - 1000) < 1 and
+      abs(features['turbine_capture_gap_ms'] - 1) < 0.01, str(features))
+
+# noise around the mean would double count crossings without the hysteresis band
+t, v = waveform(30, noise=0.05)
+check("hysteresis ignores noise at the crossings", abs(rippleFrequency(t, v) - 30) < 0.5, str(rippleFrequency(t, v)))
+check("no hysteresis band double counts", abs(rippleFrequency(t, v, hysteresisFraction=0.0) - 30) > 5)
+
+# scheduling jitter moves the sample times, not the signal
+t, v = waveform(60, jitterSec=0.0008)
+check("frequency uses the real sample times", abs(rippleFrequency(t, v) - 60) < 0.5, str(rippleFrequency(t, v)))
+
+t, v = waveform(45, amplitude=0.0)
+check("flat voltage has no ripple", rippleFrequency(t, v) == 0.0)
+check("too few samples give no features", computeVoltageFeatures(t[:5], v[:5], 450, 10.0) is None)
+check("no ripple per rev while stopped", 'turbine_ripple_per_rev' not in computeVoltageFeatures(*waveform(45), rpm=0,
+                                                                                              loadOhms=10.0))
+
+
+# the capture thread sharing the ADC with a busy scanner
+def signal(channel, now):
+    return 1.5 + 0.25 * np.sin(2 * np.pi * 40 * now)
+
+
+def runCapture(oldLocking, durationSec=1.0):
+    device = FakeMcp3008(signal, conversionSec=0.0001)
+    scanner = AdcScanner(device, channels=[0, 1, 2, 3], oversample=16, scales={0: 4.0})
+    passLock = threading.Lock()
+    stopScan = threading.Event()
+
+    def scanLoop():
+        while not stopScan.is_set():
+            if oldLocking:
+                # the old scan: the whole oversampled pass under one lock
+                with passLock:
+                    for channel in scanner.channels:
+                        for i in range(scanner.oversample):
+                            device.readRaw(channel)
+            else:
+                scanner.scan()
+            time.sleep(0.001)
+
+    def readSample():
+        if oldLocking:
+            with passLock:
+                return scanner.countsToVolts(device.readRaw(0), channel=0)
+        return scanner.countsToVolts(scanner.readRaw(0), channel=0)
+
+    capture = VoltageCapture(readSample, 1000)
+    scanThread = threading.Thread(target=scanLoop)
+    scanThread.start()
+    capture.start()
+    time.sleep(durationSec)
+    capture.stop()
+    stopScan.set()
+    scanThread.join()
+    t, v, lostCnt = capture.readWindow()
+    return computeVoltageFeatures(t, v, 0, 10.0)
+
+
+old = runCapture(True)
+new = runCapture(False)
+print("{0:>6} {1:>10} {2:>10} {3:>10}".format("", "rate Hz", "gap ms", "ripple Hz"))
+for name, features in (("old", old), ("new", new)):
+    print("{0:>6} {1:>10} {2:>10} {3:>10}".format(name, features['turbine_capture_rate'],
+                                                  features['turbine_capture_gap_ms'], features['turbine_ripple_hz']))
+check("capture no longer stalls for a whole scan", new['turbine_capture_gap_ms'] < old['turbine_capture_gap_ms'] / 2,
+      str((old['turbine_capture_gap_ms'], new['turbine_capture_gap_ms'])))
+check("capture holds its rate beside the scanner", new['turbine_capture_rate'] > 750 and
+      new['turbine_capture_rate'] > 2 * old['turbine_capture_rate'], str((old['turbine_capture_rate'],
+                                                                          new['turbine_capture_rate'])))
+check("ripple measured beside the scanner", abs(new['turbine_ripple_hz'] - 40) < 2, str(new['turbine_ripple_hz']))
+check("capture samples carry the channel scale", abs(new['turbine_vrms'] - 6.0) < 0.2, str(new['turbine_vrms']))
+
+# the ring: samples overwritten before a read are counted, an idle wait is skipped
+readings = [0]
+
+
+def countingVolts():
+    readings[0] += 1
+    return float(readings[0])
+
+
+capture = VoltageCapture(countingVolts, 2000, capacity=64)
+capture.start()
+time.sleep(0.2)
+t, v, lostCnt = capture.readWindow()
+check("overwritten samples are counted", len(v) == 64 and lostCnt > 0 and v[0] == lostCnt + 1 and
+      bool(np.all(np.diff(v) == 1)), str((len(v), lostCnt, v[:2])))
+time.sleep(0.2)
+capture.discard()
+time.sleep(0.01)
+t, v, lostCnt = capture.readWindow()
+capture.stop()
+check("the window after an idle wait is fresh and lossless", 0 < len(v) < 64 and lostCnt == 0,
+      str((len(v), lostCnt)))
+
+finish("Voltage capture")
@@ -23,6 +23,8 @@ import json
 import uuid
 import socket
 import getopt, sys
+import threading
+import asyncio
 from random import randint
 from AWSIoTPythonSDK.MQTTLib import AWSIoTMQTTClient
 from AWSIoTPythonSDK.MQTTLib import AWSIoTMQTTShadowClient
@@ -36,6 +38,30 @@ import Adafruit_SSD1306
 from PIL import Image
 from PIL import ImageDraw
 from PIL import ImageFont
+# modules shared with the weather program live in common/ at the top of the repo
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from vibe_sampler import VibeSampler
+from vibe_stats import computeVibeStats, vibeMagnitude
+from vibe_spectrum import computeSpectralFeatures
+from mpu6050_fifo import Mpu6050Fifo
+from hires_batch import HiResBatcher
+from common.payload_codec import encodePayload, decodePayload, selectEncoding
+from deadband import DeadbandPublisher
+from common.store_forward import StoreForwardQueue, StoreForwardDrainer
+from async_runtime import AsyncRuntime
+from rpm_estimator import RpmEstimator
+from rev_analysis import RevolutionAnalyzer
+from common.idle_wait import IdleWaiter
+from adc_mcp3008 import AdcScanner, SpiMcp3008, LegacyMcp3008, spiAvailable
+from voltage_capture import VoltageCapture, computeVoltageFeatures
+from power_curve import PowerCurveEngine
+from oled_renderer import OledRenderer, OledRenderWorker
+from brake_actuator import BrakeActuator, BrakeCommand, brakeOnSteps, brakeOffSteps, brakeChangeSteps
+from brake_controller import BrakeController, BrakePid
+from shadow_reporter import ShadowReporter
+from shadow_cache import ShadowCache, reconcileSame, reconcileLocal
+from command_dispatcher import CommandDispatcher
+from endpoint_probe import endpointCandidates, makeTlsContext, rankEndpoints
 
 # configurable settings from the config.json file
 configFile = None
@@ -51,10 +77,62 @@ cfgGgHost = ""
 cfgTimeoutSec = 10
 cfgRetryLimit = 3
 cfgUseGreengrass = "no"
+cfgGgProbeDeadlineSec = 2
+cfgGgProbeStaggerSec = 0.25
+cfgGgFallbackTimeoutSec = 2
 cfgBrakeOnPosition = 6.5
 cfgBrakeOffPosition = 7.5
 cfgVibeDataSampleCnt = 50
+cfgVibeSampleRateHz = 200
+cfgVibeAcquisitionMode = "poll"
 cfgBrakePressureFactor = 1
+cfgRpmPulsesPerRev = 1
+cfgRpmWindowSec = 2
+cfgRpmStallSec = 10
+cfgIdleHeartbeatSec = 60
+cfgIpRefreshSec = 300
+cfgOledMaxFps = 4
+cfgAdcChannels = [0]
+cfgAdcOversample = 4
+cfgAdcMode = "average"
+cfgAdcSpiBus = 0
+cfgAdcSpiDevice = 0
+cfgAdcSpiSpeedHz = 1350000
+cfgVoltageCaptureRateHz = 1000
+cfgVoltageScale = 1.0
+cfgLoadOhms = 10.0
+cfgPowerCurve = {
+    'rpmBinWidth': 50,
+    'rpmBinCnt': 40,
+    'windBinWidth': 1,
+    'windBinCnt': 40,
+    'checkpointSec': 300,
+    'summarySec': 3600,
+    'windTopic': "",
+    'windEncoding': "json",
+    'windMaxAgeSec': 30
+}
+cfgBrakeControl = {
+    'rateHz': 10,
+    'kp': 0.2,
+    'ki': 0.1,
+    'kd': 0.05,
+    'maxSlewPctPerSec': 60,
+    'rpmWindowSec': 0.5,
+    'overspeedRpm': None
+}
+cfgShadowFlushSec = 0.2
+cfgShadowMaxBackoffSec = 32
+cfgShadowCachePath = ""
+cfgCommandQueueSize = 32
+cfgCommandTimeoutSec = 10
+cfgStoreForwardPath = ""
+cfgStoreForwardMaxMB = 50
+cfgStoreForwardDrainRate = 20
+
+# "serial" runs everything in one loop, "asyncio" runs independent tasks (see async_runtime.py)
+cfgRuntime = "serial"
+asyncRuntime = None
 
 vibe_limit = 5
 
@@ -67,6 +145,13 @@ logger = logging.getLogger(__name__)
 
 #Keep track of iot connection state
 turbineIoTConnectedState = ""
+turbineIoTOnline = threading.Event()
+
+# publishes made while offline are kept on disk and replayed once the connection is back
+storeForwardQueue = None
+storeForwardDrainer = None
+priorityHiRes = 0
+priorityTelemetry = 1
 
 # Keep track of the safety state
 turbineSafetyState = ""
@@ -101,27 +186,83 @@ accelXCal = 0
 accelYCal = 0
 accelZCal = 0
 
+# background thread that samples the accelerometer at a fixed rate
+vibeSampler = None
+
 # AWS IoT Stuff
 awsIoTMQTTClient = None
 awsShadowClient = None
 turbineDeviceShadow = None
+# reported state goes out coalesced from its own thread
+shadowReporter = None
+# last accepted shadow state on disk, so settings are there before the connection
+shadowCache = None
+# cmd/windfarm/turbine/<thing>/<command> routing, run off the SDK thread
+commandDispatcher = None
 dataPublishSendMode = "normal"
 dataPublishHiResSendMode = "off"
+dataPublishSpectralMode = "on"
+dataPublishHiResBatchSize = 1000
+dataPublishHiResBatchAgeSec = 10
+hiResBatcher = None
+# messages built while sampling a window (hi-res samples, power curve summaries),
+# handed to the publisher along with the telemetry
+windowOutbox = []
+dataPublishEncoding = "json"
+
+# report-by-exception: "full" publishes every loop, "exception" only fields beyond their deadband
+dataPublishReportMode = "full"
+dataPublishKeyframeSec = 300
+deadbandPublisher = None
+turbineDeadbands = {
+    'default': {'abs': 0.01, 'pct': 5},
+    'turbine_speed': {'abs': 2, 'pct': 2},
+    'turbine_speed_min': {'abs': 2, 'pct': 2},
+    'turbine_speed_max': {'abs': 2, 'pct': 2},
+    'turbine_speed_mean': {'abs': 2, 'pct': 2},
+    'turbine_rev_cnt': {'abs': 0},
+    'brake_pct': {'abs': 0},
+    'turbine_voltage': {'abs': 0.05},
+    'turbine_voltage_min': {'abs': 0.05},
+    'turbine_voltage_max': {'abs': 0.05},
+    'turbine_vrms': {'abs': 0.05},
+    'turbine_vpp': {'abs': 0.05},
+    'turbine_power_w': {'abs': 0.01, 'pct': 5},
+    'turbine_ripple_hz': {'abs': 1, 'pct': 5},
+    'turbine_ripple_per_rev': {'abs': 0.2},
+    'turbine_capture_rate': {'keyframe_only': True},
+    'turbine_capture_gap_ms': {'keyframe_only': True},
+    'spectral': {'abs': 0.001, 'pct': 20},
+    'rev_timing': {'abs': 0.001, 'pct': 20},
+    'turbine_sample_cnt': {'keyframe_only': True},
+    'turbine_sample_rate': {'keyframe_only': True},
+    'turbine_sample_jitter_ms': {'keyframe_only': True},
+    'turbine_sample_lost_cnt': {'abs': 0},
+    'turbine_capture_lost_cnt': {'abs': 0}
+}
 dataPublishInterval = 5
 
 # Turbine rotation speed sensor
 turbine_rotation_sensor_pin = 26  # pin 37
 turbineRPM = 0
-turbineRpmElapse = 0
 turbineRotationCnt = 0
-lastTurbineRotationCnt = 0
-start_timer = time.time()
+rpmEstimator = None
+revAnalyzer = None
+
+# the rotation sensor interrupt wakes the main loop from idle
+idleWaiter = IdleWaiter()
 
 # Servo control for turbine brake
 turbineBrakePosPCT = 0
 turbine_servo_brake_pin = 15  # pin 10
 brakeState = "TBD"
+# last ON/OFF requested from the actuator, brakeState follows once it completes
+brakeTargetState = "TBD"
 brakeServo = None
+brakeActuator = None
+brakeController = None
+# speed the brake controller holds the turbine at, None when it is off
+brakeTargetRpm = None
 
 # ADC MCP3008 used to sample the voltage level
 CLK = 11  # pin 23
@@ -129,6 +270,16 @@ MISO = 9  # pin 21
 MOSI = 10  # pin 19
 CS = 8  # pin 24
 adcSensor = None
+adcScanner = None
+turbineVoltageChannel = 0
+
+# background thread that captures the generator voltage waveform, None when disabled
+voltageCapture = None
+
+# power curves binned on the device, with the latest wind speed when a wind topic is configured
+powerCurveEngine = None
+lastWindSpeed = None
+lastWindSpeedAt = 0
 
 # RGB LED GPIO pins
 ledRedPin = 5
@@ -140,6 +291,10 @@ oledImage = None
 oledDraw = None
 oledFont = None
 oledTop = 0
+oledRenderer = None
+oledWorker = None
+cachedIp = None
+cachedIpAt = 0
 
 def initTurbineGPIO():
     global GPIO
@@ -157,7 +312,7 @@ def initTurbineLED():
     print("Turbine LED initialized")
 
 def initOLED():
-    global oledDisplay, oledImage, oledDraw, oledTop, oledFont
+    global oledDisplay, oledImage, oledDraw, oledTop, oledFont, oledRenderer, oledWorker
 
     #stop the running service that is showing the IP address on boot
     #systemctl stop display_myip.service
@@ -187,26 +342,33 @@ def initOLED():
 
     padding = -2
     oledTop = padding
-    bottom = height-padding
     x = 0
     oledFont = ImageFont.load_default()
-    oledDraw.text((x, oledTop),       cfgThingName,  font=oledFont, fill=255)
-    oledDraw.text((x, oledTop+8),     "IP: " + getIp(),  font=oledFont, fill=255)
-    oledDraw.text((x, oledTop+16),    "IoT: ",  font=oledFont, fill=255)
-    oledDraw.text((x, oledTop+26),    "Speed: ",  font=oledFont, fill=255)
-    oledDraw.text((x, oledTop+36),    "Voltage: ",  font=oledFont, fill=255)
-    oledDraw.text((x, oledTop+46),    "Vibe Peak: ",  font=oledFont, fill=255)
-    oledDraw.text((x, oledTop+56),    "Brake:     Pct:",  font=oledFont, fill=255)
 
-    oledDisplay.image(oledImage)
-    oledDisplay.display()
+    # labels go into the renderer's background once, updates only send changed pages
+    oledRenderer = OledRenderer(oledDisplay, oledFont)
+    oledRenderer.addStatic(x, oledTop, cfgThingName)
+    oledRenderer.addField('ip', x, oledTop+8, "IP: ")
+    oledRenderer.addField('iot', x, oledTop+16, "IoT:")
+    oledRenderer.addField('speed', x, oledTop+26, "Speed: ")
+    oledRenderer.addField('voltage', x, oledTop+36, "Voltage: ")
+    oledRenderer.addField('vibe_peak', x, oledTop+46, "Peak Vibe: ")
+    oledRenderer.addField('brake', x, oledTop+56, "Brake:")
+    oledRenderer.addField('brake_pct', x+64, oledTop+56, "Pct: ")
+    oledRenderer.update({'ip': getCachedIp()})
+
+    # from here on only the render worker touches the display
+    oledWorker = OledRenderWorker(oledRenderer, cfgOledMaxFps)
+    oledWorker.start()
 
     print("OLED Display initialized")
 
-def storeLastGreengrassHost(ggInfo, ep, port):
+def storeLastGreengrassHost(ggInfo, ep, port, ranking=None):
     msg = ggInfo
     msg['LAST_HostAddress'] = ep
     msg['LAST_PortNumber'] = port
+    # probe latencies, so the next boot probes the best core first
+    msg['LAST_Ranking'] = ranking or []
     msg['timestamp'] = str(datetime.utcnow().isoformat())
     with open(cfgCertsPath + '/gg-last-host.json', 'w') as outfile:
         json.dump(msg, outfile)
@@ -219,13 +381,23 @@ def getLastGreengrassHost():
             ggInfo = json.load(infile)
     return ggInfo
 
-def hostReachable(hostname):
-    #attempt toping the host once and wait 2 seconds
-    status = subprocess.call("ping -c1 -w2 " + hostname + " > /dev/null 2>&1", shell=True)
-    if status == 0:
-      return True
-    else:
-      return False
+def rankGreengrassHosts(ggInfo, ggCA, key, cert):
+    # probes every core address at once; reachable ones come first, fastest first
+    candidates = endpointCandidates(ggInfo)
+    if not candidates:
+        return []
+    ranking = rankEndpoints(candidates, cfgGgProbeDeadlineSec, cfgGgProbeStaggerSec,
+                            tlsContext=makeTlsContext(ggCA, cert, key) if os.path.exists(ggCA) else None)
+    for entry in ranking:
+        if entry['latency_ms'] is not None:
+            print("Greengrass host " + entry['host'] + ":" + str(entry['port']) + " answered in " + str(entry['latency_ms']) + " ms")
+        else:
+            print("Greengrass host " + entry['host'] + ":" + str(entry['port']) + " unreachable (" + entry['error'] + ")")
+    return ranking
+
+
+def greengrassHostReachable(ranking):
+    return len(ranking) > 0 and ranking[0]['latency_ms'] is not None
 
 def discoverGreengrassHost(key, cert, ca):
     # call the Greengrass Discovery API to find the details of the gg group core
@@ -257,7 +429,7 @@ def connectTurbineIoTAttempt(ep, port, rootca, key, cert, timeoutSec, retryLimit
 
     # AWSIoTMQTTClient connection configuration
     awsIoTMQTTClient.configureAutoReconnectBackoffTime(1, 32, 20)
-    awsIoTMQTTClient.configureOfflinePublishQueueing(-1)  # Infinite offline Publish queueing
+    awsIoTMQTTClient.configureOfflinePublishQueueing(0)  # Offline publishes go to the store-and-forward queue
     awsIoTMQTTClient.configureDrainingFrequency(2)  # Draining: 2 Hz
     awsIoTMQTTClient.configureConnectDisconnectTimeout(timeoutSec) #seconds
     awsIoTMQTTClient.configureMQTTOperationTimeout(timeoutSec) #seconds
@@ -267,13 +439,17 @@ def connectTurbineIoTAttempt(ep, port, rootca, key, cert, timeoutSec, retryLimit
     awsIoTMQTTClient.onOffline = awsIoTClientOnDisconnectCallback
 
     # Attempt to connect
+    connected = False
     for attempt in range(0, retryLimit):
         try:
-            awsIoTMQTTClient.connect()
+            connected = awsIoTMQTTClient.connect()
         except Exception as e:
             print(str(e))
             continue
         break
+    if not connected:
+        # lets the caller move on to the next endpoint
+        return False
 
     # Shadow config
     awsShadowClient.configureAutoReconnectBackoffTime(1, 32, 20)
@@ -297,6 +473,11 @@ def connectTurbineIoTAttempt(ep, port, rootca, key, cert, timeoutSec, retryLimit
     awsIoTMQTTClient.subscribe(cmdTopic, 1, customCallbackCmd)
     print("AWS IoT Command Topic Subscribed: " + cmdTopic)
 
+    # optional local wind source for the wind power curve
+    if cfgPowerCurve['windTopic']:
+        awsIoTMQTTClient.subscribe(cfgPowerCurve['windTopic'], 0, windSpeedCallback)
+        print("AWS IoT Wind Topic Subscribed: " + cfgPowerCurve['windTopic'])
+
     return True
 
 
@@ -304,54 +485,44 @@ def connectTurbineIoT():
     ca = cfgCertsPath + '/' + cfgCaPath
     key = cfgCertsPath + '/' + cfgKeyPath
     cert = cfgCertsPath + '/' + cfgCertPath
-    localNetworks = ["127.0.0.1", "::1"]
 
     # if using Greengrass, there may be multiple addresses to reach the gg core/host.
     if cfgUseGreengrass == 'yes':
         print("Configured to use AWS Greengrass...")
-        # attempt to reconnect to the last good host
-        ggInfo = getLastGreengrassHost()
-
-        #check if the last good host is still reachable, if not start over
-        if not hostReachable(ggInfo['LAST_HostAddress']):
-            print("Unable to reach last known Greengrass host, will rediscover.")
-            ggInfo = {}
-
-        # if not none exists, attempt discovery
-        if ggInfo == {}:
-            ggInfo = discoverGreengrassHost(key, cert, ca)
-        else:
-            print("Using last known Greengrass discovery info")
-
-        if ggInfo == {}:
-            print("Can't find a way to connect to Greengrass. Exiting.")
-            quit()
-
         timeoutSec = 10
         retryLimit = 1
         ggCA = cfgCertsPath + '/gg-group-ca.pem'
 
-        if 'GGGroups' in ggInfo:
-            # Try them all until one connects.
-            for ggg in ggInfo['GGGroups']:
-                for core in ggg['Cores']:
-                    for conn in core['Connectivity']:
-                        #check if the provided host address is in a list of local interfaces that cannot be used
-                        if conn['HostAddress'] not in localNetworks:
-                            print("Attempting to connect to Greengrass at: " + conn['HostAddress'] + ":" + str(
-                                conn['PortNumber']))
-                            result = connectTurbineIoTAttempt(conn['HostAddress'], conn['PortNumber'], ggCA, key, cert,
-                                                              timeoutSec, retryLimit)
-                            if result:
-                                # store last known good host,port and rootca
-                                storeLastGreengrassHost(ggInfo, conn['HostAddress'], conn['PortNumber'])
-                                break
-                    if result:
-                        break
-                if result:
-                    break
+        # attempt to reconnect to the last known cores
+        ggInfo = getLastGreengrassHost()
+        ranking = rankGreengrassHosts(ggInfo, ggCA, key, cert)
+
+        #if none of them is reachable, start over
+        if greengrassHostReachable(ranking):
+            print("Using last known Greengrass discovery info")
         else:
-            result = False
+            if ggInfo != {}:
+                print("Unable to reach last known Greengrass hosts, will rediscover.")
+            ggInfo = discoverGreengrassHost(key, cert, ca)
+            if ggInfo == {}:
+                print("Can't find a way to connect to Greengrass. Running offline.")
+                return False
+            ranking = rankGreengrassHosts(ggInfo, ggCA, key, cert)
+
+        # cores that answered the probe get the full timeout, fastest first; the rest only
+        # a short attempt afterwards, in case the probe itself was blocked
+        result = False
+        reachable = [entry for entry in ranking if entry['latency_ms'] is not None]
+        unreachable = [entry for entry in ranking if entry['latency_ms'] is None]
+        attempts = [(entry, timeoutSec) for entry in reachable] + [(entry, cfgGgFallbackTimeoutSec) for entry in unreachable]
+        for entry, attemptTimeoutSec in attempts:
+            print("Attempting to connect to Greengrass at: " + entry['host'] + ":" + str(entry['port']))
+            result = connectTurbineIoTAttempt(entry['host'], entry['port'], ggCA, key, cert, attemptTimeoutSec, retryLimit)
+            if result:
+                # store last known good host,port and the ranking
+                storeLastGreengrassHost(ggInfo, entry['host'], entry['port'], ranking)
+                break
+        if not ranking:
             print("No Greengrass hosts discovered. Check your connection to the internet and try again.")
 
     else:
@@ -361,23 +532,43 @@ def connectTurbineIoT():
 
     return result
 
+def startTurbineIoTConnect():
+    # the turbine runs on the cached settings meanwhile, and publishes queue on disk until online
+    def connectAndSync():
+        try:
+            if connectTurbineIoT():
+                initShadowVariables()
+            else:
+                print("Not connected to AWS IoT, running offline")
+        except Exception as e:
+            print("AWS IoT connection failed, running offline: " + str(e))
+
+    connectThread = threading.Thread(target=connectAndSync, name="IoTConnect")
+    connectThread.daemon = True
+    connectThread.start()
+
 #the aws iot sdk provides callbacks for connect and disconnect events
 def awsIoTClientOnConnectCallback():
     global turbineIoTConnectedState
     turbineIoTConnectedState = "Connected"
-    updateOledDisplay()
+    turbineIoTOnline.set()
+    requestOledUpdate()
     print('IoT connection state: ' + turbineIoTConnectedState)
 
 def awsIoTClientOnDisconnectCallback():
     global turbineIoTConnectedState
     turbineIoTConnectedState = "Disconnected"
-    updateOledDisplay()
+    turbineIoTOnline.clear()
+    requestOledUpdate()
     print('IoT connection state: ' + turbineIoTConnectedState)
 
 def initTurbineRPMSensor():
-    global GPIO
+    global GPIO, rpmEstimator, revAnalyzer
+    rpmEstimator = RpmEstimator(cfgRpmPulsesPerRev, cfgRpmWindowSec, stallSec=cfgRpmStallSec)
+    revAnalyzer = RevolutionAnalyzer(rpmEstimator)
     GPIO.setup(turbine_rotation_sensor_pin, GPIO.IN, GPIO.PUD_UP)
-    GPIO.add_event_detect(turbine_rotation_sensor_pin, GPIO.FALLING, callback=calculateTurbineElapse, bouncetime=20)
+    # no bouncetime, the estimator rejects glitches without capping the speed
+    GPIO.add_event_detect(turbine_rotation_sensor_pin, GPIO.FALLING, callback=calculateTurbineElapse)
     print("Turbine rotation sensor is connected")
 
 
@@ -391,8 +582,16 @@ def initTurbineButtons():
 
 
 def initTurbineVoltageSensor():
-    global adcSensor
-    adcSensor = Adafruit_MCP3008.MCP3008(clk=CLK, cs=CS, miso=MISO, mosi=MOSI)
+    global adcSensor, adcScanner
+    if spiAvailable():
+        adcSensor = SpiMcp3008(cfgAdcSpiBus, cfgAdcSpiDevice, cfgAdcSpiSpeedHz)
+    else:
+        print("spidev is not installed, reading the ADC with software SPI")
+        adcSensor = LegacyMcp3008(Adafruit_MCP3008.MCP3008(clk=CLK, cs=CS, miso=MISO, mosi=MOSI))
+    channels = sorted(set(cfgAdcChannels) | {turbineVoltageChannel})
+    # the generator voltage is read through a divider; the scanner scales every reading of it
+    adcScanner = AdcScanner(adcSensor, channels, cfgAdcOversample, mode=cfgAdcMode,
+                            scales={turbineVoltageChannel: cfgVoltageScale})
     print("Turbine voltage sensor is connected")
 
 
@@ -406,10 +605,22 @@ def initTurbineVibeSensor():
 
 
 def initTurbineBrake():
-    global brakeServo, GPIO
+    global brakeServo, brakeActuator, brakeController, GPIO
     GPIO.setup(turbine_servo_brake_pin, GPIO.OUT)
     brakeServo = GPIO.PWM(turbine_servo_brake_pin, 50)
     brakeServo.start(0)
+    # servo timing runs on the actuator thread, callers only queue commands
+    brakeActuator = BrakeActuator(brakeServo.ChangeDutyCycle)
+    brakeActuator.start()
+
+    # target_rpm: closed-loop control on a short-window speed estimate
+    pid = BrakePid(cfgBrakeControl['kp'], cfgBrakeControl['ki'], cfgBrakeControl['kd'],
+                   cfgBrakeControl['maxSlewPctPerSec'])
+    brakeController = BrakeController(
+        lambda: rpmEstimator.estimate(windowSec=cfgBrakeControl['rpmWindowSec']),
+        applyBrakeControlPct, pid, cfgBrakeControl['rateHz'], cfgBrakeControl['overspeedRpm'],
+        lambda: turbineSafetyState == 'unsafe')
+    brakeController.start()
     print("Turbine brake connected")
 
 
@@ -418,27 +629,20 @@ def resetTurbineBrake():
     turbineBrakeAction("OFF")
     print("Turbine brake reset")
 
-def updateOledDisplay():
-    global oledDisplay, oledDraw, oledImage
-
-    width = oledDisplay.width
-    height = oledDisplay.height
-    oledDraw.rectangle((0,0,width,height), outline=0, fill=0)
-
-    x = 0
-    oledDraw.text((x, oledTop),       cfgThingName,  font=oledFont, fill=255)
-    oledDraw.text((x, oledTop+8),     "IP: " + getIp(),  font=oledFont, fill=255)
-    oledDraw.text((x, oledTop+16),    "IoT:" + turbineIoTConnectedState,  font=oledFont, fill=255)
-    oledDraw.text((x, oledTop+26),    "Speed: {0:.1f}".format(lastPayloadMsg['turbine_speed']),  font=oledFont, fill=255)
-    oledDraw.text((x, oledTop+36),    "Voltage: {0:.1f}".format(lastPayloadMsg['turbine_voltage']),  font=oledFont, fill=255)
-    oledDraw.text((x, oledTop+46),    "Peak Vibe: {0:.2f}".format(lastPayloadMsg['turbine_vibe_peak']),  font=oledFont, fill=255)
-    oledDraw.text((x, oledTop+56),    "Brake:" + brakeState + " Pct: " + str(lastPayloadMsg['brake_pct']),  font=oledFont, fill=255)
-
-    oledDisplay.image(oledImage)
-    oledDisplay.display()
+def getOledValues():
+    return {
+        'ip': getCachedIp(),
+        'iot': turbineIoTConnectedState,
+        'speed': "{0:.1f}".format(lastPayloadMsg['turbine_speed']),
+        'voltage': "{0:.1f}".format(lastPayloadMsg['turbine_voltage']),
+        'vibe_peak': "{0:.2f}".format(lastPayloadMsg['turbine_vibe_peak']),
+        'brake': brakeState,
+        'brake_pct': str(lastPayloadMsg['brake_pct'])
+    }
 
 def clearOledDisplay():
     global oledDisplay, oledDraw, oledImage
+    oledWorker.stop()
 
     width = oledDisplay.width
     height = oledDisplay.height
@@ -446,21 +650,25 @@ def clearOledDisplay():
 
     x = 0
     oledDraw.text((x, oledTop),       cfgThingName,  font=oledFont, fill=255)
-    oledDraw.text((x, oledTop+8),     "IP: " + getIp(),  font=oledFont, fill=255)
+    oledDraw.text((x, oledTop+8),     "IP: " + getCachedIp(),  font=oledFont, fill=255)
 
     oledDisplay.image(oledImage)
     oledDisplay.display()
+    oledRenderer.invalidate()
 
-def checkButtons():
-    buttonState = GPIO.input(21)  # Switch1 (S1)
-    if buttonState == True:
+def readButtons():
+    # pins of the buttons currently held down
+    return [pin for pin in (21, 20, 16) if GPIO.input(pin) == True]
+
+
+def handleButtonPress(pin):
+    if pin == 21:  # Switch1 (S1)
         print("Manual brake reset event")
         resetTurbineBrake()
-        buttonState = False
 
-    buttonState = GPIO.input(20)  # Switch2 (S2)
-    if buttonState == True:
-        if brakeState == "OFF":
+    elif pin == 20:  # Switch2 (S2)
+        # toggle from the last request, a press during a brake move reverses it
+        if brakeTargetState == "OFF":
             print("Toggle brake on event")
             processShadowChange("brake_status", "ON", "reported")
             turbineBrakeAction("ON")
@@ -468,32 +676,30 @@ def checkButtons():
             print("Toggle brake off event")
             processShadowChange("brake_status", "OFF", "reported")
             turbineBrakeAction("OFF")
-        buttonState = False
 
-    buttonState = GPIO.input(16)  # Switch3 (S3)
-    if buttonState == True:
+    elif pin == 16:  # Switch3 (S3)
         print("TBD Button")
-        buttonState = False
+
+
+def checkButtons():
+    for pin in readButtons():
+        handleButtonPress(pin)
 
     ##debounce
     sleep(0.1)
 
 
 def calculateTurbineElapse(channel):  # callback function
-    global turbineRotationCnt, start_timer, turbineRpmElapse
-    turbineRotationCnt += 1  # increase cnt by 1 whenever interrupt occurred
-    turbineRpmElapse = time.time() - start_timer  # time elapsed for every 1 complete rotation
-    start_timer = time.time()  # let current time equal to start_timer
+    global turbineRotationCnt
+    # only edges the estimator accepts count, glitches are dropped
+    if rpmEstimator.onEdge():
+        turbineRotationCnt += 1
+        idleWaiter.notify()
 
 
 def calculateTurbineSpeed():
-    global turbineRPM, lastTurbineRotationCnt
-    if turbineRpmElapse != 0:  # to avoid DivisionByZero error
-        turbineRPM = 1 / turbineRpmElapse * 60
-    if turbineRotationCnt == lastTurbineRotationCnt:
-        turbineRPM = 0
-    else:
-        lastTurbineRotationCnt = turbineRotationCnt
+    global turbineRPM
+    turbineRPM = rpmEstimator.estimate()
     return turbineRPM
 
 
@@ -568,11 +774,185 @@ def calculateTurbineVibe():
         return 0
 
 
+def readTurbineVibe():
+    # single calibrated reading for the vibration sampler thread, raises on a bus error
+    accel = accelerometer.get_accel_data()
+    return (accel["x"] - accelXCal, accel["y"] - accelYCal, accel["z"] - accelZCal)
+
+
+def startTurbineVibeSampler():
+    global vibeSampler
+    vibeFifo = None
+    if cfgVibeAcquisitionMode == "fifo" and accelerometer is not None:
+        # the sensor paces the samples and they are drained in blocks, per-sample reads are the fallback
+        vibeFifo = Mpu6050Fifo(accelerometer.bus, 0x68, cfgVibeSampleRateHz)
+        vibeFifo.offsets = (accelXCal, accelYCal, accelZCal)
+        print("Turbine vibration FIFO output rate " + str(vibeFifo.outputRateHz) + " Hz")
+
+    vibeSampler = VibeSampler(readTurbineVibe, cfgVibeSampleRateHz, blockSource=vibeFifo)
+    vibeSampler.start()
+    print("Turbine vibration sampler started at " + str(cfgVibeSampleRateHz) + " Hz")
+
+
+def waitForVibeWindow(windowStart):
+    # poll the buttons until the publish interval has elapsed and enough samples are buffered
+    while True:
+        checkButtons()
+        # the voltage channels are scanned between button checks for the interval min/max/mean
+        adcScanner.scan()
+        if time.monotonic() - windowStart < dataPublishInterval:
+            continue
+        if vibeSampler.pendingCount() >= cfgVibeDataSampleCnt or not vibeSampler.isHealthy():
+            break
+
+
+def resyncSamplers():
+    # the samples written during an idle wait belong to no window, skip them so the next
+    # window starts fresh instead of reporting a ring's worth of lost samples
+    vibeSampler.discard()
+    if voltageCapture is not None:
+        voltageCapture.discard()
+
+
+def initStoreForward():
+    global storeForwardQueue, storeForwardDrainer
+    dbPath = os.path.join(cfgStoreForwardPath or cfgCertsPath, 'turbine-queue.db')
+    storeForwardQueue = StoreForwardQueue(dbPath, cfgStoreForwardMaxMB * 1024 * 1024)
+    storeForwardDrainer = StoreForwardDrainer(storeForwardQueue, lambda topic, payload, qos: awsIoTMQTTClient.publish(topic, payload, qos),
+                                              turbineIoTOnline, cfgStoreForwardDrainRate)
+    storeForwardDrainer.start()
+    print("Store-and-forward queue: " + dbPath + " (" + str(storeForwardQueue.count()) + " messages pending)")
+
+
+def publishTurbineMessage(topic, payload, priority):
+    # publish directly while online, otherwise keep the message for the drainer to replay
+    if turbineIoTOnline.is_set():
+        try:
+            if awsIoTMQTTClient.publish(topic, payload, 0):
+                return True
+        except Exception as e:
+            logger.warning("publish failed, queueing message: " + str(e))
+    storeForwardQueue.put(topic, payload, 0, priority)
+    return False
+
+
+def initPowerCurve():
+    global powerCurveEngine
+    checkpointPath = os.path.join(cfgStoreForwardPath or cfgCertsPath, 'power-curve.npz')
+    powerCurveEngine = PowerCurveEngine(checkpointPath, cfgPowerCurve['rpmBinWidth'], cfgPowerCurve['rpmBinCnt'],
+                                        cfgPowerCurve['windBinWidth'], cfgPowerCurve['windBinCnt'],
+                                        cfgPowerCurve['checkpointSec'], cfgPowerCurve['summarySec'])
+    restored = powerCurveEngine.load()
+    print("Power curve checkpoint: " + checkpointPath + " (" + str(restored) + " curves restored)")
+    if cfgVoltageCaptureRateHz <= 0:
+        print("Power curve binning the scanner's mean voltage and V^2/R power, the voltage capture is off")
+
+
+def windSpeedCallback(client, userdata, message):
+    global lastWindSpeed, lastWindSpeedAt
+    try:
+        payloadDict = decodePayload(message.payload, cfgPowerCurve['windEncoding'])
+        lastWindSpeed = float(payloadDict['wind_speed'])
+        lastWindSpeedAt = time.monotonic()
+    except Exception as e:
+        print("wind speed message ignored: " + str(e))
+
+
+def updatePowerCurve(devicePayload):
+    # wind readings older than windMaxAgeSec are not paired with this interval
+    wind = None
+    if lastWindSpeed is not None and time.monotonic() - lastWindSpeedAt <= cfgPowerCurve['windMaxAgeSec']:
+        wind = lastWindSpeed
+    # voltage and power come from the captured waveform; without one (capture off or too
+    # few samples) both come from the scanner's scaled mean voltage, power as V^2/R
+    if 'turbine_vrms' in devicePayload:
+        voltage = devicePayload['turbine_vrms']
+        powerW = devicePayload['turbine_power_w']
+    else:
+        voltage = devicePayload['turbine_voltage']
+        powerW = voltage * voltage / cfgLoadOhms if cfgLoadOhms > 0 else 0
+    powerCurveEngine.add(devicePayload['turbine_speed'], voltage, powerW, wind)
+
+    if powerCurveEngine.summaryDue():
+        summary = {
+            'thing_name': cfgThingName,
+            'deviceID': turbineDeviceId,
+            'timestamp': str(datetime.utcnow().isoformat()),
+            'curves': powerCurveEngine.buildSummary()
+        }
+        # the summary has no fixed struct layout
+        encoding = selectEncoding(dataPublishEncoding, 'power_curve')
+        if encoding == 'struct':
+            encoding = 'json'
+        windowOutbox.append(("dt/windfarm/turbine/" + cfgThingName + "/power-curve",
+                             encodePayload(summary, 'power_curve', encoding), priorityTelemetry))
+
+
+def encodeTurbinePayload(payload, kind):
+    # kind selects the per-topic encoding from the payload_encoding shadow setting
+    return encodePayload(payload, kind, selectEncoding(dataPublishEncoding, kind))
+
+
+def queueHiResBatch(payload):
+    # one columnar message per batch of vibration samples
+    publishTopicHiRes = "dt/windfarm/turbine/" + cfgThingName + "/hi-res"
+    windowOutbox.append((publishTopicHiRes, encodeTurbinePayload(payload, 'hires'), priorityHiRes))
+
+
+def publishWindowMessages(messages):
+    for topic, payload, priority in messages:
+        publishTurbineMessage(topic, payload, priority)
+
+
+def initHiResBatcher():
+    global hiResBatcher
+    header = {
+        'thing_name': cfgThingName,
+        'deviceID': turbineDeviceId
+    }
+    hiResBatcher = HiResBatcher(queueHiResBatch, header, dataPublishHiResBatchSize, dataPublishHiResBatchAgeSec)
+
+
+def initDeadbandPublisher():
+    global deadbandPublisher
+    identityFields = ['thing_name', 'deviceID', 'timestamp', 'loop_cnt']
+    deadbandPublisher = DeadbandPublisher(identityFields, dict(turbineDeadbands), dataPublishKeyframeSec,
+                                          lambda payload: len(encodeTurbinePayload(payload, 'telemetry')))
+
+
+def configureDeadbands(shadowDeadbands):
+    # shadow entries override the per-field defaults
+    deadbands = dict(turbineDeadbands)
+    deadbands.update(shadowDeadbands)
+    deadbandPublisher.configure(deadbands=deadbands)
+
+
+def publishTurbineTelemetry(publishTopic, devicePayload):
+    # in exception mode only the fields that moved beyond their deadband are sent
+    if dataPublishReportMode == "exception":
+        devicePayload = deadbandPublisher.filter(devicePayload)
+        if devicePayload is None:
+            return None
+    return publishTurbineMessage(publishTopic, encodeTurbinePayload(devicePayload, 'telemetry'), priorityTelemetry)
+
+
+def readTurbineVoltageSample():
+    # single conversion for the waveform capture, slotted in between the scanner's transfers
+    return adcScanner.countsToVolts(adcScanner.readRaw(turbineVoltageChannel), channel=turbineVoltageChannel)
+
+
+def startTurbineVoltageCapture():
+    global voltageCapture
+    if cfgVoltageCaptureRateHz <= 0:
+        return
+    voltageCapture = VoltageCapture(readTurbineVoltageSample, cfgVoltageCaptureRateHz)
+    voltageCapture.start()
+    print("Turbine voltage capture started at " + str(cfgVoltageCaptureRateHz) + " Hz")
+
+
 def getTurbineVoltage(channel):
-    # The read_adc function will get the value of the specified channel (0-7).
-    refVal = adcSensor.read_adc(channel)
-    calcVolt = round(((3300 / 1023) * refVal) / 1000, 2)
-    return calcVolt
+    # one oversampled reading of the specified channel (0-7)
+    return round(adcScanner.readChannel(channel), 2)
 
 
 def getIp():
@@ -588,6 +968,14 @@ def getIp():
         s.close()
     return IP
 
+def getCachedIp():
+    # the address rarely changes, so don't open a socket on every display update
+    global cachedIp, cachedIpAt
+    if cachedIp is None or time.monotonic() - cachedIpAt >= cfgIpRefreshSec:
+        cachedIp = getIp()
+        cachedIpAt = time.monotonic()
+    return cachedIp
+
 def getBrakePWM(newPositionPct):
     try:
         newPWM = cfgBrakeOffPosition - ((cfgBrakeOffPosition - cfgBrakeOnPosition) * (newPositionPct/100))
@@ -596,75 +984,95 @@ def getBrakePWM(newPositionPct):
     return newPWM
 
 def turbineBrakeAction(action, brakeRelease = True):
-    global brakeServo, brakeState, turbineDeviceShadow, turbineBrakePosPCT
-    if action == brakeState:
+    global brakeTargetState, turbineBrakePosPCT
+    if action == brakeTargetState:
         return "Already there"
+    stopBrakeSpeedControl()
 
     if action == "ON":
         print("Applying turbine brake!")
         turbineBrakePosPCT = 100
-
-        brakeServo.ChangeDutyCycle(getBrakePWM(turbineBrakePosPCT))
-        sleep(3)
-        if brakeRelease:
-            brakeServo.ChangeDutyCycle(0)
-        brakeState = action
+        steps = brakeOnSteps(getBrakePWM(turbineBrakePosPCT), 3, brakeRelease)
 
     elif action == "OFF":
         print("Resetting turbine brake")
         turbineBrakePosPCT = 0
-        brakeServo.ChangeDutyCycle(getBrakePWM(turbineBrakePosPCT))
-        sleep(1)
-        brakeServo.ChangeDutyCycle(0)
-        brakeState = action
+        steps = brakeOffSteps(getBrakePWM(turbineBrakePosPCT), 1)
 
     else:
         return "NOT AN ACTION"
 
-    #update the display
-    updateOledDisplay()
+    # returns right away, turbineBrakeActionDone reports the result
+    brakeTargetState = action
+    brakeActuator.submit(BrakeCommand(action, steps, turbineBrakeActionDone))
+    return action
 
-    shadowPayload = {
-        "state": {
-            "reported": {
-                "brake_status": brakeState
-            }
-        }
-    }
-    # print shadowPayload
-    stillTrying = True
-    tryCnt = 0
-    while stillTrying:
-        try:
-            turbineDeviceShadow.shadowUpdate(json.dumps(shadowPayload).encode("utf-8"), shadowCallback, 5)
-            stillTrying = False
-        except:
-            tryCnt += 1
-            #print("Try " + str(tryCnt))
-            sleep(1)
-            if tryCnt > 10:
-                stillTrying = False
 
-    return brakeState
+def turbineBrakeActionDone(command, result):
+    # runs on the actuator's reporting thread once an ON/OFF move finishes
+    global brakeState, brakeTargetState
+    if result != 'done':
+        print("Brake " + command.name + " " + result)
+        if brakeTargetState == command.name:
+            brakeTargetState = brakeState
+        return
+    brakeState = command.name
 
+    #update the display
+    requestOledUpdate()
 
-def turbineBrakeChange(newPCTval, newActionDurSec, newReturnToOff):
-    global brakeServo
-    brakeServo.ChangeDutyCycle(getBrakePWM(newPCTval))
+    processShadowChange("brake_status", brakeState, "reported")
 
+
+def turbineBrakeChange(newPCTval, newActionDurSec, newReturnToOff):
+    global brakeTargetState
+    stopBrakeSpeedControl()
     if newActionDurSec == None:
-        sleep(1)
+        holdSec = 1
     else:
-        sleep(newActionDurSec * cfgBrakePressureFactor)
+        holdSec = newActionDurSec * cfgBrakePressureFactor
+
+    # the partial press ends wherever it was, so a later ON/OFF is never "already there"
+    brakeTargetState = "TBD"
+    steps = brakeChangeSteps(getBrakePWM(newPCTval), holdSec, cfgBrakeOffPosition, newReturnToOff)
+    brakeActuator.submit(BrakeCommand("CHANGE", steps, lambda command, result: print("Brake change " + result)))
+
+
+def applyBrakeControlPct(pct):
+    # called by the brake controller at its control rate; holds the servo at the new position
+    global turbineBrakePosPCT
+    turbineBrakePosPCT = round(pct, 1)
+    brakeActuator.submit(BrakeCommand("TARGET_RPM", [('hold', getBrakePWM(pct), None)]))
+
+
+def setBrakeTargetRpm(targetRpm):
+    # a positive target engages the controller, 0 or None releases the brake
+    global brakeTargetRpm, brakeTargetState
+    if targetRpm is None or float(targetRpm) <= 0:
+        if brakeTargetRpm is not None:
+            print("Brake speed control off")
+            brakeTargetRpm = None
+            brakeController.disengage()
+            brakeTargetState = "TBD"
+            turbineBrakeAction("OFF")
+        return None
+
+    brakeTargetRpm = float(targetRpm)
+    brakeTargetState = "TBD"
+    brakeController.engage(brakeTargetRpm, turbineBrakePosPCT)
+    print("Brake speed control holding " + str(brakeTargetRpm) + " RPM")
+    return brakeTargetRpm
 
-    if newReturnToOff:
-        # return to off position and then stop
-        brakeServo.ChangeDutyCycle(cfgBrakeOffPosition)
-        sleep(0.5)
-        brakeServo.ChangeDutyCycle(0)
-    else:
-        # remove brake pressure after specified duration
-        brakeServo.ChangeDutyCycle(0)
+
+def stopBrakeSpeedControl():
+    # manual brake commands take over from the controller
+    global brakeTargetRpm
+    if brakeTargetRpm is not None:
+        print("Brake speed control off, manual brake command")
+        brakeTargetRpm = None
+        brakeController.disengage()
+        # null removes the setting from the shadow
+        processShadowChange("target_rpm", None, "reported")
 
 
 # get the latest shadow and update local variables
@@ -673,78 +1081,184 @@ def initShadowVariables():
 
 
 def shadowCallbackReported(payload, responseStatus, token):
-    global dataPublishSendMode, dataPublishInterval, dataPublishHiResSendMode, vibe_limit
     try:
         payloadDict = json.loads(payload)
         #print ("shadow Report >> " + payload)
+        if responseStatus == "rejected" and payloadDict.get("code") == 404:
+            # no shadow in the cloud (deleted or new thing): give it back what we run with
+            print("No cloud shadow, reporting the cached settings")
+            shadowReporter.report(shadowCache.snapshot()[0])
+            return
+        shadowReporter.observeVersion(payloadDict.get("version"))
+
+        result = shadowCache.reconcile(payloadDict)
+        if result == reconcileSame:
+            print("Turbine is in sync with the shadow settings (cached version " + str(payloadDict.get("version")) + ").")
+        elif result == reconcileLocal:
+            print("Cloud shadow is older than the cache, reporting the cached settings")
+            shadowReporter.report(shadowCache.snapshot()[0])
+        else:
+            applyReportedSettings(payloadDict["state"].get("reported", {}))
+            print("Turbine is in sync with the shadow settings.")
 
-        if "data_path" in payloadDict["state"]["reported"]:
-            dataPublishSendMode = payloadDict["state"]["reported"]["data_path"]
+    except Exception as e:
+        print("Shadow get failed")
+        pass
 
-        if "data_fast_interval" in payloadDict["state"]["reported"]:
-            dataPublishInterval = int(payloadDict["state"]["reported"]["data_fast_interval"])
 
-        if "vibe_limit" in payloadDict["state"]["reported"]:
-            vibe_limit = float(payloadDict["state"]["reported"]["vibe_limit"])
+def applyReportedSettings(reported):
+    # settings from the cloud shadow or the local cache
+    global dataPublishSendMode, dataPublishInterval, dataPublishHiResSendMode, dataPublishSpectralMode, vibe_limit
+    global dataPublishHiResBatchSize, dataPublishHiResBatchAgeSec, dataPublishEncoding
+    global dataPublishReportMode, dataPublishKeyframeSec
+    if "data_path" in reported:
+        dataPublishSendMode = reported["data_path"]
 
-        if "hires_publish_mode" in payloadDict["state"]["reported"]:
-            dataPublishHiResSendMode = payloadDict["state"]["reported"]["hires_publish_mode"]
+    if "data_fast_interval" in reported:
+        dataPublishInterval = int(reported["data_fast_interval"])
 
-        print("Turbine is in sync with the shadow settings.")
+    if "vibe_limit" in reported:
+        vibe_limit = float(reported["vibe_limit"])
+
+    if "hires_publish_mode" in reported:
+        dataPublishHiResSendMode = reported["hires_publish_mode"]
+
+    if "spectral_mode" in reported:
+        dataPublishSpectralMode = reported["spectral_mode"]
+
+    if "hires_batch_size" in reported:
+        dataPublishHiResBatchSize = int(reported["hires_batch_size"])
+        hiResBatcher.configure(maxSamples=dataPublishHiResBatchSize)
+
+    if "hires_batch_age_sec" in reported:
+        dataPublishHiResBatchAgeSec = float(reported["hires_batch_age_sec"])
+        hiResBatcher.configure(maxAgeSec=dataPublishHiResBatchAgeSec)
+
+    if "payload_encoding" in reported:
+        dataPublishEncoding = reported["payload_encoding"]
+
+    if "report_mode" in reported:
+        dataPublishReportMode = reported["report_mode"]
+
+    if "keyframe_sec" in reported:
+        dataPublishKeyframeSec = float(reported["keyframe_sec"])
+        deadbandPublisher.configure(keyframeSec=dataPublishKeyframeSec)
+
+    if "deadband" in reported:
+        configureDeadbands(reported["deadband"])
+
+    if "target_rpm" in reported:
+        setBrakeTargetRpm(reported["target_rpm"])
+
+
+def initShadowCache():
+    # read before anything touches the network
+    global shadowCache
+    cachePath = cfgShadowCachePath or os.path.join(cfgStoreForwardPath or cfgCertsPath, 'shadow-cache.json')
+    shadowCache = ShadowCache(cachePath)
+    if shadowCache.load():
+        print("Shadow cache: " + cachePath + " (version " + str(shadowCache.version) + ")")
+    else:
+        print("Shadow cache: " + cachePath + " (empty, using defaults until the shadow arrives)")
+
+
+def applyCachedShadow():
+    reported, desired, version = shadowCache.snapshot()
+    if reported:
+        applyReportedSettings(reported)
+        print("Turbine settings loaded from the shadow cache.")
+
+
+def cacheAcceptedShadow(state, version):
+    # the reporter's accepted updates keep the cache current
+    shadowCache.update(state.get("reported"), state.get("desired"), version)
+
+
+def initShadowReporter():
+    global shadowReporter
+    shadowReporter = ShadowReporter(sendShadowUpdate, turbineIoTOnline, flushWindowSec=cfgShadowFlushSec,
+                                    timeoutSec=5, maxBackoffSec=cfgShadowMaxBackoffSec,
+                                    onAcceptedFunc=cacheAcceptedShadow)
+    shadowReporter.start()
 
-    except Exception as e:
-        print("Shadow get failed")
-        pass
+
+def sendShadowUpdate(document, callback, timeoutSec):
+    # the shadow handler only exists once connected
+    if turbineDeviceShadow is None:
+        raise RuntimeError("shadow not connected")
+    return turbineDeviceShadow.shadowUpdate(document, callback, timeoutSec)
 
 
 # generic procedure to acknowledge shadow changes
 def processShadowChange(param, value, type):
-    global turbineDeviceShadow
-    # type will be either desired or reported
-    shadowPayload = {
-        "state": {
-            type: {
-                param: value
-            }
-        }
-    }
-
-    stillTrying = True
-    tryCnt = 0
-    while stillTrying:
-        try:
-            turbineDeviceShadow.shadowUpdate(json.dumps(shadowPayload).encode("utf-8"), shadowCallback, 5)
-            stillTrying = False
-        except:
-            tryCnt += 1
-            #print("Try " + str(tryCnt))
-            sleep(1)
-            if tryCnt > 10:
-                stillTrying = False
+    # type will be either desired or reported; changes are merged and sent by the reporter
+    shadowReporter.report({param: value}, type)
     return value
 
 
 def shadowCallbackDelta(payload, responseStatus, token):
-    global dataPublishSendMode, dataPublishInterval, vibe_limit, dataPublishHiResSendMode, cfgBrakeOnPosition, cfgBrakeOffPosition, cfgBrakePressureFactor
+    # under the asyncio runtime the delta is applied by the command task, off the SDK thread
+    if asyncRuntime is not None:
+        asyncRuntime.submitCommand(processShadowDelta, payload, responseStatus)
+    else:
+        processShadowDelta(payload, responseStatus)
+
+
+def processShadowDelta(payload, responseStatus):
+    global dataPublishSendMode, dataPublishInterval, vibe_limit, dataPublishHiResSendMode, dataPublishSpectralMode, cfgBrakeOnPosition, cfgBrakeOffPosition, cfgBrakePressureFactor
+    global dataPublishHiResBatchSize, dataPublishHiResBatchAgeSec, dataPublishEncoding
+    global dataPublishReportMode, dataPublishKeyframeSec
     #print("delta shadow callback >> " + payload)
 
     if responseStatus == "delta/" + cfgThingName:
         payloadDict = json.loads(payload)
         print("shadow delta >> " + payload)
+        if not shadowReporter.observeVersion(payloadDict.get("version")):
+            print("ignoring stale shadow delta version " + str(payloadDict.get("version")))
+            return
+        shadowCache.update(desired=payloadDict["state"], version=payloadDict.get("version"))
         try:
             if "brake_status" in payloadDict["state"]:
                 turbineBrakeAction(payloadDict["state"]["brake_status"])
+            if "target_rpm" in payloadDict["state"]:
+                processShadowChange("target_rpm", setBrakeTargetRpm(payloadDict["state"]["target_rpm"]), "reported")
             if "data_path" in payloadDict["state"]:
                 dataPublishSendMode = processShadowChange("data_path", payloadDict["state"]["data_path"], "reported")
             if "data_fast_interval" in payloadDict["state"]:
                 dataPublishInterval = int(
-                    processShadowChange("data_fast_interval", payloadDict["state"]["data_fast_interval"]), "reported")
+                    processShadowChange("data_fast_interval", payloadDict["state"]["data_fast_interval"], "reported"))
             if "vibe_limit" in payloadDict["state"]:
                 vibe_limit = float(payloadDict["state"]["vibe_limit"])
                 processShadowChange("vibe_limit", vibe_limit, "reported")
             if "hires_publish_mode" in payloadDict["state"]:
                 dataPublishHiResSendMode = payloadDict["state"]["hires_publish_mode"]
                 processShadowChange("hires_publish_mode", dataPublishHiResSendMode, "reported")
+            if "spectral_mode" in payloadDict["state"]:
+                dataPublishSpectralMode = payloadDict["state"]["spectral_mode"]
+                processShadowChange("spectral_mode", dataPublishSpectralMode, "reported")
+            if "hires_batch_size" in payloadDict["state"]:
+                dataPublishHiResBatchSize = int(payloadDict["state"]["hires_batch_size"])
+                hiResBatcher.configure(maxSamples=dataPublishHiResBatchSize)
+                processShadowChange("hires_batch_size", dataPublishHiResBatchSize, "reported")
+            if "hires_batch_age_sec" in payloadDict["state"]:
+                dataPublishHiResBatchAgeSec = float(payloadDict["state"]["hires_batch_age_sec"])
+                hiResBatcher.configure(maxAgeSec=dataPublishHiResBatchAgeSec)
+                processShadowChange("hires_batch_age_sec", dataPublishHiResBatchAgeSec, "reported")
+            if "payload_encoding" in payloadDict["state"]:
+                dataPublishEncoding = payloadDict["state"]["payload_encoding"]
+                processShadowChange("payload_encoding", dataPublishEncoding, "reported")
+            if "report_mode" in payloadDict["state"]:
+                dataPublishReportMode = payloadDict["state"]["report_mode"]
+                # consumers resync from a full frame whenever the mode changes
+                deadbandPublisher.forceKeyframe()
+                processShadowChange("report_mode", dataPublishReportMode, "reported")
+            if "keyframe_sec" in payloadDict["state"]:
+                dataPublishKeyframeSec = float(payloadDict["state"]["keyframe_sec"])
+                deadbandPublisher.configure(keyframeSec=dataPublishKeyframeSec)
+                processShadowChange("keyframe_sec", dataPublishKeyframeSec, "reported")
+            if "deadband" in payloadDict["state"]:
+                configureDeadbands(payloadDict["state"]["deadband"])
+                processShadowChange("deadband", payloadDict["state"]["deadband"], "reported")
             if "brake_on_pwm" in payloadDict["state"]:
                 cfgBrakeOnPosition = float(payloadDict["state"]["brake_on_pwm"])
                 processShadowChange("brake_on_pwm", cfgBrakeOnPosition, "reported")
@@ -758,40 +1272,41 @@ def shadowCallbackDelta(payload, responseStatus, token):
             print("delta cb error: " + str(e))
 
 
-def shadowCallback(payload, responseStatus, token):
-    if responseStatus == "timeout":
-        print("Update request " + token + " time out!")
+def initCommandDispatcher():
+    global commandDispatcher
+    commandDispatcher = CommandDispatcher("cmd/windfarm/turbine/" + cfgThingName,
+                                          lambda topic, payload: awsIoTMQTTClient.publish(topic, payload, 0),
+                                          queueSize=cfgCommandQueueSize, defaultTimeoutSec=cfgCommandTimeoutSec)
+    commandDispatcher.register("brake", processBrakeCmd)
+    commandDispatcher.register("target_rpm", processTargetRpmCmd)
+    commandDispatcher.register("stats", lambda payloadDict: commandDispatcher.stats(), 1)
+    commandDispatcher.start()
 
-    if responseStatus == "accepted":
-        print("shadow accepted")
 
-    if responseStatus == "rejected":
-        print("Update request " + token + " rejected!")
+def customCallbackCmd(client, userdata, message):
+    # SDK callback thread: the dispatcher only decodes and queues the command
+    commandDispatcher.onMessage(message.topic, message.payload)
 
 
-def customCallbackCmd(client, userdata, message):
+def processBrakeCmd(payloadDict):
+    # {"brake_pct": 40, "duration_sec": 2, "return_to_off": "true"}
     global turbineBrakePosPCT
+    turbineBrakePosPCT = float(payloadDict["brake_pct"])
+    brakeActionDurSec = int(payloadDict.get("duration_sec", 1))
+    ret2Off = True
+    if "return_to_off" in payloadDict:
+        ret2Off = bool(strtobool(str(payloadDict["return_to_off"]).lower()))
 
-    if message.topic == "cmd/windfarm/turbine/" + cfgThingName + "/brake":
-        payloadDict = json.loads(message.payload)
-        try:
-            turbineBrakePosPCT = float(payloadDict["brake_pct"])
-            brakeActionDurSec = None
-            if "duration_sec" in payloadDict:
-                brakeActionDurSec = int(payloadDict["duration_sec"])
-            else:
-                brakeActionDurSec = 1
-
-            if "return_to_off" in payloadDict:
-                ret2Off = strtobool(payloadDict["return_to_off"].lower())
-            else:
-                ret2Off = True
+    print("Brake change >> " + str(turbineBrakePosPCT) + "% with duration of " + str(brakeActionDurSec) + " seconds and return to off >> " + str(ret2Off))
+    turbineBrakeChange(turbineBrakePosPCT, brakeActionDurSec, ret2Off)
+    return {'brake_pct': turbineBrakePosPCT, 'duration_sec': brakeActionDurSec, 'return_to_off': ret2Off}
 
-            print("Brake change >> " + str(turbineBrakePosPCT) + "% with duration of " + str(brakeActionDurSec) + " seconds and return to off >> " + str(ret2Off))
-            turbineBrakeChange(turbineBrakePosPCT, brakeActionDurSec, ret2Off)
 
-        except:
-            print("brake change failed")
+def processTargetRpmCmd(payloadDict):
+    # {"target_rpm": 350} holds the turbine at 350 RPM with the brake, 0 turns it off
+    targetRpm = setBrakeTargetRpm(payloadDict.get("target_rpm"))
+    processShadowChange("target_rpm", targetRpm, "reported")
+    return {'target_rpm': targetRpm}
 
 
 def determineTurbineSafetyState(vibe, vibeLimit=5):
@@ -864,17 +1379,255 @@ def ledFlash(mode='off-on', duration=None):
         ledOn()
 
 
-def main():
+def sampleTurbineWindow(loopCnt, publishTopicHiRes):
+    # turns the vibration samples collected since the last call into the telemetry payload
+    # and the other encoded messages of the window; nothing is published here, the caller sends both
     global lastPayloadMsg
+    calculateTurbineSpeed()
+    speedStats = rpmEstimator.intervalStats()
+    revTiming = revAnalyzer.analyze()
+    sampleRate = 0
+    sampleJitter = 0
+
+    # vibration samples collected by the sampler thread since the last publish
+    vibeWindow = vibeSampler.readWindow()
+    vibeMag = vibeMagnitude(vibeWindow.x, vibeWindow.y, vibeWindow.z)
+    vibeStats = computeVibeStats(vibeWindow.x, vibeWindow.y, vibeWindow.z, vibeMag)
+
+    if vibeWindow.lostCnt > 0:
+        print("Vibration sampler overran the buffer, " + str(vibeWindow.lostCnt) + " samples lost")
+
+    if len(vibeWindow) > 0:
+        sampleRate = vibeWindow.sampleRate()
+        sampleJitter = vibeWindow.jitterMs()
+
+        if dataPublishHiResSendMode == 'vibe' and turbineRPM > 0:
+            # the sampler timestamps are monotonic, offset them for the hi-res messages
+            wallOffset = time.time() - time.monotonic()
+            for i in range(len(vibeWindow)):
+                devicePayloadHiRes = {
+                    'thing_name': cfgThingName,
+                    'deviceID': turbineDeviceId,
+                    'timestamp': str(datetime.utcfromtimestamp(vibeWindow.t[i] + wallOffset).isoformat()),
+                    'loop_cnt': str(loopCnt),
+                    'turbine_vibe_x': float(vibeWindow.x[i]),
+                    'turbine_vibe_y': float(vibeWindow.y[i]),
+                    'turbine_vibe_z': float(vibeWindow.z[i]),
+                    'turbine_vibe': float(vibeMag[i])
+                }
+                # every vibe measurement goes out for detailed analysis and ml
+                windowOutbox.append((publishTopicHiRes, encodeTurbinePayload(devicePayloadHiRes, 'hires_sample'),
+                                    priorityHiRes))
+
+        elif dataPublishHiResSendMode == 'vibe_batch' and turbineRPM > 0:
+            # same samples as 'vibe' mode but packed into columnar batches
+            hiResBatcher.add(vibeWindow, vibeMag, loopCnt)
+    else:
+        print("The turbine appears to be disconnected. Please check the connection.")
+
+    hiResBatcher.flushIfDue()
+
+    voltageStats = adcScanner.intervalStats()
+    turbineVoltage = round(voltageStats[turbineVoltageChannel]['mean'], 2)  # channel 0 of the ADC
+
+    devicePayload = {
+        'thing_name': cfgThingName,
+        'deviceID': turbineDeviceId,
+        'timestamp': str(datetime.utcnow().isoformat()),
+        'loop_cnt': loopCnt,
+        'turbine_speed': turbineRPM,
+        'turbine_speed_min': round(speedStats['min'], 2),
+        'turbine_speed_max': round(speedStats['max'], 2),
+        'turbine_speed_mean': round(speedStats['mean'], 2),
+        'turbine_rev_cnt': turbineRotationCnt // cfgRpmPulsesPerRev,
+        'turbine_voltage': turbineVoltage,
+        'turbine_voltage_min': round(voltageStats[turbineVoltageChannel]['min'], 2),
+        'turbine_voltage_max': round(voltageStats[turbineVoltageChannel]['max'], 2),
+        'turbine_vibe_x': vibeStats['turbine_vibe_x'],
+        'turbine_vibe_y': vibeStats['turbine_vibe_y'],
+        'turbine_vibe_z': vibeStats['turbine_vibe_z'],
+        'turbine_vibe_peak': vibeStats['turbine_vibe_peak'],
+        'turbine_vibe_avg': vibeStats['turbine_vibe_avg'],
+        'turbine_vibe_rms': vibeStats['turbine_vibe_rms'],
+        'turbine_vibe_crest': vibeStats['turbine_vibe_crest'],
+        'turbine_vibe_kurtosis': vibeStats['turbine_vibe_kurtosis'],
+        'turbine_sample_cnt': vibeStats['turbine_sample_cnt'],
+        'turbine_sample_rate': round(sampleRate, 1),
+        'turbine_sample_jitter_ms': round(sampleJitter, 3),
+        'turbine_sample_lost_cnt': vibeWindow.lostCnt,
+        'brake_pct': turbineBrakePosPCT
+    }
+    # waveform features: rms, ripple and power into the load
+    if voltageCapture is not None:
+        captureT, captureV, captureLost = voltageCapture.readWindow()
+        if captureLost > 0:
+            print("Voltage capture overran the buffer, " + str(captureLost) + " samples lost")
+        voltageFeatures = computeVoltageFeatures(captureT, captureV, turbineRPM, cfgLoadOhms)
+        if voltageFeatures is not None:
+            voltageFeatures['turbine_capture_lost_cnt'] = captureLost
+            devicePayload.update(voltageFeatures)
+    # mean voltage of any other ADC channels that are configured
+    otherChannels = [channel for channel in voltageStats if channel != turbineVoltageChannel]
+    if otherChannels:
+        devicePayload['adc'] = dict((str(channel), round(voltageStats[channel]['mean'], 3)) for channel in otherChannels)
+    # period spread, jitter and speed ripple of the revolutions in this interval
+    if revTiming is not None:
+        devicePayload['rev_timing'] = revTiming
+    # rotor-order band energies replace shipping raw samples for frequency analysis
+    if dataPublishSpectralMode == 'on' and len(vibeWindow) > 0:
+        spectral = computeSpectralFeatures(vibeWindow.x, vibeWindow.y, vibeWindow.z, sampleRate, turbineRPM)
+        if spectral is not None:
+            devicePayload['spectral'] = spectral
+
+    updatePowerCurve(devicePayload)
+
+    #last payload is used by the oled Display for updates when partial info exists
+    lastPayloadMsg = devicePayload
+
+    deviceMsg = (
+        'Speed:{0:.0f}-RPM '
+        'Voltage:{1:.3f} '
+        'Rotations:{2} '
+        'Peak-Vibe:{3:.3f} '
+        'Avg-Vibe:{4:.3f} '
+        'Brake-PCT:{5} '
+        'LoopCnt:{6} '
+    ).format(
+        turbineRPM,
+        turbineVoltage,
+        turbineRotationCnt,
+        devicePayload['turbine_vibe_peak'],
+        devicePayload['turbine_vibe_avg'],
+        turbineBrakePosPCT,
+        loopCnt
+    )
+    print(deviceMsg)
+    windowMessages = windowOutbox[:]
+    del windowOutbox[:]
+    return devicePayload, windowMessages
+
+
+def getTelemetryTopic():
+    # determine the desired topic to publish on
+    if dataPublishSendMode == "faster":
+        # faster method is for use with Greengrass to Kinesis
+        return "dt/windfarm/turbine/" + cfgThingName + "/faster"
+    elif dataPublishSendMode == "cheaper":
+        # cheaper method is for use with IoT Core Basic Ingest
+        # It publishes directly to the IoT Rule
+        return "$aws/rules/EnrichWithShadow"
+    return "dt/windfarm/turbine/" + cfgThingName
+
+
+def requestOledUpdate():
+    # hands the current state to the render worker; never waits on the display
+    if oledWorker is not None:
+        oledWorker.post(getOledValues())
+
+
+def runTurbineSerial():
+    loopCnt = 0
+    lastReportedSpeed = -1
+    publishTopicHiRes = "dt/windfarm/turbine/" + cfgThingName + "/hi-res"
+    windowStart = time.monotonic()
+
+    while True:
+        # the sampler thread fills the ring buffer while the buttons are polled here
+        waitForVibeWindow(windowStart)
+        windowStart = time.monotonic()
+        loopCnt += 1
+        devicePayload, windowMessages = sampleTurbineWindow(loopCnt, publishTopicHiRes)
+        if devicePayload['turbine_sample_cnt'] > 0:
+            determineTurbineSafetyState(devicePayload['turbine_vibe_peak'], vibe_limit)
+
+        try:
+            publishWindowMessages(windowMessages)
+            publishTopic = getTelemetryTopic()
+
+            # make sure at least a final message is sent when the turbine is stopped
+            lastReportedSpeed = turbineRPM
+
+            # Only publish data if the turbine is spinning
+            if turbineRPM > 0 or lastReportedSpeed != 0:
+                # publish with QOS 0
+                response = publishTurbineTelemetry(publishTopic, devicePayload)
+                requestOledUpdate()
+                ledFlash()
+            else:
+                # publish with QOS 0
+                response = publishTurbineTelemetry(publishTopic, devicePayload)
+                requestOledUpdate()
+                ledFlash()
+                print("Turbine is idle... waiting for rotation")
+                # a heartbeat frame goes out every cfgIdleHeartbeatSec until the rotation sensor wakes us
+                if idleWaiter.waitForMotion(cfgIdleHeartbeatSec, checkButtons):
+                    print("Turbine is spinning again")
+                resyncSamplers()
+
+        except:
+            logger.warning("exception while publishing")
+            raise
+
+
+async def turbineSamplerTask(runtime):
+    # same window cadence as the serial loop, but waiting never blocks the other tasks
+    loopCnt = 0
+    publishTopicHiRes = "dt/windfarm/turbine/" + cfgThingName + "/hi-res"
+    windowStart = time.monotonic()
+
+    while True:
+        # the voltage channels are scanned while waiting for the window
+        while True:
+            await runtime.runBlocking('spi', adcScanner.scan)
+            if time.monotonic() - windowStart < dataPublishInterval:
+                await asyncio.sleep(0.1)
+            elif vibeSampler.pendingCount() < cfgVibeDataSampleCnt and vibeSampler.isHealthy():
+                await asyncio.sleep(0.05)
+            else:
+                break
+        windowStart = time.monotonic()
+        loopCnt += 1
+
+        # the window is computed off the loop, everything it produced is sent by the publish task
+        devicePayload, windowMessages = await runtime.runBlocking('compute', sampleTurbineWindow, loopCnt,
+                                                                 publishTopicHiRes)
+        if devicePayload['turbine_sample_cnt'] > 0:
+            determineTurbineSafetyState(devicePayload['turbine_vibe_peak'], vibe_limit)
+        if windowMessages:
+            runtime.publish(publishWindowMessages, windowMessages)
+        runtime.publish(publishTurbineTelemetry, getTelemetryTopic(), devicePayload)
+        requestOledUpdate()
+        runtime.requestFlash()
+
+        if turbineRPM == 0:
+            print("Turbine is idle... waiting for rotation")
+            # buttons and commands have their own tasks, so the wait only watches the sensor
+            if await runtime.runBlocking('idle', idleWaiter.waitForMotion, cfgIdleHeartbeatSec):
+                print("Turbine is spinning again")
+            resyncSamplers()
+            windowStart = time.monotonic() - dataPublishInterval
+
+
+def runTurbineAsync():
+    global asyncRuntime
+    asyncRuntime = AsyncRuntime()
+    print("Running the turbine tasks on the asyncio runtime")
+    asyncRuntime.run([
+        turbineSamplerTask,
+        lambda runtime: runtime.publishTask(),
+        lambda runtime: runtime.ledTask(ledOn, lambda: ledOff(ledLastState)),
+        lambda runtime: runtime.buttonTask(readButtons, handleButtonPress),
+        lambda runtime: runtime.commandTask()
+    ])
+
+
+def main():
     print("AWS IoT Wind Energy Turbine Program")
     print("DeviceID: " + turbineDeviceId)
     print("ThingName: " + cfgThingName)
-    loopCnt = 0
-    dataSampleCnt = 0
-    lastReportedSpeed = -1
-    vibeDataList = []
 
     try:
+        initShadowCache()
         initTurbineGPIO()
         initTurbineLED()
         initOLED()
@@ -884,151 +1637,47 @@ def main():
         initTurbineBrake()
         initTurbineVibeSensor()
         calibrateTurbineVibeSensor()
+        startTurbineVibeSampler()
+        startTurbineVoltageCapture()
+        initHiResBatcher()
+        initDeadbandPublisher()
+        initStoreForward()
+        initPowerCurve()
+        initShadowReporter()
+        initCommandDispatcher()
 
-        connectTurbineIoT()
         resetTurbineBrake()
-        initShadowVariables()
+        applyCachedShadow()
+        startTurbineIoTConnect()
 
         print("Starting turbine monitoring...")
-        publishTopicHiRes = "dt/windfarm/turbine/" + cfgThingName + "/hi-res"
-
-        while True:
-            calculateTurbineSpeed()
-            loopCnt += 1
-            peakVibe = 0
-            currentVibe = 0
-            peakVibe_x = 0
-            peakVibe_y = 0
-            peakVibe_z = 0
-            avgVibe = 0
-            del vibeDataList[:]
-
-            # sampling of vibration between published messages
-            if checkTurbineVibeSensorAvailable():
-                for dataSampleCnt in range(cfgVibeDataSampleCnt, 0, -1):
-                    calculateTurbineVibe()
-                    currentVibe = math.sqrt(accelX ** 2 + accelY ** 2 + accelZ ** 2)
-
-                    # store the peak vibration value
-                    peakVibe = max(peakVibe, currentVibe)
-                    vibeDataList.append(currentVibe)
-                    peakVibe_x = max(peakVibe_x, abs(accelX))
-                    peakVibe_y = max(peakVibe_y, abs(accelY))
-                    peakVibe_z = max(peakVibe_z, abs(accelZ))
-
-                    # check for a button press events
-                    checkButtons()
-
-                    if dataPublishHiResSendMode == 'vibe' and turbineRPM > 0:
-                        devicePayloadHiRes = {
-                            'thing_name': cfgThingName,
-                            'deviceID': turbineDeviceId,
-                            'timestamp': str(datetime.utcnow().isoformat()),
-                            'loop_cnt': str(loopCnt),
-                            'turbine_vibe_x': accelX,
-                            'turbine_vibe_y': accelY,
-                            'turbine_vibe_z': accelZ,
-                            'turbine_vibe': currentVibe
-                        }
-                        # publish every vibe measurement for detailed analysis and ml
-                        response = awsIoTMQTTClient.publish(publishTopicHiRes, json.dumps(devicePayloadHiRes), 0)
-
-                if len(vibeDataList) > 0:
-                    avgVibe = sum(vibeDataList) / len(vibeDataList)
-                else:
-                    avgVibe = 0
-
-                determineTurbineSafetyState(peakVibe, vibe_limit)
-            else:
-                print("The turbine appears to be disconnected. Please check the connection.")
-
-            turbineVoltage = getTurbineVoltage(0)  # channel 0 of the ADC
-
-            devicePayload = {
-                'thing_name': cfgThingName,
-                'deviceID': turbineDeviceId,
-                'timestamp': str(datetime.utcnow().isoformat()),
-                'loop_cnt': loopCnt,
-                'turbine_speed': turbineRPM,
-                'turbine_rev_cnt': turbineRotationCnt,
-                'turbine_voltage': turbineVoltage,
-                'turbine_vibe_x': peakVibe_x,
-                'turbine_vibe_y': peakVibe_y,
-                'turbine_vibe_z': peakVibe_z,
-                'turbine_vibe_peak': peakVibe,
-                'turbine_vibe_avg': avgVibe,
-                'turbine_sample_cnt': len(vibeDataList),
-                'brake_pct': turbineBrakePosPCT
-            }
-            #last payload is used by the oled Display for updates when partial info exists
-            lastPayloadMsg = devicePayload
-
-            try:
-                deviceMsg = (
-                    'Speed:{0:.0f}-RPM '
-                    'Voltage:{1:.3f} '
-                    'Rotations:{2} '
-                    'Peak-Vibe:{3:.3f} '
-                    'Avg-Vibe:{4:.3f} '
-                    'Brake-PCT:{5} '
-                    'LoopCnt:{6} '
-                ).format(
-                    turbineRPM,
-                    turbineVoltage,
-                    turbineRotationCnt,
-                    peakVibe,
-                    avgVibe,
-                    turbineBrakePosPCT,
-                    loopCnt
-                )
-                print(deviceMsg)
-
-                # determine the desired topic to publish on
-                if dataPublishSendMode == "faster":
-                    # faster method is for use with Greengrass to Kinesis
-                    publishTopic = "dt/windfarm/turbine/" + cfgThingName + "/faster"
-                elif dataPublishSendMode == "cheaper":
-                    # cheaper method is for use with IoT Core Basic Ingest
-                    # It publishes directly to the IoT Rule
-                    publishTopic = "$aws/rules/EnrichWithShadow"
-                else:
-                    publishTopic = "dt/windfarm/turbine/" + cfgThingName
-
-                # make sure at least a final message is sent when the turbine is stopped
-                lastReportedSpeed = turbineRPM
-
-                # Only publish data if the turbine is spinning
-                if turbineRPM > 0 or lastReportedSpeed != 0:
-                    # publish with QOS 0
-                    response = awsIoTMQTTClient.publish(publishTopic, json.dumps(devicePayload), 0)
-                    updateOledDisplay()
-                    ledFlash()
-                else:
-                    # publish with QOS 0
-                    response = awsIoTMQTTClient.publish(publishTopic, json.dumps(devicePayload), 0)
-                    updateOledDisplay()
-                    ledFlash()
-                    print("Turbine is idle... sleeping for 60 seconds")
-                    # sleep a few times with a speed check to see if the turbine is spinning again
-                    for i in range(1, 12):
-                        calculateTurbineSpeed()
-                        lastReportedSpeed = turbineRPM
-                        if turbineRPM > 0:
-                            sleep(5)  # need to do this to allow elapse time to grow for a realistic calculation on the next call
-                            break
-                        sleep(5)  # slow down the publishing rate
-                        checkButtons()
-
-            except:
-                logger.warning("exception while publishing")
-                raise
+        if cfgRuntime == "asyncio":
+            runTurbineAsync()
+        else:
+            runTurbineSerial()
 
     except (KeyboardInterrupt, SystemExit):  # when you press ctrl+c
         print("Disconnecting AWS IoT")
+        idleWaiter.cancel()
         ledOff()
+        if commandDispatcher is not None:
+            commandDispatcher.stop()
+        brakeController.stop()
         turbineBrakeAction("OFF")
+        # let the release finish before the GPIO pins go away
+        brakeActuator.waitIdle(3)
+        brakeActuator.stop()
         clearOledDisplay()
         GPIO.cleanup()
+        if powerCurveEngine is not None and powerCurveEngine.dirty:
+            powerCurveEngine.checkpoint()
+        if storeForwardQueue is not None:
+            storeForwardDrainer.stop()
+            storeForwardQueue.close()
+        if shadowReporter is not None:
+            # get the final brake state out before disconnecting
+            shadowReporter.flush(3)
+            shadowReporter.stop()
         if not awsShadowClient == None:
             try:
                 awsShadowClient.disconnect()
@@ -1043,12 +1692,12 @@ if __name__ == "__main__":
     # Usage
     usageInfo = """Usage:
 
-    python turbine.py -config <config json file>
+    python turbine.py --config <config json file> [--runtime serial|asyncio]
     """
 
     # Read in command-line parameters
     try:
-        opts, args = getopt.getopt(sys.argv[1:], "", ["config="])
+        opts, args = getopt.getopt(sys.argv[1:], "", ["config=", "runtime="])
         if len(opts) == 0:
             raise getopt.GetoptError("No input parameters!")
         for opt, arg in opts:
@@ -1071,9 +1720,50 @@ if __name__ == "__main__":
                     cfgTimeoutSec = myConfig['runtime']['connection']['timeoutSec']
                     cfgRetryLimit = myConfig['runtime']['connection']['retryLimit']
                     cfgUseGreengrass = myConfig['runtime']['connection']['useGreengrass']
+                    cfgGgProbeDeadlineSec = myConfig['runtime']['connection'].get('probeDeadlineSec', cfgGgProbeDeadlineSec)
+                    cfgGgProbeStaggerSec = myConfig['runtime']['connection'].get('probeStaggerSec', cfgGgProbeStaggerSec)
+                    cfgGgFallbackTimeoutSec = myConfig['runtime']['connection'].get('fallbackTimeoutSec', cfgGgFallbackTimeoutSec)
                     cfgBrakeOnPosition = myConfig['settings']['brakeServo']['onPosition']
                     cfgBrakeOffPosition = myConfig['settings']['brakeServo']['offPosition']
+                    cfgBrakeControl.update(myConfig['settings'].get('brakeControl', {}))
                     cfgVibeDataSampleCnt = myConfig['settings']['vibration']['dataSampleCnt']
+                    cfgVibeSampleRateHz = myConfig['settings']['vibration'].get('sampleRateHz', cfgVibeSampleRateHz)
+                    cfgVibeAcquisitionMode = myConfig['settings']['vibration'].get('acquisitionMode', cfgVibeAcquisitionMode)
+                    shadowConfig = myConfig['settings'].get('shadow', {})
+                    cfgShadowFlushSec = shadowConfig.get('flushSec', cfgShadowFlushSec)
+                    cfgShadowMaxBackoffSec = shadowConfig.get('maxBackoffSec', cfgShadowMaxBackoffSec)
+                    cfgShadowCachePath = shadowConfig.get('cachePath', cfgShadowCachePath)
+                    commandConfig = myConfig['settings'].get('commands', {})
+                    cfgCommandQueueSize = commandConfig.get('queueSize', cfgCommandQueueSize)
+                    cfgCommandTimeoutSec = commandConfig.get('timeoutSec', cfgCommandTimeoutSec)
+                    rpmConfig = myConfig['settings'].get('rpmSensor', {})
+                    cfgRpmPulsesPerRev = rpmConfig.get('pulsesPerRev', cfgRpmPulsesPerRev)
+                    cfgRpmWindowSec = rpmConfig.get('windowSec', cfgRpmWindowSec)
+                    cfgRpmStallSec = rpmConfig.get('stallSec', cfgRpmStallSec)
+                    cfgIdleHeartbeatSec = myConfig['settings'].get('idleHeartbeatSec', cfgIdleHeartbeatSec)
+                    oledConfig = myConfig['settings'].get('oled', {})
+                    cfgOledMaxFps = oledConfig.get('maxFps', cfgOledMaxFps)
+                    cfgIpRefreshSec = oledConfig.get('ipRefreshSec', cfgIpRefreshSec)
+                    adcConfig = myConfig['settings'].get('adc', {})
+                    cfgAdcChannels = adcConfig.get('channels', cfgAdcChannels)
+                    cfgAdcOversample = adcConfig.get('oversample', cfgAdcOversample)
+                    cfgAdcMode = adcConfig.get('mode', cfgAdcMode)
+                    cfgAdcSpiBus = adcConfig.get('spiBus', cfgAdcSpiBus)
+                    cfgAdcSpiDevice = adcConfig.get('spiDevice', cfgAdcSpiDevice)
+                    cfgAdcSpiSpeedHz = adcConfig.get('spiSpeedHz', cfgAdcSpiSpeedHz)
+                    captureConfig = myConfig['settings'].get('voltageCapture', {})
+                    cfgVoltageCaptureRateHz = captureConfig.get('sampleRateHz', cfgVoltageCaptureRateHz)
+                    cfgVoltageScale = captureConfig.get('voltageScale', cfgVoltageScale)
+                    cfgLoadOhms = captureConfig.get('loadOhms', cfgLoadOhms)
+                    cfgPowerCurve.update(myConfig['settings'].get('powerCurve', {}))
+                    storeForwardConfig = myConfig['runtime'].get('storeForward', {})
+                    cfgStoreForwardPath = storeForwardConfig.get('path', cfgStoreForwardPath)
+                    cfgStoreForwardMaxMB = storeForwardConfig.get('maxMB', cfgStoreForwardMaxMB)
+                    cfgStoreForwardDrainRate = storeForwardConfig.get('drainRate', cfgStoreForwardDrainRate)
+            elif opt in ("--runtime"):
+                if arg not in ("serial", "asyncio"):
+                    raise getopt.GetoptError("Unknown runtime: " + arg)
+                cfgRuntime = arg
 
     except getopt.GetoptError:
         print(usageInfo)
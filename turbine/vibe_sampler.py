@@ -0,0 +1,135 @@
+# Copyright 2018. Amazon Web Services, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import time
+import numpy as np
+from sample_ring import RingSampler
+
+# Fixed-rate vibration sampler.
+# A dedicated thread reads the accelerometer on a deadline schedule and writes
+# timestamped samples into the shared sample ring (sample_ring.py). The publish loop
+# pulls the samples collected since its last read as one window, with the samples
+# it lost to an overrun counted. Samples written while the publish loop is
+# deliberately idle are skipped with discard() rather than read late or reported as
+# lost. When a block source (the MPU6050 FIFO) is given, the sensor paces the
+# samples and the thread drains whole blocks, falling back to per-sample reads if it
+# fails.
+
+
+class VibeWindow(object):
+    def __init__(self, t, x, y, z, lostCnt=0):
+        self.t = t
+        self.x = x
+        self.y = y
+        self.z = z
+        self.lostCnt = lostCnt
+
+    def __len__(self):
+        return len(self.t)
+
+    def sampleRate(self):
+        # achieved rate over the window, not the configured one
+        if len(self.t) < 2 or self.t[-1] <= self.t[0]:
+            return 0
+        return (len(self.t) - 1) / (self.t[-1] - self.t[0])
+
+    def jitterMs(self):
+        # standard deviation of the sample-to-sample interval
+        if len(self.t) < 3:
+            return 0
+        return float(np.std(np.diff(self.t))) * 1000
+
+
+class VibeSampler(RingSampler):
+    # how long to stay on per-sample reads after the block source fails
+    blockRetrySec = 30
+
+    def __init__(self, readFunc, sampleRateHz=200, capacity=None, blockSource=None):
+        # readFunc returns a calibrated (x, y, z) tuple or raises on a bus error
+        RingSampler.__init__(self, "VibeSampler", readFunc, sampleRateHz, capacity, 3)
+
+        # optional block source with start(), drain() and samplePeriod, see mpu6050_fifo
+        self.blockSource = blockSource
+        self.blockMode = False
+        self.blockRetryAt = 0
+        self.blockFallbackCnt = 0
+        self.lastBlockT = None
+        if blockSource is not None:
+            # drain well before the 1024 byte FIFO (170 samples) can fill up
+            self.blockPollSec = max(170 * blockSource.samplePeriod / 4, 0.01)
+
+    def run(self):
+        self.running = True
+        nextDeadline = time.monotonic()
+        while self.running:
+            if self.blockSource is not None and not self.blockMode and time.monotonic() >= self.blockRetryAt:
+                self.startBlockSource()
+
+            if self.blockMode:
+                self.readBlock()
+                time.sleep(self.blockPollSec)
+                nextDeadline = time.monotonic()
+                continue
+
+            self.sampleOnce()
+            nextDeadline = self.waitForDeadline(nextDeadline)
+
+    def startBlockSource(self):
+        try:
+            self.blockSource.start()
+            self.blockMode = True
+            self.lastBlockT = None
+        except Exception as e:
+            print("Vibration block source unavailable, using per-sample reads: " + str(e))
+            self.blockFallback()
+
+    def blockFallback(self):
+        self.blockMode = False
+        self.blockFallbackCnt += 1
+        self.blockRetryAt = time.monotonic() + self.blockRetrySec
+
+    def readBlock(self):
+        try:
+            x, y, z = self.blockSource.drain()
+        except Exception as e:
+            # overflow or bus error, poll per sample for a while before trying again
+            print("Vibration block read failed, using per-sample reads: " + str(e))
+            self.blockFallback()
+            return
+
+        n = len(x)
+        if n == 0:
+            return
+        now = time.monotonic()
+        period = self.blockSource.samplePeriod
+
+        # timestamps follow the sensor's output data rate; continue the previous block's
+        # timeline unless it has drifted away from the host clock
+        first = now - (n - 1) * period
+        if self.lastBlockT is not None:
+            continued = self.lastBlockT + period
+            if abs(continued - first) < max(5 * period, 0.01):
+                first = continued
+        t = first + np.arange(n) * period
+        self.lastBlockT = t[-1]
+        self.writeBlock(t, x, y, z)
+        self.lastGoodRead = now
+
+    def writeBlock(self, t, x, y, z):
+        self.ring.writeBlock(t, (x, y, z))
+
+    def readWindow(self):
+        # return every sample written since the previous call as a VibeWindow
+        t, (x, y, z), lostCnt = self.ring.read()
+        return VibeWindow(t, x, y, z, lostCnt)
@@ -0,0 +1,91 @@
+# Copyright 2018. Amazon Web Services, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+
+# Edge spectral features for one vibration window.
+# Energy near 1x the rotor frequency points to imbalance, 2x and 3x to misalignment
+# and looseness, so only those bands plus a few shape features leave the device.
+
+# fewer samples than this give a frequency resolution too coarse to separate the orders
+minSpectralSamples = 64
+rotorOrders = (1, 2, 3)
+
+# cache the taper per window length, the window size rarely changes between publishes
+hannCache = {}
+
+
+def getHannWindow(sampleCnt):
+    window = hannCache.get(sampleCnt)
+    if window is None:
+        window = np.hanning(sampleCnt).astype(np.float32)
+        hannCache.clear()
+        hannCache[sampleCnt] = window
+    return window
+
+
+def computeSpectralFeatures(x, y, z, sampleRateHz, rpm):
+    # returns the compact 'spectral' payload block, or None when the window is too short
+    sampleCnt = len(x)
+    if sampleCnt < minSpectralSamples or sampleRateHz <= 0:
+        return None
+
+    # remove the static offset (gravity, calibration drift) so it does not swamp bin 0
+    axes = np.vstack((x, y, z)).astype(np.float32)
+    axes -= axes.mean(axis=1, keepdims=True)
+    window = getHannWindow(sampleCnt)
+    spectrum = np.fft.rfft(axes * window, axis=1)
+
+    # one-sided power per bin scaled so the bins of an axis sum to its mean square
+    power = (spectrum.real ** 2 + spectrum.imag ** 2) * (2.0 / (sampleCnt * float(np.sum(window * window))))
+    power[:, 0] = 0
+    freqs = np.fft.rfftfreq(sampleCnt, 1.0 / sampleRateHz)
+    resolution = freqs[1]
+    nyquist = sampleRateHz / 2.0
+
+    # an axis with no vibration at all reports 0 rather than a rounding-noise peak
+    axisPower = power.sum(axis=1)
+    hasPower = axisPower > 1e-9
+    dominant = np.where(hasPower, freqs[np.argmax(power, axis=1)], 0)
+    centroid = np.where(hasPower, power.dot(freqs) / np.where(hasPower, axisPower, 1), 0)
+
+    # rotor order band energies, summed over the three axes
+    totalPower = power.sum(axis=0)
+    totalEnergy = float(totalPower.sum())
+    rotorHz = rpm / 60.0 if rpm > 0 else 0
+    orderEnergy = []
+    orderRatio = []
+    for order in rotorOrders:
+        centerHz = order * rotorHz
+        if rotorHz == 0 or centerHz >= nyquist:
+            orderEnergy.append(0)
+            orderRatio.append(0)
+            continue
+        # wide enough to catch the Hann main lobe and a few percent of speed drift
+        halfWidth = max(2 * resolution, 0.05 * centerHz)
+        band = (freqs >= centerHz - halfWidth) & (freqs <= centerHz + halfWidth)
+        energy = float(totalPower[band].sum())
+        orderEnergy.append(round(energy, 6))
+        orderRatio.append(round(energy / totalEnergy, 4) if totalEnergy > 0 else 0)
+
+    return {
+        'fs': round(sampleRateHz, 1),
+        'res_hz': round(float(resolution), 3),
+        'rot_hz': round(rotorHz, 3),
+        'order_energy': orderEnergy,
+        'order_ratio': orderRatio,
+        'dom_hz': [round(float(f), 2) for f in dominant],
+        'centroid_hz': [round(float(f), 2) for f in centroid],
+        'energy': round(totalEnergy, 6)
+    }
@@ -0,0 +1,115 @@
+# Copyright 2018. Amazon Web Services, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import math
+import numpy as np
+
+# Statistics over one window of X/Y/Z vibration samples.
+# The field names match the turbine telemetry payload. numpy's per-call overhead
+# dominates short windows, so below loopMaxSamples the statistics are computed with
+# a plain loop over Python floats; tests/bench_vibe_stats.py measures the crossover
+# (around 100 samples when the magnitude is passed in, as turbine.py does).
+
+loopMaxSamples = 64
+
+emptyVibeStats = {
+    'turbine_vibe_x': 0,
+    'turbine_vibe_y': 0,
+    'turbine_vibe_z': 0,
+    'turbine_vibe_peak': 0,
+    'turbine_vibe_avg': 0,
+    'turbine_vibe_rms': 0,
+    'turbine_vibe_crest': 0,
+    'turbine_vibe_kurtosis': 0,
+    'turbine_sample_cnt': 0
+}
+
+
+def vibeMagnitude(x, y, z):
+    return np.sqrt(x * x + y * y + z * z)
+
+
+def computeVibeStats(x, y, z, magnitude=None):
+    # x, y and z are equal length float32 arrays; returns a dict of plain floats
+    sampleCnt = len(x)
+    if sampleCnt == 0:
+        return dict(emptyVibeStats)
+    if sampleCnt < loopMaxSamples:
+        return loopVibeStats(x, y, z, magnitude)
+    return numpyVibeStats(x, y, z, magnitude)
+
+
+def numpyVibeStats(x, y, z, magnitude=None):
+    sampleCnt = len(x)
+    if magnitude is None:
+        magnitude = vibeMagnitude(x, y, z)
+
+    # accumulate in float64 so long windows do not lose precision
+    mean = float(np.mean(magnitude, dtype=np.float64))
+    meanSq = float(np.mean(magnitude * magnitude, dtype=np.float64))
+    peak = float(np.max(magnitude))
+    rms = np.sqrt(meanSq)
+
+    centered = magnitude - mean
+    centeredSq = centered * centered
+    var = float(np.mean(centeredSq, dtype=np.float64))
+    if var > 0:
+        kurtosis = float(np.mean(centeredSq * centeredSq, dtype=np.float64)) / (var * var)
+    else:
+        kurtosis = 0
+
+    return {
+        'turbine_vibe_x': float(np.max(np.abs(x))),
+        'turbine_vibe_y': float(np.max(np.abs(y))),
+        'turbine_vibe_z': float(np.max(np.abs(z))),
+        'turbine_vibe_peak': peak,
+        'turbine_vibe_avg': mean,
+        'turbine_vibe_rms': float(rms),
+        'turbine_vibe_crest': peak / rms if rms > 0 else 0,
+        'turbine_vibe_kurtosis': kurtosis,
+        'turbine_sample_cnt': sampleCnt
+    }
+
+
+def loopVibeStats(x, y, z, magnitude=None):
+    xs = x.tolist()
+    ys = y.tolist()
+    zs = z.tolist()
+    if magnitude is None:
+        mags = [math.sqrt(a * a + b * b + c * c) for a, b, c in zip(xs, ys, zs)]
+    else:
+        mags = magnitude.tolist()
+    sampleCnt = len(mags)
+
+    mean = sum(mags) / sampleCnt
+    peak = max(mags)
+    rms = math.sqrt(sum(m * m for m in mags) / sampleCnt)
+    centeredSq = [(m - mean) * (m - mean) for m in mags]
+    var = sum(centeredSq) / sampleCnt
+    if var > 0:
+        kurtosis = sum(c * c for c in centeredSq) / sampleCnt / (var * var)
+    else:
+        kurtosis = 0
+
+    return {
+        'turbine_vibe_x': max(abs(v) for v in xs),
+        'turbine_vibe_y': max(abs(v) for v in ys),
+        'turbine_vibe_z': max(abs(v) for v in zs),
+        'turbine_vibe_peak': peak,
+        'turbine_vibe_avg': mean,
+        'turbine_vibe_rms': rms,
+        'turbine_vibe_crest': peak / rms if rms > 0 else 0,
+        'turbine_vibe_kurtosis': kurtosis,
+        'turbine_sample_cnt': sampleCnt
+    }
@@ -0,0 +1,80 @@
+# Copyright 2018. Amazon Web Services, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+from sample_ring import RingSampler
+
+# Generator voltage waveform capture.
+# A dedicated thread reads one ADC channel at a kHz rate on a deadline schedule into
+# the shared sample ring (sample_ring.py), the same as the vibration sampler, so
+# samples lost to an overrun are counted and an idle wait is skipped with discard().
+# Per publish interval the waveform gives the RMS voltage, the peak-to-peak ripple,
+# the ripple frequency and the power into the load resistance. The ripple frequency
+# comes from mean-crossings with hysteresis using the real sample times, so
+# scheduling jitter doesn't bias it; divided by the rotation rate it gives the ripple
+# cycles per revolution, which stays constant for a healthy generator. The longest
+# gap between samples is reported too, since a stall longer than half a ripple cycle
+# can hide a crossing.
+
+
+class VoltageCapture(RingSampler):
+    def __init__(self, readFunc, sampleRateHz=1000, capacity=None):
+        # readFunc returns one voltage reading or raises on a bus error
+        RingSampler.__init__(self, "VoltageCapture", lambda: (readFunc(),), sampleRateHz, capacity, 1)
+
+    def readWindow(self):
+        # (t, v, lostCnt) for every sample written since the previous call
+        t, (v,), lostCnt = self.ring.read()
+        return t, v.astype(np.float64), lostCnt
+
+
+def rippleFrequency(t, v, hysteresisFraction=0.1):
+    # full cycles per second from crossings of the mean with a hysteresis band
+    if len(v) < 8:
+        return 0.0
+    centered = v - np.mean(v)
+    band = hysteresisFraction * np.std(centered)
+    if band <= 0:
+        return 0.0
+    # +1 above the band, -1 below, 0 inside; carry the last state through the band
+    state = np.where(centered > band, 1, np.where(centered < -band, -1, 0))
+    nonzero = np.flatnonzero(state)
+    if len(nonzero) < 2:
+        return 0.0
+    states = state[nonzero]
+    flips = np.flatnonzero(np.diff(states) > 0)
+    if len(flips) < 2:
+        return 0.0
+    # time between the first and last upward crossing covers a whole number of cycles
+    rising = t[nonzero[flips + 1]]
+    return float((len(rising) - 1) / (rising[-1] - rising[0]))
+
+
+def computeVoltageFeatures(t, v, rpm, loadOhms):
+    # None when the interval has too few samples to say anything
+    if len(v) < 8:
+        return None
+    meanSquare = float(np.mean(np.square(v)))
+    rippleHz = rippleFrequency(t, v)
+    features = {
+        'turbine_vrms': round(float(np.sqrt(meanSquare)), 3),
+        'turbine_vpp': round(float(np.max(v) - np.min(v)), 3),
+        'turbine_ripple_hz': round(rippleHz, 2),
+        'turbine_power_w': round(meanSquare / loadOhms, 4) if loadOhms > 0 else 0,
+        'turbine_capture_rate': round(float((len(t) - 1) / (t[-1] - t[0])), 1) if t[-1] > t[0] else 0,
+        'turbine_capture_gap_ms': round(float(np.max(np.diff(t))) * 1000, 2)
+    }
+    if rpm > 0 and rippleHz > 0:
+        features['turbine_ripple_per_rev'] = round(rippleHz / (rpm / 60.0), 2)
+    return features
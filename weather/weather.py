@@ -23,6 +23,7 @@ import json
 import uuid
 import socket
 import getopt, sys
+import threading
 from random import randint
 from AWSIoTPythonSDK.MQTTLib import AWSIoTMQTTClient
 from AWSIoTPythonSDK.MQTTLib import AWSIoTMQTTShadowClient
@@ -30,6 +31,12 @@ import math
 from requests import get
 from distutils.util import strtobool
 
+# modules shared with the turbine program live in common/ at the top of the repo
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.payload_codec import encodePayload, selectEncoding
+from common.store_forward import StoreForwardQueue, StoreForwardDrainer
+from common.idle_wait import IdleWaiter
+
 #configurable settings from the config.json file
 configFile = None
 myConfig = {}
@@ -45,6 +52,10 @@ cfgTimeoutSec = 10
 cfgRetryLimit = 3
 cfgUseGreengrass = "no"
 cfgLocation = ""
+cfgStoreForwardPath = ""
+cfgStoreForwardMaxMB = 20
+cfgStoreForwardDrainRate = 20
+cfgIdleHeartbeatSec = 60
 
 #determine a unique deviceID for this Raspberry PI to be used in the IoT message
 # getnode() - Gets the hardware address as a 48-bit positive integer
@@ -59,6 +70,12 @@ awsShadowClient = None
 weatherDeviceShadow = None
 dataPublishSendMode = "normal"
 dataPublishInterval = 5
+dataPublishEncoding = "json"
+
+#publishes made while offline are kept on disk and replayed once the connection is back
+iotOnline = threading.Event()
+storeForwardQueue = None
+storeForwardDrainer = None
 
 #Annemometer rotation speed sensor
 wind_speed_sensor_pin = 22 #pin 15
@@ -69,6 +86,9 @@ start_timer = time.time()
 weatherRotationCnt = 0
 weatherSpeedElapse = 0
 
+#the annemometer interrupt wakes the main loop from idle
+idleWaiter = IdleWaiter()
+
 #RGB LED GPIO pins
 ledRedPin   = 5
 ledGreenPin = 6
@@ -132,10 +152,12 @@ def connectIoTAttempt(ep, port, rootca, key, cert, timeoutSec, retryLimit):
 
     # AWSIoTMQTTClient connection configuration
     awsIoTMQTTClient.configureAutoReconnectBackoffTime(1, 32, 20)
-    awsIoTMQTTClient.configureOfflinePublishQueueing(-1)  # Infinite offline Publish queueing
+    awsIoTMQTTClient.configureOfflinePublishQueueing(0)  # Offline publishes go to the store-and-forward queue
     awsIoTMQTTClient.configureDrainingFrequency(2)  # Draining: 2 Hz
     awsIoTMQTTClient.configureConnectDisconnectTimeout(timeoutSec)
     awsIoTMQTTClient.configureMQTTOperationTimeout(timeoutSec)
+    awsIoTMQTTClient.onOnline = awsIoTClientOnConnectCallback
+    awsIoTMQTTClient.onOffline = awsIoTClientOnDisconnectCallback
 
     #Attempt to connect
     for attempt in range(0, retryLimit):
@@ -172,6 +194,35 @@ def connectIoTAttempt(ep, port, rootca, key, cert, timeoutSec, retryLimit):
 
     return True
 
+#the aws iot sdk provides callbacks for connect and disconnect events
+def awsIoTClientOnConnectCallback():
+    iotOnline.set()
+    print ("IoT connection state: Connected")
+
+def awsIoTClientOnDisconnectCallback():
+    iotOnline.clear()
+    print ("IoT connection state: Disconnected")
+
+def initStoreForward():
+    global storeForwardQueue, storeForwardDrainer
+    dbPath = os.path.join(cfgStoreForwardPath or cfgCertsPath, 'weather-queue.db')
+    storeForwardQueue = StoreForwardQueue(dbPath, cfgStoreForwardMaxMB * 1024 * 1024)
+    storeForwardDrainer = StoreForwardDrainer(storeForwardQueue, lambda topic, payload, qos: awsIoTMQTTClient.publish(topic, payload, qos),
+                                              iotOnline, cfgStoreForwardDrainRate)
+    storeForwardDrainer.start()
+    print ("Store-and-forward queue: " + dbPath + " (" + str(storeForwardQueue.count()) + " messages pending)")
+
+def publishWeatherMessage(topic, payload):
+    #publish directly while online, otherwise keep the message for the drainer to replay
+    if iotOnline.is_set():
+        try:
+            if awsIoTMQTTClient.publish(topic, payload, 0):
+                return True
+        except Exception as e:
+            logger.warning("publish failed, queueing message: " + str(e))
+    storeForwardQueue.put(topic, payload, 0)
+    return False
+
 def connectIoT():
     ca = cfgCertsPath + '/' + cfgCaPath
     key = cfgCertsPath + '/' + cfgKeyPath
@@ -274,6 +325,7 @@ def windSpeedSensorCallback(channel):
   weatherRotationCnt+=1                                # increase weatherRotationCnt by 1 whenever interrupt occurred
   weatherSpeedElapse = time.time() - start_timer      # weatherSpeedElapse for every 1 complete rotation made!
   start_timer = time.time()               # let current time equals to start_timer
+  idleWaiter.notify()
   #calculate_wind_speed()
 
 def getIp():
@@ -316,13 +368,16 @@ def processShadowChange(param,value,type):
     return value
 
 def shadowCallbackDelta(payload, responseStatus, token):
+    global dataPublishEncoding
     print ("delta shadow callback >> " + payload)
 
     if responseStatus == "delta/" + cfgThingName:
         payloadDict = json.loads(payload)
         print ("shadow delta >> " + payload)
         try:
-            Pass
+            if "payload_encoding" in payloadDict["state"]:
+                dataPublishEncoding = payloadDict["state"]["payload_encoding"]
+                processShadowChange("payload_encoding", dataPublishEncoding, "reported")
         except:
             print ("delta cb error")
 
@@ -408,13 +463,18 @@ def main():
         initLED()
         initWindSpeedSensor()
         initButtons()
+        initStoreForward()
         connectIoT()
 
         print("Starting weather station monitoring...")
 
+        wokeFromIdle = False
         while True:
             loopCnt += 1
-            sleep(5)
+            #the wake pulses already give a valid speed, report it right away
+            if not wokeFromIdle:
+                sleep(5)
+            wokeFromIdle = False
             #check for a button press events
             checkButtons()
             calculate_wind_speed()
@@ -424,8 +484,8 @@ def main():
                 'deviceID' : weatherDeviceId,
                 'location': cfgLocation,
                 'timestamp' : str(datetime.utcnow().isoformat()),
-                'loop_cnt' : str(loopCnt),
-                'wind_speed' : str(round(windSpeedMPH,2))
+                'loop_cnt' : loopCnt,
+                'wind_speed' : round(windSpeedMPH,2)
                 }
 
             try:
@@ -451,22 +511,17 @@ def main():
                 #Only publish data if the annemometer is spinning
                 if windSpeedMPH > 0 or lastReportedSpeed != 0:
                     #publish with QOS 0
-                    response = awsIoTMQTTClient.publish(publishTopic, json.dumps(devicePayload), 0)
+                    response = publishWeatherMessage(publishTopic, encodePayload(devicePayload, 'weather', selectEncoding(dataPublishEncoding, 'weather')))
                     ledFlash()
                 else:
                     #publish with QOS 0
-                    response = awsIoTMQTTClient.publish(publishTopic, json.dumps(devicePayload), 0)
+                    response = publishWeatherMessage(publishTopic, encodePayload(devicePayload, 'weather', selectEncoding(dataPublishEncoding, 'weather')))
                     ledFlash()
-                    print("Wind speed is 0... sleeping for 60 seconds")
-                    #sleep a few times with a speed check to see if the annemometer is spinning again
-
-                    for i in range(1,12):
-                        calculate_wind_speed()
-                        lastReportedSpeed = windSpeedMPH
-                        if windSpeedMPH > 0:
-                            sleep(5)  #need to do this to allow weatherSpeedElapse time to grow for a realistic calculation on the next call
-                            break
-                        sleep(5)  #slow down the publishing rate
+                    print("Wind speed is 0... waiting for the annemometer")
+                    #a heartbeat frame goes out every cfgIdleHeartbeatSec until the annemometer wakes us
+                    if idleWaiter.waitForMotion(cfgIdleHeartbeatSec, checkButtons):
+                        print("Annemometer is spinning again")
+                        wokeFromIdle = True
 
             except:
                 logger.warning("exception while publishing")
@@ -474,7 +529,11 @@ def main():
 
     except (KeyboardInterrupt, SystemExit): #when you press ctrl+c
         print("Disconnecting AWS IoT")
+        idleWaiter.cancel()
         ledOff()
+        if storeForwardQueue is not None:
+            storeForwardDrainer.stop()
+            storeForwardQueue.close()
         if not awsShadowClient == None:
             awsShadowClient.disconnect()
         sleep(2)
@@ -514,6 +573,11 @@ if __name__ == "__main__":
                     cfgRetryLimit = myConfig['runtime']['connection']['retryLimit']
                     cfgUseGreengrass = myConfig['runtime']['connection']['useGreengrass']
                     cfgLocation = myConfig['settings']['location']
+                    cfgIdleHeartbeatSec = myConfig['settings'].get('idleHeartbeatSec', cfgIdleHeartbeatSec)
+                    storeForwardConfig = myConfig['runtime'].get('storeForward', {})
+                    cfgStoreForwardPath = storeForwardConfig.get('path', cfgStoreForwardPath)
+                    cfgStoreForwardMaxMB = storeForwardConfig.get('maxMB', cfgStoreForwardMaxMB)
+                    cfgStoreForwardDrainRate = storeForwardConfig.get('drainRate', cfgStoreForwardDrainRate)
 
     except getopt.GetoptError:
             print(usageInfo)